@@ -0,0 +1,162 @@
+# arrival_scheduler.py - Open-model arrival-rate scheduling
+#
+# With wait_time = between(...) each user waits for its previous task to finish, so
+# when the server slows down the offered load drops with it and queueing collapse
+# stays hidden (coordinated omission at the workload level). In the open model
+# (ARRIVAL_MODEL=poisson or constant) task starts follow a per-worker schedule at
+# the target arrival rate instead. Users are just the concurrency pool: a free
+# user claims the next arrival and sleeps until it is due. If every user is busy,
+# arrivals queue up and are started late, but none are skipped.
+#
+# Every claimed arrival is reported as "OPEN_MODEL <smtp|imap>.schedule_lag":
+# the response time is how late the task started (0 when on time) and the
+# response length is the backlog of overdue arrivals at that moment, so Locust's
+# "Average size" column shows the mean backlog.
+#
+# The rate is split evenly across workers and follows MailTrafficShape's level
+# when a load shape is active (see load_shapes.py), or the multiple chosen by
+# CapacitySearchShape (see capacity_search.py).
+#
+import time
+import random
+import logging
+import weakref
+import threading
+
+import gevent
+from locust import events
+
+from config import EmailServerConfig
+from load_shapes import option, shape_settings, shape_level
+from user_manager import worker_position
+
+logger = logging.getLogger(__name__)
+
+RATE_OPTIONS = {
+    "smtp": ("smtp_arrival_rate", EmailServerConfig.SMTP_ARRIVAL_RATE),
+    "imap": ("imap_arrival_rate", EmailServerConfig.IMAP_ARRIVAL_RATE),
+}
+
+
+class ArrivalScheduler:
+    """Per-worker sequence of task start times at a (possibly time-varying) rate"""
+
+    def __init__(self, rate_at, process="poisson", rng=None):
+        self.rate_at = rate_at  # seconds since the first arrival -> arrivals per second
+        self.process = process
+        self.rng = rng or random.Random()
+        self.started = None
+        self._next = None
+        self._lock = threading.Lock()
+
+    def _advance(self, scheduled):
+        """Time of the arrival after the one at scheduled"""
+        for _ in range(3600):
+            rate = self.rate_at(scheduled - self.started)
+            if rate > 0:
+                gap = self.rng.expovariate(rate) if self.process == "poisson" else 1.0 / rate
+                return scheduled + gap
+            scheduled += 1.0  # no traffic right now; look again a second later
+        return scheduled
+
+    def claim(self, now=None):
+        """Take the next arrival; returns (scheduled time, overdue arrivals left behind)"""
+        now = now or time.time()
+        with self._lock:
+            if self._next is None:
+                self.started = self._next = now
+            scheduled = self._next
+            self._next = self._advance(scheduled)
+            backlog = 0
+            if self._next < now:
+                backlog = int((now - self._next) * max(self.rate_at(now - self.started), 0)) + 1
+        return scheduled, backlog
+
+
+# How late the current task of each user greenlet started (see current_task_lag)
+_task_lags = weakref.WeakKeyDictionary()
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+# Multiple of the configured rates set by the capacity search; overrides the shape level
+_rate_scale = None
+
+
+def set_rate_scale(scale):
+    """Scale every arrival rate by scale from now on (None to follow the load shape again)"""
+    global _rate_scale
+    with _schedulers_lock:
+        _rate_scale = scale
+        # Start a fresh schedule so a backlog from an overloaded step does not carry over
+        _schedulers.clear()
+
+
+@events.test_start.add_listener
+def _reset_schedulers(**kwargs):
+    """Start every run (including restarts from the web UI) with a fresh schedule"""
+    with _schedulers_lock:
+        _schedulers.clear()
+
+
+def get_arrival_scheduler(environment, key, process):
+    """Return this worker's scheduler for a user class key ("smtp" or "imap")"""
+    scheduler = _schedulers.get(key)
+    if scheduler is not None:
+        return scheduler
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            rate_option, default_rate = RATE_OPTIONS[key]
+            _, worker_count = worker_position(environment)
+            worker_rate = option(environment, rate_option, default_rate) / worker_count
+
+            def rate_at(elapsed):
+                if _rate_scale is not None:
+                    return worker_rate * _rate_scale
+                settings = shape_settings(environment)
+                if not settings.profile:
+                    return worker_rate
+                level = shape_level(settings, elapsed)
+                return worker_rate * (level or 0.0)
+
+            seed = EmailServerConfig.LOADTEST_SEED
+            rng = random.Random(f"{seed}:arrivals:{key}") if seed is not None else None
+            scheduler = ArrivalScheduler(rate_at, process, rng)
+            _schedulers[key] = scheduler
+            logger.info(f"Open model: {key} at {worker_rate:.2f}/s per worker ({process})")
+    return scheduler
+
+
+def _arrival_model(environment):
+    return option(environment, "arrival_model", EmailServerConfig.ARRIVAL_MODEL)
+
+
+def arrival_wait_time(key, closed_wait_time):
+    """wait_time for a user class: closed_wait_time, or the open-model schedule when enabled"""
+    def wait_time(user):
+        environment = user.environment
+        model = _arrival_model(environment)
+        if model == "closed":
+            return closed_wait_time(user)
+        scheduled, backlog = get_arrival_scheduler(environment, key, model).claim()
+        lag = time.time() - scheduled
+        _task_lags[gevent.getcurrent()] = max(lag, 0.0)
+        environment.events.request.fire(
+            request_type="OPEN_MODEL",
+            name=f"{key}.schedule_lag",
+            response_time=max(lag, 0.0) * 1000,
+            response_length=backlog,
+            exception=None
+        )
+        return max(0.0, -lag)
+    return wait_time
+
+
+def wait_for_first_arrival(user):
+    """In the open model, hold a new user's first task until its arrival is due"""
+    if _arrival_model(user.environment) != "closed":
+        user.wait()
+
+
+def current_task_lag():
+    """Seconds the calling user's current open-model task started after its scheduled time"""
+    return _task_lags.get(gevent.getcurrent(), 0.0)
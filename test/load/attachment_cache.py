@@ -0,0 +1,106 @@
+# attachment_cache.py - Encode-once attachment payload cache
+#
+# Each attachment from TestDataGenerator._get_attachments() is base64-encoded once
+# into a sidecar file (76-character CRLF lines, ready to go on the wire) and then
+# memory-mapped read-only. The mapping is backed by the page cache, so every Locust
+# worker process on the host shares the same physical pages, and sending an
+# attachment never copies or re-encodes the payload in Python: the SMTP DATA stream
+# is fed memoryview slices of the mapping (see smtp_session.send_raw_message).
+#
+# Sidecar files are written to a temporary name and renamed into place, so worker
+# processes that start at the same time can race safely.
+#
+import os
+import mmap
+import base64
+import threading
+
+# 57 input bytes encode to one 76-character base64 line
+_LINE_INPUT_BYTES = 57
+_ENCODE_BLOCK_BYTES = _LINE_INPUT_BYTES * 16 * 1024
+
+
+def encoded_size(raw_size):
+    """Size of the CRLF-wrapped base64 encoding of raw_size bytes"""
+    if raw_size == 0:
+        return 0
+    full_lines, remainder = divmod(raw_size, _LINE_INPUT_BYTES)
+    size = full_lines * (76 + 2)
+    if remainder:
+        size += 4 * ((remainder + 2) // 3) + 2
+    return size
+
+
+class EncodedAttachment:
+    """Base64 body of one attachment, memory-mapped from its sidecar file"""
+
+    def __init__(self, path, encoded_path, raw_size):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.raw_size = raw_size
+        with open(encoded_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.encoded_size = len(self._mmap)
+
+    def chunks(self, chunk_size=256 * 1024):
+        """Yield zero-copy memoryview slices of the encoded body"""
+        view = memoryview(self._mmap)
+        for offset in range(0, self.encoded_size, chunk_size):
+            yield view[offset:offset + chunk_size]
+
+
+class AttachmentCache:
+    """Process-wide cache of encoded attachments"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return the EncodedAttachment for path, encoding it on first use"""
+        entry = self._entries.get(path)
+        if entry is not None:
+            return entry
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                raw_size = os.path.getsize(path)
+                encoded_path = self._ensure_encoded(path, raw_size)
+                entry = EncodedAttachment(path, encoded_path, raw_size)
+                self._entries[path] = entry
+        return entry
+
+    def _ensure_encoded(self, path, raw_size):
+        """Write the sidecar file unless an up-to-date one already exists"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        encoded_path = os.path.join(self.cache_dir, os.path.basename(path) + ".b64")
+        try:
+            stat = os.stat(encoded_path)
+            if stat.st_size == encoded_size(raw_size) and stat.st_mtime >= os.path.getmtime(path):
+                return encoded_path
+        except FileNotFoundError:
+            pass
+
+        tmp_path = f"{encoded_path}.{os.getpid()}.tmp"
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            while True:
+                block = src.read(_ENCODE_BLOCK_BYTES)
+                if not block:
+                    break
+                dst.write(base64.encodebytes(block).replace(b"\n", b"\r\n"))
+        os.replace(tmp_path, encoded_path)
+        return encoded_path
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_attachment_cache(cache_dir):
+    """Return the attachment cache shared by all users in this process"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = AttachmentCache(cache_dir)
+    return _shared_cache
@@ -0,0 +1,136 @@
+# bench_harness.py - Harness throughput against the local stand-in server
+"""
+Run SMTPLoadTester and IMAPLoadTester flat out (LOADTEST_WAIT_TIME=0) against
+standin_server.py and report the ceiling of the Locust client itself: messages/sec
+for SMTP, sessions/sec for IMAP, and both per CPU-second of the Locust process
+(i.e. per fully used core). The stand-in's CPU use is reported as well; when it is
+close to 100% the server is the limit, not the harness (try --server-processes).
+
+Every other setting is taken from the environment, so hot paths can be compared
+run against run:
+
+Usage (from test/load):
+    python benchmarks/bench_harness.py --scenario smtp --users 20 --duration 30
+    SMTP_SESSION_REUSE=true MESSAGE_CORPUS_ENABLED=true python benchmarks/bench_harness.py
+    IMAP_FETCH_STRATEGY=headers python benchmarks/bench_harness.py --scenario imap
+"""
+import os
+import csv
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+
+import psutil
+
+LOAD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LOAD_DIR)
+os.chdir(LOAD_DIR)
+
+from config import STANDIN_HOST, STANDIN_SMTP_PORT  # noqa: E402
+
+# scenario -> (user class, predicate selecting the stats rows that count as one unit)
+SCENARIOS = {
+    "smtp": ("SMTPLoadTester", "messages",
+             lambda row: row["Type"] == "SMTP" and row["Name"].startswith("send_")
+             and not row["Name"].endswith("_rate_limited")),
+    "imap": ("IMAPLoadTester", "sessions",
+             lambda row: row["Type"] == "IMAP" and row["Name"] == "connect"),
+}
+
+
+def start_server(processes):
+    """Start standin_server.py and wait until it accepts SMTP connections"""
+    server = subprocess.Popen(
+        [sys.executable, "standin_server.py", "--processes", str(processes), "--max-messages", "200"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection((STANDIN_HOST, STANDIN_SMTP_PORT), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("stand-in server did not start")
+
+
+def server_cpu_seconds(server):
+    """CPU time used so far by the stand-in and its forked processes"""
+    if server is None:
+        return 0.0
+    try:
+        process = psutil.Process(server.pid)
+        processes = [process] + process.children(recursive=True)
+        return sum(p.cpu_times().user + p.cpu_times().system for p in processes)
+    except psutil.Error:
+        return 0.0
+
+
+def run_locust(user_class, users, duration, csv_prefix):
+    """Run Locust headless; returns (wall seconds, CPU seconds of the Locust process)"""
+    env = dict(os.environ, LOADTEST_TARGET="standin", LOADTEST_WAIT_TIME="0")
+    command = [
+        sys.executable, "-m", "locust", "-f", "locustfile.py", "--headless",
+        "-u", str(users), "-r", str(users), "-t", f"{duration}s", "--stop-timeout", "5",
+        "--csv", csv_prefix, "--only-summary", "--loglevel", "WARNING", user_class,
+    ]
+    start = time.time()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return time.time() - start, usage.ru_utime + usage.ru_stime
+
+
+def read_stats(csv_prefix, predicate):
+    """Sum request count, failures and requests/s over the matching stats rows"""
+    count = failures = rate = 0
+    with open(f"{csv_prefix}_stats.csv", newline="") as f:
+        for row in csv.DictReader(f):
+            if row["Name"] != "Aggregated" and predicate(row):
+                count += int(row["Request Count"])
+                failures += int(row["Failure Count"])
+                rate += float(row["Requests/s"])
+    return count, failures, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["all"] + sorted(SCENARIOS), default="all")
+    parser.add_argument("--users", type=int, default=20, help="concurrent Locust users per scenario")
+    parser.add_argument("--duration", type=int, default=30, help="seconds per scenario")
+    parser.add_argument("--server-processes", type=int, default=1, help="stand-in processes (SO_REUSEPORT)")
+    parser.add_argument("--no-server", action="store_true", help="use an already running stand-in")
+    args = parser.parse_args()
+
+    server = None if args.no_server else start_server(args.server_processes)
+    scenarios = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    print(f"{'scenario':>8} {'users':>6} {'units':>9} {'count':>8} {'fail':>6} {'per s':>9} "
+          f"{'client cpu':>11} {'per core/s':>11} {'server cpu':>11}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for scenario in scenarios:
+                user_class, units, predicate = SCENARIOS[scenario]
+                csv_prefix = os.path.join(tmp, scenario)
+                server_before = server_cpu_seconds(server)
+                wall, cpu = run_locust(user_class, args.users, args.duration, csv_prefix)
+                server_cpu = server_cpu_seconds(server) - server_before
+                count, failures, rate = read_stats(csv_prefix, predicate)
+                print(
+                    f"{scenario:>8} {args.users:>6} {units:>9} {count:>8} {failures:>6} {rate:>9.1f} "
+                    f"{cpu / wall:>10.0%} {count / cpu if cpu else 0:>11.1f} "
+                    f"{server_cpu / wall:>10.0%}"
+                )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
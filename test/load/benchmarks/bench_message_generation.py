@@ -0,0 +1,85 @@
+# bench_message_generation.py - Message generation microbenchmark
+"""
+Compare messages generated per second on one core for the per-send path
+(Faker + str.format + MIME tree + serialization) and the pre-rendered corpus
+path (cached bytes + patched headers).
+
+Usage (from test/load):
+    python benchmarks/bench_message_generation.py --seconds 5 --size-class small
+"""
+import os
+import sys
+import time
+import argparse
+
+LOAD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LOAD_DIR)
+os.chdir(LOAD_DIR)
+
+from email.mime.text import MIMEText  # noqa: E402
+from email.mime.multipart import MIMEMultipart  # noqa: E402
+
+from data_generator import TestDataGenerator  # noqa: E402
+from message_corpus import MessageCorpus  # noqa: E402
+
+SENDER = "sender@example.com"
+RECIPIENT = "recipient@example.com"
+
+
+def per_send_message(generator, email_type):
+    """Build and serialize a message the way the SMTP tasks do without the corpus"""
+    content = generator.generate_email_content(email_type)
+    if content['type'] == 'plain_text':
+        msg = MIMEText(content['body'], 'plain')
+    else:
+        msg = MIMEMultipart('alternative')
+        msg.attach(MIMEText(content['body'], 'html'))
+    msg['Subject'] = content['subject']
+    msg['From'] = SENDER
+    msg['To'] = RECIPIENT
+    # send_message() flattens the tree before transmitting
+    return msg.as_bytes()
+
+
+def measure(label, func, seconds):
+    """Call func repeatedly for the given time and report the rate"""
+    count = 0
+    total_bytes = 0
+    start_cpu = time.process_time()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        total_bytes += len(func())
+        count += 1
+    cpu = time.process_time() - start_cpu
+    rate = count / cpu if cpu else float("inf")
+    print(f"{label:<12} {count:>9} msgs  {rate:>12,.0f} msgs/cpu-s  {total_bytes / count:>10,.0f} B/msg")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each measurement")
+    parser.add_argument("--email-type", default="random", help="template type or 'random'")
+    parser.add_argument("--size-class", default="small", choices=sorted(MessageCorpus.SIZE_CLASSES))
+    parser.add_argument("--variants", type=int, default=20, help="corpus messages per template and size class")
+    args = parser.parse_args()
+
+    generator = TestDataGenerator()
+    generator.config.MESSAGE_CORPUS_VARIANTS = args.variants
+    generator.config.MESSAGE_CORPUS_SIZE_CLASSES = [args.size_class]
+
+    start = time.perf_counter()
+    corpus = generator.build_corpus()
+    print(f"corpus build: {time.perf_counter() - start:.2f}s {corpus.stats()}")
+
+    per_send = measure("per-send", lambda: per_send_message(generator, args.email_type), args.seconds)
+    cached = measure(
+        "corpus",
+        lambda: generator.render_message(args.email_type, SENDER, [RECIPIENT], args.size_class),
+        args.seconds
+    )
+    print(f"speedup: {cached / per_send:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
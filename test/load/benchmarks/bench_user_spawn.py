@@ -0,0 +1,98 @@
+# bench_user_spawn.py - on_start latency benchmark
+"""
+Measure on_start latency of the Locust user classes at increasing user counts,
+with the process-wide shared TestUserManager/TestDataGenerator ("shared") or with
+a new instance per user, as before ("per-user").
+
+Usage (from test/load):
+    python benchmarks/bench_user_spawn.py --counts 10,1000,10000 --mode shared
+    python benchmarks/bench_user_spawn.py --counts 10,1000 --mode per-user --user-class imap
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import contextlib
+import statistics
+
+LOAD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LOAD_DIR)
+os.chdir(LOAD_DIR)
+
+from locust.env import Environment  # noqa: E402
+
+import smtp_tester  # noqa: E402
+import imap_tester  # noqa: E402
+import user_manager  # noqa: E402
+import data_generator  # noqa: E402
+
+USER_CLASSES = {
+    "smtp": smtp_tester.SMTPLoadTester,
+    "imap": imap_tester.IMAPLoadTester,
+}
+
+
+def reset_shared_state():
+    """Forget shared instances so every round starts cold"""
+    user_manager._shared_managers.clear()
+    data_generator._shared_generator = None
+
+
+@contextlib.contextmanager
+def per_user_instances():
+    """Make on_start build its own manager and generator, as before sharing"""
+    # assign_account and get_partition look get_user_manager up in user_manager itself
+    originals = [(module, "get_user_manager", module.get_user_manager)
+                 for module in (smtp_tester, imap_tester, user_manager)]
+    originals.append((smtp_tester, "get_data_generator", smtp_tester.get_data_generator))
+    for module in (smtp_tester, imap_tester, user_manager):
+        module.get_user_manager = lambda users_file="test_data/users.csv": user_manager.TestUserManager(users_file)
+    smtp_tester.get_data_generator = lambda: data_generator.TestDataGenerator()
+    try:
+        yield
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+
+def run(user_class, count):
+    """Instantiate and start count users, returning per-user on_start latency in ms"""
+    environment = Environment(user_classes=[user_class])
+    latencies = []
+    for _ in range(count):
+        user = user_class(environment)
+        start = time.perf_counter()
+        user.on_start()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", default="10,1000,10000", help="comma-separated user counts")
+    parser.add_argument("--mode", choices=["shared", "per-user"], default="shared")
+    parser.add_argument("--user-class", choices=sorted(USER_CLASSES), default="smtp")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    patches = per_user_instances() if args.mode == "per-user" else contextlib.nullcontext()
+
+    user_class = USER_CLASSES[args.user_class]
+    print(f"{args.user_class} on_start, mode={args.mode}")
+    print(f"{'users':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'users/s':>10}")
+    with patches:
+        for count in (int(c) for c in args.counts.split(",")):
+            reset_shared_state()
+            latencies = run(user_class, count)
+            total = sum(latencies) / 1000
+            ordered = sorted(latencies)
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+            print(
+                f"{count:>8} {total:>9.2f} {statistics.mean(latencies):>9.3f} {statistics.median(latencies):>9.3f} "
+                f"{p99:>9.3f} {ordered[-1]:>9.2f} {count / total if total else float('inf'):>10,.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
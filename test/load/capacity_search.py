@@ -0,0 +1,317 @@
+# capacity_search.py - Automatic capacity search (saturation knee finder)
+#
+# Instead of hand-running fixed -u/-r profiles, CapacitySearchShape raises the load
+# step by step and checks every step against an SLO:
+#
+#   - p95 and p99 latency of the SMTP and IMAP request/response operations
+#     (connect, send_*, content.*, session_check, check_inbox, sync_inbox.*,
+#     list_folders, fetch_messages*, ...). Rows that only break an operation down
+#     are reported but not judged: connect.* and send.* phases, endpoint.*,
+#     fanout.* and *_size_rejected (SLO_EXCLUDED_PREFIXES/SUFFIXES). Neither are
+#     IMAP_SESSION (IDLE waits and notifications, which last as long as
+#     IMAP_IDLE_SECONDS by design), E2E delivery, MX, THROTTLE and PROFILE
+#   - error rate of those operations
+#   - share of SMTP and IMAP outcomes reported as *_rate_limited (Postfix 421
+#     replies, see SMTPLoadTester._is_rate_limit_error)
+#   - in the open model, p95 of OPEN_MODEL *.schedule_lag, i.e. whether the offered
+#     rate was actually delivered
+#
+# The load doubles while the SLO holds, then bisects between the highest passing
+# and the lowest failing load until they are within CAPACITY_RESOLUTION of each
+# other. "Load" is the user count in the closed model, and a multiple of
+# SMTP_ARRIVAL_RATE / IMAP_ARRIVAL_RATE in the open model (the user count then
+# stays at SHAPE_PEAK_USERS as the concurrency pool).
+#
+# Each step runs for CAPACITY_STEP_SECONDS; only the part after
+# CAPACITY_WARMUP_SECONDS is judged. The knee and the per-step latency
+# distribution of every operation are written as JSON to CAPACITY_REPORT.
+#
+import json
+import time
+import logging
+from collections import namedtuple
+
+from locust import LoadTestShape
+from locust.runners import MasterRunner, WorkerRunner
+from locust.stats import calculate_response_time_percentile
+
+from config import EmailServerConfig
+from load_shapes import option
+import arrival_scheduler
+
+logger = logging.getLogger(__name__)
+
+SLO = namedtuple('SLO', ['p95_ms', 'p99_ms', 'max_error_rate', 'max_rate_limited', 'max_schedule_lag_ms'])
+
+PERCENTILES = (0.5, 0.75, 0.9, 0.95, 0.99, 0.999)
+# Request types whose operation rows are judged against the SLO
+SLO_REQUEST_TYPES = ("SMTP", "IMAP")
+# Rows of those types that break an operation down instead of timing one: phases
+# of a connection or send, circuit breaker events, the fan-out view of sends
+# already reported as send_*, and oversized attachments rejected by design
+SLO_EXCLUDED_PREFIXES = ("connect.", "send.", "endpoint.", "fanout.")
+SLO_EXCLUDED_SUFFIXES = ("_size_rejected",)
+
+
+def add_capacity_arguments(parser):
+    """Register the capacity search options on Locust's argument parser"""
+    config = EmailServerConfig
+    group = parser.add_argument_group("Capacity search")
+    group.add_argument("--capacity-search", action="store_true", default=config.CAPACITY_SEARCH,
+                       help="search for the highest load that meets the SLO (enables CapacitySearchShape)")
+    group.add_argument("--capacity-start", type=float, default=config.CAPACITY_START,
+                       help="first load: users (closed model) or arrival rate multiple (open model)")
+    group.add_argument("--capacity-max", type=float, default=config.CAPACITY_MAX)
+    group.add_argument("--capacity-step-time", type=float, default=config.CAPACITY_STEP_SECONDS,
+                       help="seconds per step")
+    group.add_argument("--capacity-warmup", type=float, default=config.CAPACITY_WARMUP_SECONDS,
+                       help="seconds at the start of each step that are not judged")
+    group.add_argument("--capacity-resolution", type=float, default=config.CAPACITY_RESOLUTION,
+                       help="stop when the passing and failing loads are within this fraction")
+    group.add_argument("--capacity-report", default=config.CAPACITY_REPORT, help="JSON report path")
+    group.add_argument("--slo-p95-ms", type=float, default=config.SLO_P95_MS)
+    group.add_argument("--slo-p99-ms", type=float, default=config.SLO_P99_MS)
+    group.add_argument("--slo-error-rate", type=float, default=config.SLO_ERROR_RATE)
+    group.add_argument("--slo-rate-limited", type=float, default=config.SLO_RATE_LIMITED)
+    group.add_argument("--slo-schedule-lag-ms", type=float, default=config.SLO_SCHEDULE_LAG_MS)
+
+
+def slo_settings(environment):
+    """Current SLO from the command line and config"""
+    config = EmailServerConfig
+    return SLO(
+        p95_ms=option(environment, "slo_p95_ms", config.SLO_P95_MS),
+        p99_ms=option(environment, "slo_p99_ms", config.SLO_P99_MS),
+        max_error_rate=option(environment, "slo_error_rate", config.SLO_ERROR_RATE),
+        max_rate_limited=option(environment, "slo_rate_limited", config.SLO_RATE_LIMITED),
+        max_schedule_lag_ms=option(environment, "slo_schedule_lag_ms", config.SLO_SCHEDULE_LAG_MS),
+    )
+
+
+def register_capacity_search(environment):
+    """Let workers follow the arrival rate multiple chosen by the master's search"""
+    runner = environment.runner
+    if isinstance(runner, WorkerRunner):
+        def on_capacity_message(environment, msg, **kwargs):
+            arrival_scheduler.set_rate_scale(msg.data["scale"])
+        runner.register_message("loadtest_capacity", on_capacity_message)
+
+
+class CapacitySearch:
+    """Exponential growth, then bisection, towards the highest load that passes"""
+
+    def __init__(self, start, maximum, resolution=0.05, integer=False, max_steps=30):
+        self.start = start
+        self.maximum = maximum
+        self.resolution = resolution
+        self.integer = integer
+        self.max_steps = max_steps
+        self.best = None     # highest passing load
+        self.failed = None   # lowest failing load
+        self.steps = 0
+        self.load = self._round(start)
+
+    def _round(self, load):
+        return max(1, int(round(load))) if self.integer else round(load, 3)
+
+    def record(self, load, passed):
+        """Record a step result; sets the next load, or None when the search is over"""
+        self.steps += 1
+        if passed:
+            self.best = load if self.best is None else max(self.best, load)
+        else:
+            self.failed = load if self.failed is None else min(self.failed, load)
+        self.load = self._next()
+        return self.load
+
+    def _next(self):
+        if self.steps >= self.max_steps:
+            return None
+        if self.failed is None:
+            if self.best >= self.maximum:
+                return None
+            return self._round(min(self.maximum, self.best * 2))
+        low = self.best or 0
+        if self.failed - low <= self.resolution * self.failed:
+            return None
+        load = self._round((low + self.failed) / 2)
+        if load <= low or load >= self.failed or (self.best is None and load < self.start * self.resolution):
+            return None
+        return load
+
+
+def snapshot(stats):
+    """Counters and response time histograms of every stats entry"""
+    return {
+        key: (entry.num_requests, entry.num_failures, dict(entry.response_times))
+        for key, entry in stats.entries.items()
+    }
+
+
+def window_stats(before, after, seconds):
+    """Per-operation request counts and latency distribution between two snapshots"""
+    operations = {}
+    for (name, request_type), (requests, failures, response_times) in after.items():
+        base_requests, base_failures, base_times = before.get((name, request_type), (0, 0, {}))
+        count = requests - base_requests
+        if count <= 0:
+            continue
+        histogram = {ms: n - base_times.get(ms, 0) for ms, n in response_times.items() if n > base_times.get(ms, 0)}
+        operation = {
+            "type": request_type,
+            "name": name,
+            "count": count,
+            "failures": failures - base_failures,
+            "per_second": round(count / seconds, 2) if seconds else 0.0,
+            "max_ms": max(histogram) if histogram else 0,
+        }
+        for percent in PERCENTILES:
+            operation[f"p{percent * 100:g}_ms"] = calculate_response_time_percentile(histogram, count, percent)
+        operation["histogram"] = histogram
+        operations[f"{request_type} {name}"] = operation
+    return operations
+
+
+def evaluate(operations, slo):
+    """Judge a step against the SLO; returns (passed, summary, reasons)"""
+    histogram = {}
+    count = failures = rate_limited = 0
+    lag = {}
+    lag_count = 0
+    for operation in operations.values():
+        name = operation["name"]
+        if operation["type"] == "OPEN_MODEL":
+            lag_count += operation["count"]
+            for ms, n in operation["histogram"].items():
+                lag[ms] = lag.get(ms, 0) + n
+        elif (operation["type"] not in SLO_REQUEST_TYPES or name.startswith(SLO_EXCLUDED_PREFIXES)
+              or name.endswith(SLO_EXCLUDED_SUFFIXES)):
+            continue  # phases, long-lived sessions and harness rows are not judged
+        elif name.endswith("_rate_limited"):
+            rate_limited += operation["count"]
+        else:
+            count += operation["count"]
+            failures += operation["failures"]
+            for ms, n in operation["histogram"].items():
+                histogram[ms] = histogram.get(ms, 0) + n
+
+    summary = {
+        "requests": count,
+        "p95_ms": calculate_response_time_percentile(histogram, count, 0.95),
+        "p99_ms": calculate_response_time_percentile(histogram, count, 0.99),
+        "error_rate": round(failures / count, 4) if count else 0.0,
+        "rate_limited": round(rate_limited / (count + rate_limited), 4) if count + rate_limited else 0.0,
+    }
+    if lag_count:
+        summary["schedule_lag_p95_ms"] = calculate_response_time_percentile(lag, lag_count, 0.95)
+
+    reasons = []
+    if not count:
+        reasons.append("no completed requests")
+    if summary["p95_ms"] > slo.p95_ms:
+        reasons.append(f"p95 {summary['p95_ms']}ms > {slo.p95_ms:g}ms")
+    if summary["p99_ms"] > slo.p99_ms:
+        reasons.append(f"p99 {summary['p99_ms']}ms > {slo.p99_ms:g}ms")
+    if summary["error_rate"] > slo.max_error_rate:
+        reasons.append(f"error rate {summary['error_rate']:.2%} > {slo.max_error_rate:.2%}")
+    if summary["rate_limited"] > slo.max_rate_limited:
+        reasons.append(f"rate limited {summary['rate_limited']:.2%} > {slo.max_rate_limited:.2%}")
+    if summary.get("schedule_lag_p95_ms", 0) > slo.max_schedule_lag_ms:
+        reasons.append(f"schedule lag p95 {summary['schedule_lag_p95_ms']}ms > {slo.max_schedule_lag_ms:g}ms")
+    return not reasons, summary, reasons
+
+
+class CapacitySearchShape(LoadTestShape):
+    """Step the load up and bisect until the highest load that meets the SLO is found"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.search = None
+        self.steps = []
+        self.step_started = 0.0
+        self.baseline = None
+
+    def _option(self, name, default):
+        return option(self.runner.environment, name, default)
+
+    def _open_model(self):
+        return self._option("arrival_model", EmailServerConfig.ARRIVAL_MODEL) != "closed"
+
+    def _start_step(self, run_time):
+        self.step_started = run_time
+        self.baseline = None
+        load = self.search.load
+        logger.info(f"Capacity search step {self.search.steps + 1}: load {load}")
+        if self._open_model():
+            if isinstance(self.runner, MasterRunner):
+                self.runner.send_message("loadtest_capacity", {"scale": load})
+            else:
+                arrival_scheduler.set_rate_scale(load)
+
+    def _finish_step(self, run_time):
+        config = EmailServerConfig
+        seconds = run_time - self.step_started - self._option("capacity_warmup", config.CAPACITY_WARMUP_SECONDS)
+        operations = window_stats(self.baseline or {}, snapshot(self.runner.stats), seconds)
+        passed, summary, reasons = evaluate(operations, slo_settings(self.runner.environment))
+        load = self.search.load
+        self.steps.append({
+            "load": load,
+            "passed": passed,
+            "reasons": reasons,
+            "judged_seconds": round(seconds, 1),
+            "summary": summary,
+            "operations": operations,
+        })
+        logger.info(f"Capacity search load {load}: {'pass' if passed else 'FAIL ' + '; '.join(reasons)} {summary}")
+        self.search.record(load, passed)
+
+    def _write_report(self):
+        environment = self.runner.environment
+        open_model = self._open_model()
+        knee = self.search.best
+        report = {
+            "generated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "model": self._option("arrival_model", EmailServerConfig.ARRIVAL_MODEL),
+            "load_unit": "arrival_rate_multiple" if open_model else "users",
+            "slo": slo_settings(environment)._asdict(),
+            "knee": knee,
+            "first_failing_load": self.search.failed,
+            "steps": self.steps,
+        }
+        if open_model and knee is not None:
+            report["knee_arrival_rates"] = {
+                key: round(knee * option(environment, rate_option, default), 3)
+                for key, (rate_option, default) in arrival_scheduler.RATE_OPTIONS.items()
+            }
+        path = self._option("capacity_report", EmailServerConfig.CAPACITY_REPORT)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Capacity search finished: knee {knee} ({report['load_unit']}), report written to {path}")
+
+    def tick(self):
+        config = EmailServerConfig
+        run_time = self.get_run_time()
+        if self.search is None:
+            open_model = self._open_model()
+            self.search = CapacitySearch(
+                self._option("capacity_start", config.CAPACITY_START),
+                self._option("capacity_max", config.CAPACITY_MAX),
+                self._option("capacity_resolution", config.CAPACITY_RESOLUTION),
+                integer=not open_model,
+            )
+            self._start_step(run_time)
+
+        elapsed = run_time - self.step_started
+        if self.baseline is None and elapsed >= self._option("capacity_warmup", config.CAPACITY_WARMUP_SECONDS):
+            self.baseline = snapshot(self.runner.stats)
+        if elapsed >= self._option("capacity_step_time", config.CAPACITY_STEP_SECONDS):
+            self._finish_step(run_time)
+            if self.search.load is None:
+                self._write_report()
+                return None
+            self._start_step(run_time)
+
+        spawn_rate = self._option("shape_spawn_rate", config.SHAPE_SPAWN_RATE)
+        if self._open_model():
+            return self._option("shape_peak_users", config.SHAPE_PEAK_USERS), spawn_rate
+        return self.search.load, spawn_rate
@@ -4,23 +4,249 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 MAIL_DOMAIN = os.getenv("MAIL_DOMAIN", "localhost")
+
+# Load test target: "server" (the Silver deployment at MAIL_DOMAIN) or "standin"
+# (standin_server.py, a local SMTP/IMAP stand-in for benchmarking the harness)
+LOADTEST_TARGET = os.getenv("LOADTEST_TARGET", "server").strip().lower()
+STANDIN_HOST = os.getenv("STANDIN_HOST", "127.0.0.1")
+STANDIN_SMTP_PORT = int(os.getenv("STANDIN_SMTP_PORT", "2587"))
+STANDIN_IMAPS_PORT = int(os.getenv("STANDIN_IMAPS_PORT", "2993"))
+STANDIN_IMAP_PORT = int(os.getenv("STANDIN_IMAP_PORT", "2143"))
+STANDIN_MX_PORT = int(os.getenv("STANDIN_MX_PORT", "2525"))
+_STANDIN = LOADTEST_TARGET == "standin"
+
+
+def _env_bool(name, default=False):
+    """Read a boolean flag from the environment"""
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
 class EmailServerConfig:
     """Email server configuration with multiple fallback options"""
-    SMTP_SERVER = MAIL_DOMAIN
-    SMTP_PORT = 587
-    IMAP_SERVER = MAIL_DOMAIN
+    SMTP_SERVER = STANDIN_HOST if _STANDIN else MAIL_DOMAIN
+    SMTP_PORT = STANDIN_SMTP_PORT if _STANDIN else 587
+    IMAP_SERVER = STANDIN_HOST if _STANDIN else MAIL_DOMAIN
 
     # Try these configurations in order
+    _IMAPS_PORT = STANDIN_IMAPS_PORT if _STANDIN else 993
+    _IMAP_PORT = STANDIN_IMAP_PORT if _STANDIN else 143
     IMAP_CONFIGS = [
-        {"port": 993, "ssl": True, "starttls": False, "name": "IMAP SSL (Port 993)"},
-        {"port": 143, "ssl": False, "starttls": True, "name": "IMAP with STARTTLS (Port 143)"},
-        {"port": 143, "ssl": False, "starttls": False, "name": "IMAP Plain (Port 143)"},
+        {"port": _IMAPS_PORT, "ssl": True, "starttls": False, "name": f"IMAP SSL (Port {_IMAPS_PORT})"},
+        {"port": _IMAP_PORT, "ssl": False, "starttls": True, "name": f"IMAP with STARTTLS (Port {_IMAP_PORT})"},
+        {"port": _IMAP_PORT, "ssl": False, "starttls": False, "name": f"IMAP Plain (Port {_IMAP_PORT})"},
     ]
 
     TIMEOUT = 30
+    # Enforced on every SMTP/IMAP socket: CONNECT_TIMEOUT for the TCP connect,
+    # READ_TIMEOUT for each later read/write (TLS handshake, greeting, replies)
+    CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT", "10"))
+    READ_TIMEOUT = float(os.getenv("READ_TIMEOUT", str(TIMEOUT)))
+    # Shared IMAP endpoint discovery and per-endpoint circuit breakers (see
+    # endpoint_discovery.py)
+    ENDPOINT_REVALIDATE_SECONDS = float(os.getenv("ENDPOINT_REVALIDATE_SECONDS", "60"))
+    ENDPOINT_FAILURE_THRESHOLD = int(os.getenv("ENDPOINT_FAILURE_THRESHOLD", "5"))
+    ENDPOINT_COOLDOWN_SECONDS = float(os.getenv("ENDPOINT_COOLDOWN_SECONDS", "30"))
     USE_TLS = True
+    # Offer each user's previous TLS session (ticket or session ID) when it
+    # reconnects; handshakes are reported as connect.tls_full / connect.tls_resumed
+    TLS_SESSION_RESUMPTION = _env_bool("TLS_SESSION_RESUMPTION", False)
 
     # Attachment size limit (10MB - industry standard for email attachments)
     # Setting to 6MB to ensure encoded size stays under 10MB (base64 adds ~33% overhead)
     MAX_ATTACHMENT_SIZE_MB = 6
-    MAX_ATTACHMENT_SIZE_BYTES = MAX_ATTACHMENT_SIZE_MB * 1024 * 1024
\ No newline at end of file
+    MAX_ATTACHMENT_SIZE_BYTES = MAX_ATTACHMENT_SIZE_MB * 1024 * 1024
+
+    # SMTP session reuse: keep one authenticated session per Locust user instead of
+    # connect + STARTTLS + AUTH for every task
+    SMTP_SESSION_REUSE = _env_bool("SMTP_SESSION_REUSE", False)
+    SMTP_MAX_MESSAGES_PER_SESSION = int(os.getenv("SMTP_MAX_MESSAGES_PER_SESSION", "100"))
+    # Sessions idle for longer than this are checked with NOOP before reuse
+    SMTP_SESSION_HEALTHCHECK_SECONDS = float(os.getenv("SMTP_SESSION_HEALTHCHECK_SECONDS", "30"))
+
+    # Message corpus: pre-render serialized messages once per worker and only patch
+    # From/To/Date/Message-ID at send time (see message_corpus.py)
+    MESSAGE_CORPUS_ENABLED = _env_bool("MESSAGE_CORPUS_ENABLED", False)
+    MESSAGE_CORPUS_VARIANTS = int(os.getenv("MESSAGE_CORPUS_VARIANTS", "20"))
+    MESSAGE_CORPUS_MAX_MB = int(os.getenv("MESSAGE_CORPUS_MAX_MB", "64"))
+    MESSAGE_CORPUS_SIZE_CLASSES = [
+        size.strip() for size in os.getenv("MESSAGE_CORPUS_SIZE_CLASSES", "small").split(",") if size.strip()
+    ]
+
+    # Attachment handling for send_email_with_attachment:
+    #   mime   - read and base64-encode the file through the email package on every send
+    #   cached - encode each file once into a memory-mapped sidecar shared by all
+    #            workers and splice it into the DATA stream (see attachment_cache.py)
+    #   stream - generate a seeded pseudo-random attachment and base64-encode it while
+    #            sending, in O(STREAM_CHUNK_KB) memory per user (see message_stream.py)
+    ATTACHMENT_MODE = os.getenv("ATTACHMENT_MODE", "mime").strip().lower()
+    ATTACHMENT_CACHE_DIR = os.getenv("ATTACHMENT_CACHE_DIR", "test_data/attachments/.encoded")
+    # Generated sizes are not capped by MAX_ATTACHMENT_SIZE_MB, to reach message_size_limit
+    STREAM_ATTACHMENT_MIN_MB = float(os.getenv("STREAM_ATTACHMENT_MIN_MB", "1"))
+    STREAM_ATTACHMENT_MAX_MB = float(os.getenv("STREAM_ATTACHMENT_MAX_MB", "8"))
+    STREAM_CHUNK_KB = int(os.getenv("STREAM_CHUNK_KB", "256"))
+    # Stream and cached attachments use BDAT (RFC 3030) when the server offers CHUNKING,
+    # and declare their size on MAIL FROM (RFC 1870); without the declaration an
+    # oversized message is only rejected after the whole body has been transferred
+    SMTP_USE_BDAT = _env_bool("SMTP_USE_BDAT", True)
+    SMTP_DECLARE_SIZE = _env_bool("SMTP_DECLARE_SIZE", True)
+
+    # Long-lived IMAP sessions (IMAPIdleLoadTester): disabled unless enabled here,
+    # so the default user mix is unchanged
+    IMAP_IDLE_USERS = _env_bool("IMAP_IDLE_USERS", False)
+    # Seconds to stay in IDLE before DONE + NOOP (RFC 2177 recommends < 29 minutes)
+    IMAP_IDLE_SECONDS = float(os.getenv("IMAP_IDLE_SECONDS", "300"))
+
+    # Content-security workload: adds ContentMixLoadTester, which sends spam-like,
+    # URL-heavy, nested-archive, EICAR, GTUBE and large-text messages in the
+    # CONTENT_MIX proportions and reports each class separately (see content_mix.py)
+    CONTENT_MIX_USERS = _env_bool("CONTENT_MIX_USERS", False)
+    CONTENT_MIX = os.getenv("CONTENT_MIX", "clean:50,spam:15,url_heavy:10,archive:10,large_text:10,eicar:3,gtube:2")
+    CONTENT_URL_COUNT = int(os.getenv("CONTENT_URL_COUNT", "60"))
+    CONTENT_ARCHIVE_DEPTH = int(os.getenv("CONTENT_ARCHIVE_DEPTH", "3"))
+    CONTENT_ARCHIVE_KB = int(os.getenv("CONTENT_ARCHIVE_KB", "256"))
+    CONTENT_ARCHIVE_VARIANTS = int(os.getenv("CONTENT_ARCHIVE_VARIANTS", "8"))
+    CONTENT_LARGE_TEXT_KB = int(os.getenv("CONTENT_LARGE_TEXT_KB", "1024"))
+
+    # Inbound MX workload: adds MXRelayLoadTester, which delivers to port 25 as
+    # external MTAs do: unauthenticated, pipelined, several messages per session,
+    # from MX_IDENTITIES sender identities, a share of them DKIM-signed (see mx_relay.py)
+    MX_RELAY_USERS = _env_bool("MX_RELAY_USERS", False)
+    MX_SERVER = SMTP_SERVER
+    MX_PORT = STANDIN_MX_PORT if _STANDIN else 25
+    MX_STARTTLS = _env_bool("MX_STARTTLS", True)  # opportunistic, when offered
+    MX_IDENTITIES = int(os.getenv("MX_IDENTITIES", "200"))
+    MX_IDENTITY_ZIPF_EXPONENT = float(os.getenv("MX_IDENTITY_ZIPF_EXPONENT", "1.0"))  # 0 = uniform
+    # Sender domains; default: a synthetic senderNNNN.example.net per identity
+    MX_SENDER_DOMAINS = [d.strip() for d in os.getenv("MX_SENDER_DOMAINS", "").split(",") if d.strip()]
+    # Local addresses or CIDR ranges to connect from, one per identity (round robin)
+    MX_SOURCE_ADDRESSES = os.getenv("MX_SOURCE_ADDRESSES", "")
+    # Messages per session, weighted ranges like RECIPIENT_FANOUT
+    MX_MESSAGES_PER_SESSION = os.getenv("MX_MESSAGES_PER_SESSION", "1:60,2-5:30,10-50:10")
+    MX_DKIM_SHARE = float(os.getenv("MX_DKIM_SHARE", "0.5"))  # share of identities that sign
+    MX_DKIM_KEY = os.getenv("MX_DKIM_KEY", "test_data/dkim/loadtest.key")
+    MX_DKIM_SELECTOR = os.getenv("MX_DKIM_SELECTOR", "loadtest")
+    MX_DKIM_DOMAIN = os.getenv("MX_DKIM_DOMAIN", "")  # d= of every signature; default: the sender domain
+    # Greylisted messages are retried from the same identity after this long (0: never)
+    MX_GREYLIST_RETRY_SECONDS = float(os.getenv("MX_GREYLIST_RETRY_SECONDS", "300"))
+
+    # End-to-end delivery tracking (see delivery_tracker.py): messages to the first
+    # E2E_TRACKED_MAILBOXES test accounts are matched on arrival by DeliveryTrackerUser
+    E2E_TRACKING = _env_bool("E2E_TRACKING", False)
+    E2E_TRACKED_MAILBOXES = int(os.getenv("E2E_TRACKED_MAILBOXES", "5"))
+    E2E_TIMEOUT_SECONDS = float(os.getenv("E2E_TIMEOUT_SECONDS", "300"))
+    E2E_MAX_PENDING = int(os.getenv("E2E_MAX_PENDING", "10000"))
+    # IDLE period (or polling interval without IDLE support) of the tracker sessions
+    E2E_POLL_SECONDS = float(os.getenv("E2E_POLL_SECONDS", "30"))
+
+    # IMAP fetch strategy for fetch_recent_messages (reported as fetch_messages.<strategy>):
+    #   rfc822    - SEARCH ALL, then one FETCH n (RFC822) per message (legacy, sets \Seen)
+    #   uid_range - whole messages for the window in one UID FETCH with BODY.PEEK[]
+    #   headers   - BODY.PEEK[HEADER.FIELDS (...)] envelope-only listing
+    #   partial   - BODYSTRUCTURE plus BODY.PEEK[]<0.IMAP_FETCH_PARTIAL_BYTES>
+    #   envelope  - ENVELOPE/FLAGS for a message list view
+    IMAP_FETCH_STRATEGY = os.getenv("IMAP_FETCH_STRATEGY", "rfc822").strip().lower()
+    IMAP_FETCH_WINDOW = int(os.getenv("IMAP_FETCH_WINDOW", "5"))
+    IMAP_FETCH_PARTIAL_BYTES = int(os.getenv("IMAP_FETCH_PARTIAL_BYTES", "2048"))
+
+    # How IMAPLoadTester.check_inbox polls INBOX:
+    #   search      - SELECT + SEARCH ALL on every poll (legacy)
+    #   incremental - STATUS (UIDNEXT MESSAGES HIGHESTMODSEQ) and fetch only what
+    #                 changed, using CONDSTORE/QRESYNC when advertised (see imap_sync.py)
+    IMAP_SYNC_MODE = os.getenv("IMAP_SYNC_MODE", "search").strip().lower()
+
+    # Deterministic account partitioning for distributed runs (see user_manager.py):
+    # each worker gets a disjoint slice of users.csv and each spawned user its own
+    # account from that slice. Set LOADTEST_WORKER_COUNT on every worker.
+    USER_PARTITIONING = _env_bool("USER_PARTITIONING", False)
+    LOADTEST_WORKER_COUNT = int(os.getenv("LOADTEST_WORKER_COUNT", "0"))
+    # Seed for reproducible accounts, recipients, content and task selection
+    LOADTEST_SEED = int(os.getenv("LOADTEST_SEED")) if os.getenv("LOADTEST_SEED") else None
+    # Recipient distribution: uniform, partition, sequential, zipf or hotspot
+    RECIPIENT_DISTRIBUTION = os.getenv("RECIPIENT_DISTRIBUTION", "uniform").strip().lower()
+    RECIPIENT_ZIPF_EXPONENT = float(os.getenv("RECIPIENT_ZIPF_EXPONENT", "1.0"))
+    RECIPIENT_HOTSPOT_ACCOUNTS = int(os.getenv("RECIPIENT_HOTSPOT_ACCOUNTS", "3"))
+    RECIPIENT_HOTSPOT_SHARE = float(os.getenv("RECIPIENT_HOTSPOT_SHARE", "0.8"))
+    # Recipients per message as "count:weight" or "low-high:weight" classes; the
+    # default sends every message to one recipient. Messages with at least
+    # RECIPIENT_LIST_THRESHOLD recipients are sent as distribution-list mail (all Bcc)
+    RECIPIENT_FANOUT = os.getenv("RECIPIENT_FANOUT", "1")
+    RECIPIENT_CC_SHARE = float(os.getenv("RECIPIENT_CC_SHARE", "0.3"))
+    RECIPIENT_BCC_SHARE = float(os.getenv("RECIPIENT_BCC_SHARE", "0.1"))
+    RECIPIENT_LIST_THRESHOLD = int(os.getenv("RECIPIENT_LIST_THRESHOLD", "50"))
+    # Upper bounds of the SMTP fanout.<bucket> rows reported when fan-out is enabled
+    RECIPIENT_FANOUT_BUCKETS = [int(b) for b in os.getenv("RECIPIENT_FANOUT_BUCKETS", "1,2,5,20,100").split(",") if b.strip()]
+
+    # Constant wait (seconds) between tasks for every user class, overriding the
+    # per-class wait_time; 0 runs users flat out (used by benchmarks/bench_harness.py)
+    LOADTEST_WAIT_TIME = float(os.getenv("LOADTEST_WAIT_TIME")) if os.getenv("LOADTEST_WAIT_TIME") else None
+
+    # Open-model arrival rate (see arrival_scheduler.py): closed keeps the per-class
+    # wait_time; poisson or constant start SMTPLoadTester/IMAPLoadTester tasks at the
+    # rates below (tasks/s across all workers), independent of completion times
+    ARRIVAL_MODEL = os.getenv("ARRIVAL_MODEL", "closed").strip().lower()
+    SMTP_ARRIVAL_RATE = float(os.getenv("SMTP_ARRIVAL_RATE", "10"))
+    IMAP_ARRIVAL_RATE = float(os.getenv("IMAP_ARRIVAL_RATE", "5"))
+
+    # Traffic profile for MailTrafficShape (see load_shapes.py): diurnal, monday,
+    # newsletter, step or ramp; empty runs the usual -u/-r load
+    LOAD_SHAPE = os.getenv("LOAD_SHAPE", "").strip().lower()
+    SHAPE_DURATION = float(os.getenv("SHAPE_DURATION", "600"))
+    SHAPE_PEAK_USERS = int(os.getenv("SHAPE_PEAK_USERS", "50"))
+    SHAPE_SPAWN_RATE = float(os.getenv("SHAPE_SPAWN_RATE", "10"))
+    SHAPE_STEPS = int(os.getenv("SHAPE_STEPS", "5"))
+    SHAPE_BASELINE = float(os.getenv("SHAPE_BASELINE", "0.2"))
+    SHAPE_STAGES = os.getenv("SHAPE_STAGES", "")
+
+    # Capacity search (see capacity_search.py): step the load up and bisect towards the
+    # highest users (closed model) or arrival rate multiple (open model) meeting the SLO
+    CAPACITY_SEARCH = _env_bool("CAPACITY_SEARCH")
+    CAPACITY_START = float(os.getenv("CAPACITY_START", "5"))
+    CAPACITY_MAX = float(os.getenv("CAPACITY_MAX", "1000"))
+    CAPACITY_STEP_SECONDS = float(os.getenv("CAPACITY_STEP_SECONDS", "60"))
+    CAPACITY_WARMUP_SECONDS = float(os.getenv("CAPACITY_WARMUP_SECONDS", "15"))
+    CAPACITY_RESOLUTION = float(os.getenv("CAPACITY_RESOLUTION", "0.1"))
+    CAPACITY_REPORT = os.getenv("CAPACITY_REPORT", "capacity_report.json")
+    SLO_P95_MS = float(os.getenv("SLO_P95_MS", "1000"))
+    SLO_P99_MS = float(os.getenv("SLO_P99_MS", "3000"))
+    SLO_ERROR_RATE = float(os.getenv("SLO_ERROR_RATE", "0.01"))
+    SLO_RATE_LIMITED = float(os.getenv("SLO_RATE_LIMITED", "0.05"))
+    SLO_SCHEDULE_LAG_MS = float(os.getenv("SLO_SCHEDULE_LAG_MS", "1000"))
+
+    # Full-resolution latency histograms (see latency_histograms.py)
+    HDR_STATS = _env_bool("HDR_STATS")
+    HDR_SIGNIFICANT_DIGITS = int(os.getenv("HDR_SIGNIFICANT_DIGITS", "3"))
+    HDR_CO_CORRECTION = os.getenv("HDR_CO_CORRECTION", "none").strip().lower()  # none, interval or schedule
+    HDR_EXPECTED_INTERVAL_MS = float(os.getenv("HDR_EXPECTED_INTERVAL_MS", "0"))
+    HDR_INTERVAL_SECONDS = float(os.getenv("HDR_INTERVAL_SECONDS", "10"))
+    HDR_LOG = os.getenv("HDR_LOG", "reports/hdr_latency.jsonl")
+    HDR_SUMMARY = os.getenv("HDR_SUMMARY", "reports/hdr_summary.json")
+
+    # Batched structured event recording instead of per-operation log lines
+    # (see event_sink.py)
+    EVENT_SINK = _env_bool("EVENT_SINK", False)
+    EVENT_LOG = os.getenv("EVENT_LOG", "reports/events.ndjson")
+    EVENT_LEVEL = os.getenv("EVENT_LEVEL", "info").strip().lower()  # debug, info, warning or error
+    EVENT_SAMPLE_RATE = float(os.getenv("EVENT_SAMPLE_RATE", "1.0"))  # debug/info events kept
+    EVENT_TRACE_REQUESTS = _env_bool("EVENT_TRACE_REQUESTS", True)
+    EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "100000"))
+    EVENT_FLUSH_SECONDS = float(os.getenv("EVENT_FLUSH_SECONDS", "1"))
+
+    # Client self-profiling (see harness_profiler.py)
+    HARNESS_PROFILE = _env_bool("HARNESS_PROFILE", False)
+    PROFILE_LOOP_LAG_INTERVAL = float(os.getenv("PROFILE_LOOP_LAG_INTERVAL", "0.1"))
+    PROFILE_RESOURCE_SECONDS = float(os.getenv("PROFILE_RESOURCE_SECONDS", "5"))
+    PROFILE_CPU_WARN_PERCENT = float(os.getenv("PROFILE_CPU_WARN_PERCENT", "90"))  # 0 = never warn
+    PROFILE_SAMPLER = _env_bool("PROFILE_SAMPLER", False)
+    PROFILE_SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "100"))
+    PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "reports/profile.folded")
+
+    # Adaptive AIMD throttling of new SMTP connections and messages (see throttle.py);
+    # starting rates are per second across all workers
+    THROTTLE_ENABLED = _env_bool("THROTTLE_ENABLED", False)
+    THROTTLE_CONNECT_RATE = float(os.getenv("THROTTLE_CONNECT_RATE", "0.17"))
+    THROTTLE_MESSAGE_RATE = float(os.getenv("THROTTLE_MESSAGE_RATE", "1.67"))
+    THROTTLE_MIN_RATE = float(os.getenv("THROTTLE_MIN_RATE", "0.01"))
+    THROTTLE_MAX_RATE = float(os.getenv("THROTTLE_MAX_RATE", "1000"))
+    THROTTLE_INCREASE = float(os.getenv("THROTTLE_INCREASE", "0.01"))  # x starting rate per second
+    THROTTLE_DECREASE = float(os.getenv("THROTTLE_DECREASE", "0.5"))
+    THROTTLE_DECREASE_INTERVAL = float(os.getenv("THROTTLE_DECREASE_INTERVAL", "60"))  # anvil_rate_time_unit
@@ -0,0 +1,337 @@
+# content_mix.py - Content-security workload for rspamd and ClamAV
+#
+# The regular generated messages are trivially clean: short template bodies and
+# attachments of random bytes, which rspamd and ClamAV wave through without running
+# their expensive checks. ContentMixLoadTester (CONTENT_MIX_USERS) sends messages of
+# these classes instead, drawn with the weights in CONTENT_MIX:
+#
+#   clean       the regular template messages, as a baseline
+#   spam        spam-like wording, money amounts, hidden text (Bayes, regexp rules)
+#   url_heavy   HTML with CONTENT_URL_COUNT links: shorteners, IP literals and
+#               anchors whose text names another domain (URL/SURBL/phishing checks)
+#   archive     zip attachments nesting a docx, a pdf and another zip
+#               CONTENT_ARCHIVE_DEPTH levels deep (ClamAV archive unpacking)
+#   eicar       the EICAR anti-virus test file, bare or zipped (virus verdicts)
+#   gtube       the GTUBE anti-spam test string (rspamd reject)
+#   large_text  a plain-text body of CONTENT_LARGE_TEXT_KB (tokenization, Bayes)
+#
+# Each message is tagged with its class in an X-Loadtest-Content header and reported
+# as "SMTP content.<class>" when accepted, "content.<class>.rejected" on a 5xx and
+# "content.<class>.deferred" on a 4xx (greylisting, soft reject, rate limits), so
+# latency and verdict rates can be read per class. A spam verdict that only adds
+# headers or files the message as Junk is not visible at SMTP time and counts as
+# accepted. At the end of a run the per-class verdict rates are logged.
+#
+# Bodies, URLs and archives are built from pools prepared once per worker, so the
+# generator itself stays cheap next to the scanning it is meant to load.
+#
+import io
+import random
+import logging
+import zipfile
+import threading
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email import encoders
+
+from config import EmailServerConfig
+from data_generator import get_data_generator
+
+logger = logging.getLogger(__name__)
+
+CONTENT_CLASSES = ("clean", "spam", "url_heavy", "archive", "eicar", "gtube", "large_text")
+
+CONTENT_HEADER = "X-Loadtest-Content"
+
+# The standard test signatures, assembled at run time so that a virus or spam scanner
+# on a developer machine does not flag this source file itself
+EICAR = ("X5O!P%@AP[4\\PZX54(P^)7CC)7}$" + "EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*").encode()
+GTUBE = "XJS*C4JDBQADN1.NSBN3*2IDNEN*" + "GTUBE-STANDARD-ANTI-UBE-TEST-EMAIL*C.34X"
+
+_SPAM_SUBJECTS = (
+    "URGENT: Your account has been selected for a ${amount} reward!!!",
+    "Congratulations {name}, you are our lucky WINNER",
+    "LIMITED TIME: 90% OFF - act now before it's gone",
+    "Re: your unpaid invoice #{order_id} - FINAL NOTICE",
+    "Make ${amount} a week from home - 100% GUARANTEED",
+)
+
+_SPAM_PHRASES = (
+    "Click here to claim your prize", "This is not spam", "100% free, no obligation",
+    "Act now! Offer expires at midnight", "Risk-free trial", "Earn extra cash from home",
+    "You have been specially selected", "Lowest price guaranteed", "Cheap meds without prescription",
+    "Wire transfer required to release your funds", "Dear valued customer", "Verify your account immediately",
+    "No credit check", "Once in a lifetime opportunity", "Unsubscribe to stop receiving these offers",
+)
+
+_SHORTENERS = ("bit.ly", "tinyurl.com", "t.co", "goo.gl", "ow.ly", "is.gd")
+
+_CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/></Relationships>'
+)
+
+
+def parse_mix(spec):
+    """Parse CONTENT_MIX, e.g. "clean:60,spam:15,archive:10"; returns [(class, weight)]"""
+    mix = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition(":")
+        name = name.strip()
+        if name not in CONTENT_CLASSES:
+            raise ValueError(f"Unknown content class '{name}' in CONTENT_MIX, expected one of {CONTENT_CLASSES}")
+        mix.append((name, float(weight or 1)))
+    if not mix:
+        raise ValueError("CONTENT_MIX is empty")
+    return mix
+
+
+def build_docx(paragraphs):
+    """Minimal Office Open XML document with the given paragraphs"""
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{body}</w:body></w:document>'
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES_XML)
+        archive.writestr("_rels/.rels", _RELS_XML)
+        archive.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def build_pdf(lines):
+    """Minimal single-page PDF showing the given lines of text"""
+    text = " ".join(f"({line.replace('(', '').replace(')', '')}) Tj T*" for line in lines)
+    stream = f"BT /F1 11 Tf 14 TL 72 760 Td {text} ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(pdf)
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _attach(msg, data, filename, maintype="application", subtype="octet-stream"):
+    part = MIMEBase(maintype, subtype)
+    part.set_payload(data)
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    msg.attach(part)
+
+
+class ContentMix:
+    """Builds messages of the content classes from pools prepared once per worker"""
+
+    def __init__(self, config=EmailServerConfig):
+        self.config = config
+        self.generator = get_data_generator()
+        self.mix = parse_mix(config.CONTENT_MIX)
+        self.classes = [name for name, _ in self.mix]
+        self.weights = [weight for _, weight in self.mix]
+        fake = self.generator.fake
+        self.paragraphs = [fake.paragraph(nb_sentences=8) for _ in range(200)]
+        self.names = [fake.name() for _ in range(100)]
+        self.domains = [fake.domain_name() for _ in range(300)]
+        self.words = [fake.word() for _ in range(300)]
+        self._archives = {}
+        self._archives_lock = threading.Lock()
+
+    def pick_class(self, rng):
+        return rng.choices(self.classes, self.weights)[0]
+
+    def build(self, content_class, rng):
+        """Return (MIME message without From/To, size of its body and attachments)"""
+        msg, size = getattr(self, f"_build_{content_class}")(rng)
+        msg[CONTENT_HEADER] = content_class
+        return msg, size
+
+    def _build_clean(self, rng):
+        content = self.generator.generate_email_content()
+        msg = MIMEText(content['body'], 'plain' if content['type'] == 'plain_text' else 'html')
+        msg['Subject'] = content['subject']
+        return msg, len(content['body'])
+
+    def _spam_subject(self, rng):
+        return rng.choice(_SPAM_SUBJECTS).format(
+            amount=f"{rng.randint(500, 50000):,}", name=rng.choice(self.names), order_id=rng.randint(10000, 99999)
+        )
+
+    def _build_spam(self, rng):
+        phrases = rng.sample(_SPAM_PHRASES, 6)
+        hidden = " ".join(rng.choice(self.paragraphs) for _ in range(3))
+        body = (
+            f"<html><body><h1>{phrases[0].upper()}!!!</h1>"
+            f"<p>Dear {rng.choice(self.names)},</p>"
+            + "".join(f"<p><b>{phrase}!</b> Only ${rng.randint(1, 99)}.{rng.randint(0, 99):02d}</p>"
+                      for phrase in phrases[1:])
+            + f'<p><a href="http://{rng.choice(self.domains)}/claim?id={rng.getrandbits(48):x}">CLAIM NOW</a></p>'
+            f'<div style="color:#ffffff;font-size:1px">{hidden}</div>'
+            "</body></html>"
+        )
+        msg = MIMEText(body, 'html')
+        msg['Subject'] = self._spam_subject(rng)
+        return msg, len(body)
+
+    def _url(self, rng):
+        kind = rng.random()
+        if kind < 0.2:
+            return f"https://{rng.choice(_SHORTENERS)}/{rng.getrandbits(40):x}"
+        if kind < 0.3:
+            # TEST-NET-3 (RFC 5737): an IP-literal URL that never leads anywhere
+            return f"http://203.0.113.{rng.randint(1, 254)}/{rng.choice(self.words)}.php"
+        return f"https://{rng.choice(self.domains)}/{rng.choice(self.words)}/{rng.choice(self.words)}"
+
+    def _build_url_heavy(self, rng):
+        links = []
+        for _ in range(self.config.CONTENT_URL_COUNT):
+            url = self._url(rng)
+            # Some anchors show one domain and link to another (phishing heuristics)
+            text = f"https://www.{rng.choice(self.domains)}/" if rng.random() < 0.15 else rng.choice(self.words)
+            links.append(f'<li><a href="{url}">{text}</a></li>')
+        body = (
+            f"<html><body><p>{rng.choice(self.paragraphs)}</p><ul>{''.join(links)}</ul>"
+            f"<p>{rng.choice(self.paragraphs)}</p></body></html>"
+        )
+        msg = MIMEText(body, 'html')
+        msg['Subject'] = f"{rng.choice(self.words).title()} links for this week"
+        return msg, len(body)
+
+    def _archive(self, variant):
+        """Nested zip for a variant, built once per worker"""
+        archive = self._archives.get(variant)
+        if archive is None:
+            with self._archives_lock:
+                archive = self._archives.get(variant)
+                if archive is None:
+                    archive = self._make_archive(variant)
+                    self._archives[variant] = archive
+        return archive
+
+    def _make_archive(self, variant):
+        rng = random.Random(f"archive:{variant}")
+        paragraphs = [rng.choice(self.paragraphs) for _ in range(40)]
+        # Incompressible filler, so every variant has its own fuzzy hash
+        filler = rng.randbytes(self.config.CONTENT_ARCHIVE_KB * 1024)
+        inner = _zip([("notes.txt", "\n\n".join(paragraphs[:10])), ("data.bin", filler)])
+        for level in range(max(0, self.config.CONTENT_ARCHIVE_DEPTH - 1)):
+            inner = _zip([
+                (f"report-{level}.docx", build_docx(paragraphs[level::3])),
+                (f"statement-{level}.pdf", build_pdf(paragraphs[level:level + 12])),
+                (f"archive-{level}.zip", inner),
+            ])
+        return inner
+
+    def _build_archive(self, rng):
+        msg = MIMEMultipart()
+        msg['Subject'] = f"Documents for {rng.choice(self.names)}"
+        text = rng.choice(self.paragraphs)
+        msg.attach(MIMEText(text, 'plain'))
+        archive = self._archive(rng.randrange(self.config.CONTENT_ARCHIVE_VARIANTS))
+        _attach(msg, archive, f"documents-{rng.getrandbits(24):06x}.zip", subtype="zip")
+        return msg, len(text) + len(archive)
+
+    def _build_eicar(self, rng):
+        msg = MIMEMultipart()
+        msg['Subject'] = f"Scanned file {rng.getrandbits(24):06x}"
+        text = rng.choice(self.paragraphs)
+        msg.attach(MIMEText(text, 'plain'))
+        if rng.random() < 0.5:
+            data, filename = EICAR, "eicar.com"
+        else:
+            data, filename = _zip([("eicar.com", EICAR)]), "eicar.zip"
+        _attach(msg, data, filename)
+        return msg, len(text) + len(data)
+
+    def _build_gtube(self, rng):
+        body = f"{rng.choice(self.paragraphs)}\n\n{GTUBE}\n\n{rng.choice(self.paragraphs)}\n"
+        msg = MIMEText(body, 'plain')
+        msg['Subject'] = self._spam_subject(rng)
+        return msg, len(body)
+
+    def _build_large_text(self, rng):
+        target = self.config.CONTENT_LARGE_TEXT_KB * 1024
+        parts, size = [], 0
+        while size < target:
+            paragraph = rng.choice(self.paragraphs)
+            parts.append(paragraph)
+            size += len(paragraph) + 2
+        body = "\n\n".join(parts)
+        msg = MIMEText(body, 'plain')
+        msg['Subject'] = f"Minutes: {rng.choice(self.words)} {rng.choice(self.words)} review"
+        return msg, len(body)
+
+
+_shared_mix = None
+_shared_mix_lock = threading.Lock()
+
+
+def get_content_mix():
+    """Return the ContentMix shared by all users in this worker"""
+    global _shared_mix
+    if _shared_mix is None:
+        with _shared_mix_lock:
+            if _shared_mix is None:
+                _shared_mix = ContentMix()
+    return _shared_mix
+
+
+def log_verdict_summary(environment, **kwargs):
+    """test_stop listener: accepted/rejected/deferred rates per content class"""
+    stats = environment.stats
+    lines = []
+    for content_class in CONTENT_CLASSES:
+        accepted = stats.entries.get((f"content.{content_class}", "SMTP"))
+        rejected = stats.entries.get((f"content.{content_class}.rejected", "SMTP"))
+        deferred = stats.entries.get((f"content.{content_class}.deferred", "SMTP"))
+        counts = [entry.num_requests if entry else 0 for entry in (accepted, rejected, deferred)]
+        failed = accepted.num_failures if accepted else 0
+        total = sum(counts)
+        if not total:
+            continue
+        ok = counts[0] - failed
+        p95 = accepted.get_response_time_percentile(0.95) if ok else 0
+        lines.append(
+            f"  {content_class:<11} {total:>7} sent  {ok / total:>6.1%} accepted  {counts[1] / total:>6.1%} rejected  "
+            f"{counts[2] / total:>6.1%} deferred  {failed / total:>6.1%} errors  accepted p95 {p95:.0f} ms"
+        )
+    if lines:
+        logger.info("Content classes:\n" + "\n".join(lines))
@@ -1,13 +1,22 @@
 # data_generator.py - Test data generation utilities
 import os
 import random
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.policy import SMTP
 from faker import Faker
-from config import EmailServerConfig
+from config import EmailServerConfig, MAIL_DOMAIN
+from message_corpus import MessageCorpus
 
 
 class TestDataGenerator:
     """Generate realistic test data for emails"""
     
+    # Pre-rendered message corpus, shared by all generators in the worker process
+    _corpus = None
+    _corpus_lock = threading.Lock()
+    
     def __init__(self):
         self.fake = Faker()
         self.config = EmailServerConfig()
@@ -118,4 +127,66 @@ class TestDataGenerator:
     
     def get_random_attachment(self):
         """Get a random attachment for testing"""
-        return random.choice(self.attachments)
\ No newline at end of file
+        return random.choice(self.attachments)
+    
+    def _padding(self, email_type, size):
+        """Generate filler paragraphs of roughly the given size"""
+        paragraphs = []
+        total = 0
+        while total < size:
+            paragraph = self.fake.paragraph(nb_sentences=8)
+            paragraphs.append(paragraph if email_type == 'plain_text' else f"<p>{paragraph}</p>")
+            total += len(paragraphs[-1]) + 1
+        return "\n".join(paragraphs)
+    
+    def build_message(self, email_type, size_class="small"):
+        """Serialize a message (without From/To/Date/Message-ID) for the corpus"""
+        content = self.generate_email_content(email_type)
+        body = content['body']
+        padding = MessageCorpus.SIZE_CLASSES[size_class]
+        if padding:
+            body += self._padding(email_type, padding)
+        
+        if email_type == 'plain_text':
+            msg = MIMEText(body, 'plain')
+        else:
+            msg = MIMEMultipart('alternative')
+            msg.attach(MIMEText(body, 'html'))
+        msg['Subject'] = content['subject']
+        return msg.as_bytes(policy=SMTP)
+    
+    def build_corpus(self):
+        """Build the shared message corpus for this worker process (idempotent)"""
+        with TestDataGenerator._corpus_lock:
+            if TestDataGenerator._corpus is None:
+                corpus = MessageCorpus(
+                    self.build_message,
+                    variants_per_key=self.config.MESSAGE_CORPUS_VARIANTS,
+                    max_bytes=self.config.MESSAGE_CORPUS_MAX_MB * 1024 * 1024,
+                    domain=MAIL_DOMAIN
+                )
+                corpus.warm(self.email_templates.keys(), self.config.MESSAGE_CORPUS_SIZE_CLASSES)
+                TestDataGenerator._corpus = corpus
+        return TestDataGenerator._corpus
+    
+    def render_message(self, email_type, sender, recipients, size_class=None, extra_headers=None, cc=None):
+        """Render a complete pre-serialized message for sendmail(); recipients and cc are header addresses"""
+        if email_type == "random":
+            email_type = random.choice(list(self.email_templates.keys()))
+        if size_class is None:
+            size_class = random.choice(self.config.MESSAGE_CORPUS_SIZE_CLASSES)
+        return self.build_corpus().render(email_type, size_class, sender, recipients, extra_headers, cc)
+
+
+_shared_generator = None
+_shared_generator_lock = threading.Lock()
+
+
+def get_data_generator():
+    """Return the TestDataGenerator shared by all users in this process"""
+    global _shared_generator
+    if _shared_generator is None:
+        with _shared_generator_lock:
+            if _shared_generator is None:
+                _shared_generator = TestDataGenerator()
+    return _shared_generator
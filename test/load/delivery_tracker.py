@@ -0,0 +1,105 @@
+# delivery_tracker.py - End-to-end delivery latency tracking
+#
+# SMTP users stamp every message with a unique token and its send time. Messages
+# addressed to a mailbox watched by a DeliveryTrackerUser in the same worker
+# process are also registered here. When the tracker sees the token arrive in the
+# mailbox (IMAP IDLE or polling), the submit -> mailbox latency is reported as
+# "E2E delivery"; messages that do not arrive within the timeout, or that are
+# evicted because the pending table is full, are reported as "E2E delivery_lost".
+#
+# Only mailboxes watched in this process are registered, so a distributed run
+# never counts a message as lost because it arrived at another worker's tracker.
+#
+import os
+import time
+import random
+import itertools
+import threading
+from collections import OrderedDict
+
+TOKEN_HEADER = "X-Loadtest-Token"
+SENT_HEADER = "X-Loadtest-Sent"
+
+
+class DeliveryTracker:
+    """Bounded table of in-flight messages awaiting delivery"""
+
+    def __init__(self, timeout, max_pending):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._pending = OrderedDict()  # token -> (sent_at, recipient), oldest first
+        self._watched = {}             # mailbox -> number of trackers watching it
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._prefix = f"{os.getpid()}-{random.getrandbits(32):08x}"
+        self.delivered = 0
+        self.lost = 0
+
+    def watch(self, mailbox):
+        """Start matching arrivals for a mailbox"""
+        with self._lock:
+            self._watched[mailbox] = self._watched.get(mailbox, 0) + 1
+
+    def unwatch(self, mailbox):
+        """Stop matching arrivals for a mailbox"""
+        with self._lock:
+            remaining = self._watched.get(mailbox, 0) - 1
+            if remaining > 0:
+                self._watched[mailbox] = remaining
+            else:
+                self._watched.pop(mailbox, None)
+
+    def stamp(self, recipients):
+        """Return the tracking headers for a new message and register it if watched"""
+        token = f"{self._prefix}-{next(self._counter)}"
+        sent_at = time.time()
+        tracked = [r for r in recipients if r in self._watched]
+        evicted = []
+        if tracked:
+            with self._lock:
+                for recipient in tracked:
+                    self._pending[(token, recipient)] = sent_at
+                while len(self._pending) > self.max_pending:
+                    evicted.append(self._pending.popitem(last=False))
+        self.lost += len(evicted)
+        return {TOKEN_HEADER: token, SENT_HEADER: f"{sent_at:.6f}"}, len(evicted)
+
+    def match(self, token, recipient, arrived_at=None):
+        """Return the delivery latency in seconds for an arrival, or None if unknown"""
+        with self._lock:
+            sent_at = self._pending.pop((token, recipient), None)
+        if sent_at is None:
+            return None
+        self.delivered += 1
+        return (arrived_at or time.time()) - sent_at
+
+    def expire(self, now=None):
+        """Drop and return the number of messages pending for longer than the timeout"""
+        deadline = (now or time.time()) - self.timeout
+        expired = 0
+        with self._lock:
+            while self._pending:
+                key, sent_at = next(iter(self._pending.items()))
+                if sent_at > deadline:
+                    break
+                self._pending.popitem(last=False)
+                expired += 1
+        self.lost += expired
+        return expired
+
+    def pending(self):
+        """Number of messages still in flight"""
+        return len(self._pending)
+
+
+_shared_tracker = None
+_shared_tracker_lock = threading.Lock()
+
+
+def get_delivery_tracker(timeout=300, max_pending=10000):
+    """Return the delivery tracker shared by all users in this process"""
+    global _shared_tracker
+    with _shared_tracker_lock:
+        if _shared_tracker is None:
+            _shared_tracker = DeliveryTracker(timeout, max_pending)
+    return _shared_tracker
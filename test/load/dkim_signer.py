@@ -0,0 +1,165 @@
+# dkim_signer.py - DKIM signatures (RFC 6376) for the inbound MX workload
+#
+# Every message arriving on port 25 is DKIM-checked by rspamd and OpenDKIM: a DNS
+# TXT lookup for <selector>._domainkey.<domain> and, if a key is published, an RSA
+# verification of the signed headers and the body hash. MXRelayLoadTester signs a
+# share of its messages (MX_DKIM_SHARE) so that cost is part of the MX latencies.
+#
+# Signatures are rsa-sha256 with relaxed/relaxed canonicalization, computed in plain
+# Python (pow() with the CRT) so the suite needs no crypto package. A 2048-bit
+# signature costs around 10ms of worker CPU; at high signed-message rates check the
+# worker CPU (see harness_profiler.py) or give MX_DKIM_KEY a 1024-bit key.
+#
+# The private key is read from MX_DKIM_KEY (PEM, PKCS#1 or unencrypted PKCS#8); if
+# the file does not exist a 2048-bit key is created with the openssl CLI. The TXT
+# record to publish is logged when the key is loaded. Without it verifiers still do the DNS lookup but stop at "no key"
+# (dkim=permerror) instead of verifying the signature.
+#
+import os
+import re
+import time
+import base64
+import hashlib
+import logging
+import subprocess
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# DigestInfo prefix of a SHA-256 hash in an EMSA-PKCS1-v1_5 signature (RFC 8017 9.2)
+_SHA256_PREFIX = bytes.fromhex("3031300d060960864801650304020105000420")
+_RSA_ENCRYPTION = bytes.fromhex("2a864886f70d010101")  # OID 1.2.840.113549.1.1.1
+_PEM = re.compile(rb"-----BEGIN ([A-Z ]+)-----(.*?)-----END \1-----", re.DOTALL)
+_WSP = re.compile(rb"[ \t]+")
+_FOLD = re.compile(rb"\r\n(?=[ \t])")
+
+
+def _der_items(data):
+    """Decode a run of DER TLVs into [(tag, content), ...]"""
+    items, offset = [], 0
+    while offset < len(data):
+        tag, length = data[offset], data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            count = length & 0x7f
+            length = int.from_bytes(data[offset:offset + count], "big")
+            offset += count
+        items.append((tag, data[offset:offset + length]))
+        offset += length
+    return items
+
+
+def _der(tag, content):
+    """Encode one DER TLV"""
+    length = len(content)
+    if length < 0x80:
+        return bytes((tag, length)) + content
+    size = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes((tag, 0x80 | len(size))) + size + content
+
+
+def _der_integer(value):
+    return _der(0x02, value.to_bytes(value.bit_length() // 8 + 1, "big"))
+
+
+class RSAKey(namedtuple('RSAKey', ['n', 'e', 'd', 'p', 'q', 'dp', 'dq', 'qinv'])):
+    """RSA private key in the CRT form of PKCS#1"""
+
+    @property
+    def size(self):
+        """Modulus length in bytes"""
+        return (self.n.bit_length() + 7) // 8
+
+    def sign(self, digest):
+        """RSASSA-PKCS1-v1_5 signature of a SHA-256 digest"""
+        t = _SHA256_PREFIX + digest
+        m = int.from_bytes(b"\x00\x01" + b"\xff" * (self.size - len(t) - 3) + b"\x00" + t, "big")
+        s1, s2 = pow(m, self.dp, self.p), pow(m, self.dq, self.q)
+        return (s2 + self.qinv * (s1 - s2) % self.p * self.q).to_bytes(self.size, "big")
+
+    def public_key(self):
+        """Base64 SubjectPublicKeyInfo, the p= tag of the DNS record"""
+        algorithm = _der(0x30, _der(0x06, _RSA_ENCRYPTION) + _der(0x05, b""))
+        key = _der(0x30, _der_integer(self.n) + _der_integer(self.e))
+        return base64.b64encode(_der(0x30, algorithm + _der(0x03, b"\x00" + key))).decode()
+
+
+def load_private_key(path):
+    """Read an unencrypted RSA private key from a PEM file"""
+    with open(path, "rb") as f:
+        match = _PEM.search(f.read())
+    if match is None:
+        raise ValueError(f"{path} is not a PEM file")
+    label, der = match.group(1), base64.b64decode(b"".join(match.group(2).split()))
+    if label == b"PRIVATE KEY":
+        der = _der_items(_der_items(der)[0][1])[2][1]  # PKCS#8: the PKCS#1 key is the OCTET STRING
+    elif label != b"RSA PRIVATE KEY":
+        raise ValueError(f"{path}: expected an unencrypted RSA private key, found {label.decode()}")
+    numbers = [int.from_bytes(content, "big") for _, content in _der_items(_der_items(der)[0][1])]
+    return RSAKey(*numbers[1:9])
+
+
+def ensure_private_key(path, bits=2048):
+    """Return the key at path, creating it with openssl if needed"""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        subprocess.run(["openssl", "genrsa", "-out", path, str(bits)],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        logger.info(f"DKIM: created {bits}-bit key {path}")
+    return load_private_key(path)
+
+
+def relaxed_header(name, value):
+    """Relaxed header canonicalization (RFC 6376 3.4.2)"""
+    value = _WSP.sub(b" ", _FOLD.sub(b"", value)).strip(b" \r\n")
+    return name.strip().lower() + b":" + value + b"\r\n"
+
+
+def relaxed_body(body):
+    """Relaxed body canonicalization (RFC 6376 3.4.4)"""
+    lines = [_WSP.sub(b" ", line).rstrip(b" ") for line in body.split(b"\r\n")]
+    while lines and not lines[-1]:
+        lines.pop()
+    return b"\r\n".join(lines) + b"\r\n" if lines else b""
+
+
+def header_fields(head):
+    """[(name, value), ...] of a header block, values with their folding"""
+    fields = []
+    for line in head.split(b"\r\n"):
+        if line[:1] in (b" ", b"\t") and fields:
+            fields[-1][1] += b"\r\n" + line
+        elif b":" in line:
+            name, _, value = line.partition(b":")
+            fields.append([name, value])
+    return fields
+
+
+class DKIMSigner:
+    """Adds a DKIM-Signature header to serialized messages"""
+
+    HEADERS = (b"from", b"to", b"cc", b"subject", b"date", b"message-id", b"mime-version", b"content-type")
+
+    def __init__(self, key, selector):
+        self.key = key
+        self.selector = selector
+
+    def record(self):
+        """TXT record to publish at <selector>._domainkey.<domain>"""
+        return f"v=DKIM1; k=rsa; p={self.key.public_key()}"
+
+    def sign(self, message, domain):
+        """Return message (bytes with CRLF line endings) signed for d=domain"""
+        head, _, body = message.partition(b"\r\n\r\n")
+        fields = {name.strip().lower(): (name, value) for name, value in header_fields(head)}
+        signed = [name for name in self.HEADERS if name in fields]
+        body_hash = base64.b64encode(hashlib.sha256(relaxed_body(body)).digest())
+        tags = (
+            f"v=1; a=rsa-sha256; c=relaxed/relaxed; d={domain}; s={self.selector};\r\n"
+            f"\tt={int(time.time())}; h={':'.join(name.decode() for name in signed)};\r\n"
+            f"\tbh={body_hash.decode()};\r\n\tb="
+        ).encode()
+        data = b"".join(relaxed_header(*fields[name]) for name in signed)
+        data += relaxed_header(b"DKIM-Signature", tags)[:-2]
+        signature = base64.b64encode(self.key.sign(hashlib.sha256(data).digest()))
+        return b"DKIM-Signature: " + tags + signature + b"\r\n" + message
@@ -0,0 +1,205 @@
+# endpoint_discovery.py - Shared IMAP endpoint discovery with circuit breakers
+#
+# EmailServerConfig.IMAP_CONFIGS lists the ways to reach IMAP in order of preference
+# (implicit TLS, STARTTLS, plain). Walking that list per user means that during a
+# partial outage every user pays a connect timeout on each dead port before it
+# finds a live one, which stalls the worker and turns the connect latency into a
+# measure of the timeout. Instead, each worker keeps one EndpointDirectory:
+#
+#   - the first user to connect probes all endpoints concurrently (TCP connect,
+#     greeting, STARTTLS where configured; no login), with CONNECT_TIMEOUT and
+#     READ_TIMEOUT on every socket, and all users share the result
+#   - the probe is repeated in the background every ENDPOINT_REVALIDATE_SECONDS
+#   - every endpoint has a circuit breaker: a failed probe, or
+#     ENDPOINT_FAILURE_THRESHOLD consecutive connection failures reported by users,
+#     opens it, and users skip the endpoint without touching the network. After
+#     ENDPOINT_COOLDOWN_SECONDS one user may try it again (half-open); a success or
+#     a passing probe closes it
+#
+# Login failures are per account and never count against an endpoint. The breakers
+# show up in the stats as IMAP rows named endpoint.<key>.<event>:
+#
+#   probe          each probe; failed probes are failures
+#   breaker_open   the breaker opened (a failure, with the last error)
+#   short_circuit  a connection attempt skipped the endpoint because it was open
+#
+import time
+import logging
+import threading
+
+import gevent
+from locust import events
+
+from config import EmailServerConfig
+from imap_session import TimedIMAP4, TimedIMAP4_SSL
+from tls_context import get_client_context
+
+logger = logging.getLogger(__name__)
+
+
+def endpoint_key(config):
+    """Short stats name of an IMAP_CONFIGS entry, e.g. imaps:993 or imap+starttls:143"""
+    scheme = "imaps" if config.get("ssl") else "imap+starttls" if config.get("starttls") else "imap"
+    return f"{scheme}:{config['port']}"
+
+
+class CircuitBreaker:
+    """closed -> open after failures -> half-open after a cooldown -> closed on success"""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self, now=None):
+        """True if a connection attempt may use the endpoint"""
+        now = now or time.monotonic()
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and now - self.opened_at >= self.cooldown:
+                self.state = "half_open"  # let exactly one trial through
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self, now=None, force=False):
+        """Count a failure; returns True if this opened the breaker"""
+        now = now or time.monotonic()
+        with self._lock:
+            self.failures += 1
+            if self.state == "open":
+                return False
+            if force or self.state == "half_open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_at = now
+                return True
+            return False
+
+
+class Endpoint:
+    """One IMAP_CONFIGS entry and its breaker"""
+
+    def __init__(self, config, breaker):
+        self.config = config
+        self.key = endpoint_key(config)
+        self.breaker = breaker
+
+
+class EndpointDirectory:
+    """Per-worker view of which IMAP endpoints are usable"""
+
+    def __init__(self, environment, config=EmailServerConfig):
+        self.environment = environment
+        self.config = config
+        self.endpoints = [
+            Endpoint(entry, CircuitBreaker(config.ENDPOINT_FAILURE_THRESHOLD, config.ENDPOINT_COOLDOWN_SECONDS))
+            for entry in config.IMAP_CONFIGS
+        ]
+        self.probed_at = None
+        self._probing = None  # greenlet of the probe in progress
+
+    def _fire(self, endpoint, event, response_time=0, exception=None):
+        self.environment.events.request.fire(
+            request_type="IMAP",
+            name=f"endpoint.{endpoint.key}.{event}",
+            response_time=response_time,
+            response_length=0,
+            exception=exception
+        )
+
+    def candidates(self):
+        """Endpoints to try, in order of preference, skipping open breakers"""
+        self._refresh()
+        allowed = []
+        for endpoint in self.endpoints:
+            if endpoint.breaker.allow():
+                allowed.append(endpoint)
+            else:
+                self._fire(endpoint, "short_circuit")
+        return allowed
+
+    def record(self, endpoint, exception=None):
+        """Report a user's connection attempt; exception is None if the endpoint worked
+        (a refused login still means the endpoint is reachable)"""
+        if exception is None:
+            endpoint.breaker.success()
+        elif endpoint.breaker.failure():
+            self._opened(endpoint, exception)
+
+    def _opened(self, endpoint, exception):
+        logger.warning(f"IMAP endpoint {endpoint.key} unavailable, skipping it for "
+                       f"{self.config.ENDPOINT_COOLDOWN_SECONDS:.0f}s: {type(exception).__name__}: {exception}")
+        self._fire(endpoint, "breaker_open", exception=exception)
+
+    def _refresh(self):
+        """Probe on first use (everyone waits) and in the background when stale"""
+        stale = (self.probed_at is None
+                 or time.monotonic() - self.probed_at >= self.config.ENDPOINT_REVALIDATE_SECONDS)
+        if stale and self._probing is None:
+            self._probing = gevent.spawn(self.probe)
+        if self.probed_at is None and self._probing is not None:
+            self._probing.join()
+
+    def probe(self):
+        """Probe every endpoint concurrently and update the breakers"""
+        try:
+            gevent.joinall([gevent.spawn(self._probe, endpoint) for endpoint in self.endpoints])
+            self.probed_at = time.monotonic()
+        finally:
+            self._probing = None
+
+    def _probe(self, endpoint):
+        config = endpoint.config
+        start_time = time.time()
+        mail = None
+        try:
+            if config.get("ssl"):
+                mail = TimedIMAP4_SSL(self.config.IMAP_SERVER, config["port"], ssl_context=get_client_context(),
+                                      timeout=self.config.CONNECT_TIMEOUT, read_timeout=self.config.READ_TIMEOUT)
+            else:
+                mail = TimedIMAP4(self.config.IMAP_SERVER, config["port"], timeout=self.config.CONNECT_TIMEOUT,
+                                  read_timeout=self.config.READ_TIMEOUT)
+                if config.get("starttls"):
+                    mail.starttls(ssl_context=get_client_context())
+            mail.logout()
+        except Exception as e:
+            self._fire(endpoint, "probe", (time.time() - start_time) * 1000, e)
+            if endpoint.breaker.failure(force=True):
+                self._opened(endpoint, e)
+            if mail is not None:
+                try:
+                    mail.shutdown()
+                except Exception:
+                    pass
+            return
+        self._fire(endpoint, "probe", (time.time() - start_time) * 1000)
+        endpoint.breaker.success()
+
+
+_shared_directory = None
+_shared_directory_lock = threading.Lock()
+
+
+@events.test_start.add_listener
+def _reset_directory(**kwargs):
+    """Rediscover endpoints at the start of every run"""
+    global _shared_directory
+    with _shared_directory_lock:
+        _shared_directory = None
+
+
+def get_endpoint_directory(environment):
+    """Return the EndpointDirectory shared by all IMAP users in this worker"""
+    global _shared_directory
+    with _shared_directory_lock:
+        if _shared_directory is None:
+            _shared_directory = EndpointDirectory(environment)
+    return _shared_directory
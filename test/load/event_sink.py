@@ -0,0 +1,215 @@
+# event_sink.py - Low-overhead structured event recording
+#
+# Per-operation log lines ("Attempting IMAP connection ...", "Inbox check
+# successful ...", every SMTP rate-limit hit) are formatted and written
+# synchronously by the logging module. At thousands of operations per second that
+# costs a measurable share of worker CPU and blocks the gevent loop on file writes,
+# which shows up in the very latencies being measured.
+#
+# With EVENT_SINK enabled, the per-operation events go to an EventSink instead:
+#
+#   - recording an event appends a (time, level, event, fields) tuple to a bounded
+#     ring buffer of EVENT_BUFFER_SIZE records; nothing is formatted on the hot path
+#   - events below EVENT_LEVEL are dropped, and debug/info events are sampled at
+#     EVENT_SAMPLE_RATE; warnings and errors are always kept
+#   - a background greenlet swaps the buffer out every EVENT_FLUSH_SECONDS and
+#     serializes and writes the batch in gevent's thread pool, so the users keep
+#     running during the write
+#   - if the buffer fills up between flushes the oldest records are overwritten and
+#     the loss is written to the file as a "sink.dropped" record
+#
+# With EVENT_TRACE_REQUESTS every Locust request event (including the connect.* and
+# other sub-rows) is also recorded, so a full per-operation trace can stay on in
+# large runs. The output is NDJSON, one compact object per line:
+#
+#   {"t":1760780000.123456,"lvl":"info","ev":"request","type":"IMAP","name":"connect","ms":9.6,"len":0}
+#
+# Each worker writes its own file (EVENT_LOG with ".w<index>" before the extension).
+# Modules get an EventRecorder with event_recorder(__name__) and call
+# recorder.info("imap.login", port=993, ...); without a sink the event falls back to
+# the module's logger, formatted only if that level is enabled.
+#
+import os
+import json
+import time
+import random
+import logging
+import collections
+
+import gevent
+import gevent.lock
+from locust.runners import MasterRunner, WorkerRunner
+
+from config import EmailServerConfig
+
+logger = logging.getLogger(__name__)
+
+_sink = None  # the EventSink of this process, if enabled
+
+
+class _Message:
+    """Lazy "event key=value ..." rendering for the logging fallback"""
+
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join([self.event] + [f"{key}={value}" for key, value in self.fields.items()])
+
+
+class EventRecorder:
+    """Logger-like front end that records into the process's EventSink"""
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def log(self, level, event, **fields):
+        sink = _sink
+        if sink is not None:
+            sink.record(level, event, fields)
+        elif self.logger.isEnabledFor(level):
+            self.logger.log(level, "%s", _Message(event, fields))
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+
+def event_recorder(name):
+    """Return an EventRecorder for a module, like logging.getLogger()"""
+    return EventRecorder(name)
+
+
+class EventSink:
+    """Ring buffer of structured events, flushed to an NDJSON file in batches"""
+
+    def __init__(self, path, level=logging.INFO, sample_rate=1.0, buffer_size=100000, flush_seconds=1.0):
+        self.path = path
+        self.level = level
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.flush_seconds = flush_seconds
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.written = 0
+        # Own generator, so sampling does not disturb seeded traffic (LOADTEST_SEED)
+        self.rng = random.Random()
+        self.file = None
+        self._flusher = None
+        self._write_lock = gevent.lock.BoundedSemaphore()  # one batch at a time, in order
+
+    def record(self, level, event, fields):
+        """Buffer one event; cheap enough for every operation"""
+        if level < self.level:
+            return
+        if level < logging.WARNING and self.sample_rate < 1.0 and self.rng.random() >= self.sample_rate:
+            return
+        if len(self.buffer) == self.buffer_size:
+            self.dropped += 1  # the deque overwrites the oldest record
+        self.buffer.append((time.time(), level, event, fields))
+
+    def on_request(self, request_type, name, response_time, response_length, exception=None, **kwargs):
+        """events.request listener: one record per operation"""
+        if exception is None:
+            self.record(logging.INFO, "request",
+                        {"type": request_type, "name": name, "ms": response_time, "len": response_length})
+        else:
+            self.record(logging.WARNING, "request",
+                        {"type": request_type, "name": name, "ms": response_time, "len": response_length,
+                         "err": f"{type(exception).__name__}: {exception}"})
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = gevent.spawn(self._run)
+
+    def stop(self):
+        """Stop the flusher, write what is left and close the file"""
+        if self._flusher is not None:
+            with self._write_lock:  # not in the middle of a write
+                self._flusher.kill()
+            self._flusher = None
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _run(self):
+        while True:
+            gevent.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Event sink flush to {self.path} failed: {e}")
+
+    def flush(self):
+        """Swap the buffer out and write it from gevent's thread pool"""
+        if not self.buffer and not self.dropped:
+            return
+        batch, self.buffer = self.buffer, collections.deque(maxlen=self.buffer_size)
+        dropped, self.dropped = self.dropped, 0
+        if dropped:
+            batch.append((time.time(), logging.WARNING, "sink.dropped", {"count": dropped}))
+            logger.warning(f"Event sink buffer full: {dropped} records dropped; "
+                           f"raise EVENT_BUFFER_SIZE or lower EVENT_SAMPLE_RATE")
+        with self._write_lock:
+            gevent.get_hub().threadpool.apply(self._write, (batch,))
+        self.written += len(batch)
+
+    def _write(self, batch):
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, "a", buffering=1024 * 1024)
+        dumps = json.dumps
+        lines = []
+        for timestamp, level, event, fields in batch:
+            entry = {"t": round(timestamp, 6), "lvl": _LEVEL_NAMES.get(level, level), "ev": event}
+            entry.update(fields)
+            lines.append(dumps(entry, separators=(",", ":"), default=str))
+        lines.append("")
+        self.file.write("\n".join(lines))
+        self.file.flush()
+
+
+_LEVEL_NAMES = {logging.DEBUG: "debug", logging.INFO: "info", logging.WARNING: "warning",
+                logging.ERROR: "error", logging.CRITICAL: "critical"}
+
+
+def worker_path(path, environment):
+    """EVENT_LOG for this process: workers get ".w<index>" before the extension"""
+    if not isinstance(environment.runner, WorkerRunner):
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.w{environment.runner.worker_index}{extension}"
+
+
+def register_event_sink(environment, config=EmailServerConfig):
+    """Route per-operation events of this process to an EventSink"""
+    global _sink
+    if isinstance(environment.runner, MasterRunner):
+        return None  # the master runs no users
+    level = logging.getLevelName(config.EVENT_LEVEL.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"EVENT_LEVEL must be debug, info, warning or error, not {config.EVENT_LEVEL!r}")
+    sink = EventSink(worker_path(config.EVENT_LOG, environment), level, config.EVENT_SAMPLE_RATE,
+                     config.EVENT_BUFFER_SIZE, config.EVENT_FLUSH_SECONDS)
+    if config.EVENT_TRACE_REQUESTS:
+        environment.events.request.add_listener(sink.on_request)
+    environment.events.test_start.add_listener(lambda **kwargs: sink.start())
+    environment.events.test_stop.add_listener(lambda **kwargs: sink.flush())
+    environment.events.quitting.add_listener(lambda **kwargs: sink.stop())
+    _sink = sink
+    logger.info(f"Recording events to {sink.path} (level {config.EVENT_LEVEL}, sample rate {config.EVENT_SAMPLE_RATE})")
+    return sink
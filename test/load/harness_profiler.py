@@ -0,0 +1,291 @@
+# harness_profiler.py - Self-profiling of the Locust client
+#
+# When throughput plateaus, the limit may be the worker rather than Silver: Faker
+# in generate_email_content, MIME serialization, base64 of attachments and TLS
+# handshakes all run on the one gevent thread, and while it is busy every other
+# user's network wait is stretched. This module shows where the worker's time goes
+# and reports it as PROFILE rows next to the request stats:
+#
+#   worker.cpu       every PROFILE_RESOURCE_SECONDS; response time = CPU of the
+#                    worker process in % of one core, response length = RSS in MB
+#
+# and, with HARNESS_PROFILE enabled:
+#
+#   task.<name>      per task run; response time = CPU ms spent by the user's
+#                    greenlet, response length = that CPU as % of the task's wall
+#                    time (low = waiting on the network, high = client-bound)
+#   phase.<name>     the same for each PhaseTimer phase (connect.tls_full,
+#                    connect.auth, send.data, ...)
+#   gevent.loop_lag  every PROFILE_LOOP_LAG_INTERVAL; how late a timer fired, i.e.
+#                    how long some greenlet held the loop without yielding
+#
+# Per-greenlet CPU comes from a greenlet switch tracer that charges thread CPU time
+# (time.thread_time()) to the greenlet that was running; it costs about a
+# microsecond per switch, so it is off by default.
+#
+# With PROFILE_SAMPLER a native thread samples the stack of the gevent thread
+# PROFILE_SAMPLE_HZ times a second and writes them to PROFILE_OUTPUT at the end of
+# each run in the folded format of flamegraph.pl, speedscope and inferno
+# ("frame;frame;frame count" per line). Stacks ending in the hub are idle time.
+#
+# Independently of these settings the worker warns when its CPU use exceeds
+# PROFILE_CPU_WARN_PERCENT, and summarizes at the end of the run how often it did,
+# since the numbers of a client-bound run describe the client, not the server.
+#
+import os
+import sys
+import time
+import logging
+import collections
+
+import gevent
+import greenlet
+import psutil
+from gevent import monkey
+from locust.runners import MasterRunner
+
+from config import EmailServerConfig
+from phase_timer import PhaseTimer
+from event_sink import worker_path
+
+logger = logging.getLogger(__name__)
+
+
+class GreenletCPU:
+    """Charges thread CPU time to the greenlet that was running"""
+
+    def __init__(self):
+        self._last = time.thread_time()
+        self._previous = None
+        self._installed = False
+
+    def install(self):
+        if not self._installed:
+            self._last = time.thread_time()
+            self._previous = greenlet.settrace(self._on_switch)
+            self._installed = True
+
+    def uninstall(self):
+        if self._installed:
+            greenlet.settrace(self._previous)
+            self._installed = False
+
+    def _on_switch(self, event, args):
+        now = time.thread_time()
+        origin = args[0]
+        origin.profile_cpu = getattr(origin, "profile_cpu", 0.0) + now - self._last
+        self._last = now
+        if self._previous is not None:
+            self._previous(event, args)
+
+    def current(self):
+        """CPU seconds used so far by the calling greenlet"""
+        return getattr(greenlet.getcurrent(), "profile_cpu", 0.0) + time.thread_time() - self._last
+
+
+class StackSampler:
+    """Native thread sampling the gevent thread's stack into folded stacks"""
+
+    def __init__(self, path, hz):
+        self.path = path
+        self.interval = 1.0 / hz
+        self.stacks = collections.Counter()
+        self.running = False
+        # Locust monkey-patches threading; the sampler must be a real thread
+        self._sleep = monkey.get_original("time", "sleep")
+        self._get_ident = monkey.get_original("_thread", "get_ident")
+        self._start_thread = monkey.get_original("_thread", "start_new_thread")
+        self._target = None
+
+    def start(self):
+        if not self.running:
+            self.stacks.clear()
+            self._target = self._get_ident()
+            self.running = True
+            self._start_thread(self._run, ())
+
+    def _run(self):
+        while self.running:
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self.stacks[self._fold(frame)] += 1
+            self._sleep(self.interval)
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None and len(names) < 128:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def stop(self):
+        """Stop sampling and write the folded stacks"""
+        if not self.running:
+            return
+        self.running = False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Profile: {sum(self.stacks.values())} stack samples written to {self.path}")
+
+
+class ResourceMonitor:
+    """Worker CPU and RSS, with a warning when the client is the bottleneck"""
+
+    def __init__(self, environment, config=EmailServerConfig):
+        self.environment = environment
+        self.interval = config.PROFILE_RESOURCE_SECONDS
+        self.threshold = config.PROFILE_CPU_WARN_PERCENT
+        self.report = config.HARNESS_PROFILE
+        self.process = psutil.Process()
+        self.samples = self.hot = 0
+        self.peak = 0.0
+        self.last_warning = None
+        self._greenlet = None
+
+    def start(self):
+        self.samples = self.hot = 0
+        self.peak = 0.0
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+        if self.hot:
+            logger.warning(
+                f"Worker CPU was above {self.threshold:.0f}% in {self.hot} of {self.samples} samples "
+                f"(peak {self.peak:.0f}%): this run measured the load generator, not just the server"
+            )
+
+    def _run(self):
+        times = self.process.cpu_times()
+        last_cpu, last_wall = times.user + times.system, time.monotonic()
+        while True:
+            gevent.sleep(self.interval)
+            times = self.process.cpu_times()
+            cpu, wall = times.user + times.system, time.monotonic()
+            percent = (cpu - last_cpu) / (wall - last_wall) * 100
+            last_cpu, last_wall = cpu, wall
+            self._sample(percent, self.process.memory_info().rss)
+
+    def _sample(self, percent, rss):
+        self.samples += 1
+        self.peak = max(self.peak, percent)
+        if self.report:
+            self.environment.events.request.fire(
+                request_type="PROFILE",
+                name="worker.cpu",
+                response_time=percent,
+                response_length=rss // (1024 * 1024),
+                exception=None
+            )
+        if self.threshold and percent >= self.threshold:
+            self.hot += 1
+            now = time.monotonic()
+            if self.last_warning is None or now - self.last_warning >= 60:
+                self.last_warning = now
+                logger.warning(f"Worker CPU at {percent:.0f}% (threshold {self.threshold:.0f}%): "
+                               f"results are likely client-bound; add workers or lower the load")
+
+
+class HarnessProfiler:
+    """CPU versus wall time per task and phase, and gevent loop lag"""
+
+    def __init__(self, environment, config=EmailServerConfig):
+        self.environment = environment
+        self.loop_interval = config.PROFILE_LOOP_LAG_INTERVAL
+        self.cpu = GreenletCPU()
+        self._wrapped = {}
+        self._greenlet = None
+
+    def _fire(self, name, cpu_ms, wall_ms):
+        self.environment.events.request.fire(
+            request_type="PROFILE",
+            name=name,
+            response_time=cpu_ms,
+            response_length=int(round(cpu_ms / wall_ms * 100)) if wall_ms > 0 else 0,
+            exception=None
+        )
+
+    def wrap_tasks(self, user_classes):
+        """Time every task function of the given user classes"""
+        for user_class in user_classes:
+            user_class.tasks = [self._wrap(task) for task in user_class.tasks]
+
+    def _wrap(self, task):
+        if not callable(task) or isinstance(task, type):
+            return task  # nested TaskSets time their own tasks
+        if task not in self._wrapped:
+            name = f"task.{task.__name__}"
+            cpu = self.cpu
+
+            def profiled(user, *args, **kwargs):
+                wall_started, cpu_started = time.perf_counter(), cpu.current()
+                try:
+                    return task(user, *args, **kwargs)
+                finally:
+                    self._fire(name, (cpu.current() - cpu_started) * 1000,
+                               (time.perf_counter() - wall_started) * 1000)
+
+            profiled.__name__ = task.__name__
+            profiled.__wrapped__ = task
+            self._wrapped[task] = profiled
+            self._wrapped[profiled] = profiled
+        return self._wrapped[task]
+
+    def greenlet_cpu(self):
+        """CPU seconds of the calling greenlet (PhaseTimer hook)"""
+        return self.cpu.current()
+
+    def phase(self, name, wall_ms, cpu_ms):
+        """PhaseTimer hook: one finished phase"""
+        self._fire(f"phase.{name}", cpu_ms, wall_ms)
+
+    def start(self):
+        self.cpu.install()
+        PhaseTimer.profiler = self
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._loop_lag)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+        PhaseTimer.profiler = None
+        self.cpu.uninstall()
+
+    def _loop_lag(self):
+        while True:
+            started = time.perf_counter()
+            gevent.sleep(self.loop_interval)
+            lag = time.perf_counter() - started - self.loop_interval
+            self.environment.events.request.fire(
+                request_type="PROFILE",
+                name="gevent.loop_lag",
+                response_time=max(0.0, lag) * 1000,
+                response_length=0,
+                exception=None
+            )
+
+
+def register_harness_profiler(environment, config=EmailServerConfig):
+    """Start the resource monitor, and the profilers if enabled, with every run"""
+    if isinstance(environment.runner, MasterRunner):
+        return  # the master runs no users
+    parts = [ResourceMonitor(environment, config)]
+    if config.HARNESS_PROFILE:
+        profiler = HarnessProfiler(environment, config)
+        profiler.wrap_tasks(environment.user_classes)
+        parts.append(profiler)
+    if config.PROFILE_SAMPLER:
+        parts.append(StackSampler(worker_path(config.PROFILE_OUTPUT, environment), config.PROFILE_SAMPLE_HZ))
+    for part in parts:
+        environment.events.test_start.add_listener(lambda part=part, **kwargs: part.start())
+        environment.events.test_stop.add_listener(lambda part=part, **kwargs: part.stop())
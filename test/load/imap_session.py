@@ -0,0 +1,132 @@
+# imap_session.py - Helpers for long-lived IMAP sessions
+#
+# imaplib has no IDLE support before Python 3.14, so idle() drives RFC 2177 IDLE
+# directly over an authenticated imaplib connection. Waiting for a notification
+# uses gevent.Timeout (Locust always runs under gevent) rather than a socket
+# timeout, which would leave imaplib's buffered reader unusable.
+#
+# TimedIMAP4 and TimedIMAP4_SSL record connect.dns/tcp/tls_full|tls_resumed/
+# banner/auth into a PhaseTimer (see phase_timer.py) and can offer a saved TLS
+# session for resumption (see tls_context.py). timeout bounds the TCP connect and
+# read_timeout every later socket operation; idle() lifts the read timeout while
+# it waits for a notification.
+#
+import re
+import time
+import imaplib
+import gevent
+
+from phase_timer import PhaseTimer, create_connection
+from tls_context import get_client_context, with_session, handshake_phase
+
+_UNTAGGED = re.compile(rb'^\* (\d+) (EXISTS|EXPUNGE|RECENT|FETCH)\b', re.IGNORECASE)
+
+
+class TimedIMAP4(imaplib.IMAP4):
+    """imaplib.IMAP4 that times each connection phase.
+
+    "connect.banner" covers the greeting and the CAPABILITY command imaplib
+    sends right after it.
+    """
+
+    def __init__(self, host='', port=imaplib.IMAP4_PORT, timeout=None, timer=None, tls_session=None,
+                 read_timeout=None):
+        self.timer = timer or PhaseTimer()
+        self.tls_session = tls_session  # offered for resumption by STARTTLS
+        self.read_timeout = read_timeout
+        super().__init__(host, port, timeout)
+
+    def _create_socket(self, timeout):
+        return create_connection(self.timer, self.host or None, self.port, timeout,
+                                 read_timeout=self.read_timeout)
+
+    def _connect(self):
+        self.timer.start("connect.banner")
+        super()._connect()
+        self.timer.stop()
+
+    def starttls(self, ssl_context=None):
+        self.timer.start("connect.tls")
+        reply = super().starttls(with_session(ssl_context or get_client_context(), self.tls_session))
+        self.timer.stop(handshake_phase(self.sock))
+        return reply
+
+    def login(self, user, password):
+        self.timer.start("connect.auth")
+        reply = super().login(user, password)
+        self.timer.stop()
+        return reply
+
+
+class TimedIMAP4_SSL(TimedIMAP4, imaplib.IMAP4_SSL):
+    """imaplib.IMAP4_SSL that times each connection phase, including the handshake"""
+
+    def __init__(self, host='', port=imaplib.IMAP4_SSL_PORT, ssl_context=None, timeout=None, timer=None,
+                 tls_session=None, read_timeout=None):
+        self.timer = timer or PhaseTimer()
+        self.tls_session = tls_session
+        self.read_timeout = read_timeout
+        imaplib.IMAP4_SSL.__init__(self, host, port, ssl_context=ssl_context or get_client_context(),
+                                   timeout=timeout)
+
+    def _create_socket(self, timeout):
+        sock = TimedIMAP4._create_socket(self, timeout)
+        self.timer.start("connect.tls")
+        sock = with_session(self.ssl_context, self.tls_session).wrap_socket(sock, server_hostname=self.host)
+        self.timer.stop(handshake_phase(sock))
+        return sock
+
+
+def supports(mail, capability):
+    """True if the server advertised the capability"""
+    return capability.upper() in mail.capabilities
+
+
+def parse_untagged(lines):
+    """Extract (number, kind) pairs such as (12, 'EXISTS') from untagged responses"""
+    events = []
+    for line in lines:
+        match = _UNTAGGED.match(line)
+        if match:
+            events.append((int(match.group(1)), match.group(2).decode().upper()))
+    return events
+
+
+def idle(mail, timeout):
+    """Run one IDLE cycle on the selected mailbox.
+
+    Waits up to timeout seconds for the server to push an untagged response, then
+    ends IDLE with DONE. Returns (untagged_lines, notified_at), the time.time() at
+    which the first notification arrived or None when nothing arrived before the
+    timeout.
+    """
+    tag = mail._new_tag()
+    mail.tagged_commands.pop(tag, None)  # completion is read here, not by imaplib
+    mail.send(tag + b" IDLE\r\n")
+
+    lines = []
+    line = mail._get_line()
+    while line.startswith(b"* "):
+        lines.append(line)
+        line = mail._get_line()
+    if not line.startswith(b"+"):
+        raise mail.error(f"IDLE rejected: {line.decode(errors='replace')}")
+
+    notified_at = None
+    read_timeout = mail.sock.gettimeout()
+    mail.sock.settimeout(None)  # the wait is bounded by gevent.Timeout instead
+    try:
+        with gevent.Timeout(timeout, False):
+            lines.append(mail._get_line())
+            notified_at = time.time()
+    finally:
+        mail.sock.settimeout(read_timeout)
+
+    mail.send(b"DONE\r\n")
+    while True:
+        line = mail._get_line()
+        if line.startswith(tag):
+            if not line[len(tag):].strip().upper().startswith(b"OK"):
+                raise mail.error(f"IDLE failed: {line.decode(errors='replace')}")
+            return lines, notified_at
+        lines.append(line)
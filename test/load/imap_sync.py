@@ -0,0 +1,126 @@
+# imap_sync.py - Incremental mailbox synchronization
+#
+# Modern clients don't count a mailbox with SELECT + SEARCH ALL on every poll. They
+# remember UIDVALIDITY, the last UID seen and the highest mod-sequence, ask STATUS
+# whether anything changed, and only then fetch what is new:
+#
+#   unchanged - STATUS shows the same UIDNEXT, MESSAGES and HIGHESTMODSEQ; done
+#   qresync   - SELECT ... (QRESYNC (uidvalidity modseq)) returns flag changes and
+#               VANISHED UIDs, then new messages are fetched by UID (RFC 7162)
+#   condstore - SELECT ... (CONDSTORE), new messages by UID plus
+#               UID FETCH 1:<last> (FLAGS) (CHANGEDSINCE modseq)
+#   uidnext   - no CONDSTORE: new messages by UID plus a full FLAGS resync, which is
+#               what clients have to do without the extension
+#   full      - first poll or UIDVALIDITY changed: fetch UID and FLAGS for everything
+#
+import re
+
+from imap_session import supports
+
+_STATUS_ITEM = re.compile(rb'([A-Z]+) (\d+)')
+_FETCH_UID = re.compile(rb'\bUID (\d+)')
+
+
+class MailboxSyncState:
+    """What a client remembers about a mailbox between polls"""
+
+    def __init__(self, mailbox="INBOX"):
+        self.mailbox = mailbox
+        self.uidvalidity = None
+        self.last_uid = 0
+        self.messages = 0
+        self.highest_modseq = None
+
+
+def _status(mail, state, condstore):
+    """STATUS the mailbox and return its items as a dict of ints"""
+    items = "(UIDNEXT UIDVALIDITY MESSAGES HIGHESTMODSEQ)" if condstore else "(UIDNEXT UIDVALIDITY MESSAGES)"
+    typ, data = mail.status(state.mailbox, items)
+    if typ != 'OK':
+        raise mail.error(f"STATUS failed: {data}")
+    return {key.decode(): int(value) for key, value in _STATUS_ITEM.findall(data[0])}
+
+
+def _select(mail, state, parameters=None):
+    """SELECT with optional RFC 7162 parameters; returns the untagged lines received"""
+    if not parameters:
+        mail.select(state.mailbox)
+        return []
+    mail.untagged_responses.clear()
+    typ, data = mail._simple_command('SELECT', state.mailbox, parameters)
+    if typ != 'OK':
+        raise mail.error(f"SELECT {parameters} failed: {data}")
+    mail.state = 'SELECTED'
+    lines = mail.untagged_responses.get('FETCH', []) + mail.untagged_responses.get('VANISHED', [])
+    return lines
+
+
+def _fetch_uids(mail, uid_set, items, first_uid=1):
+    """UID FETCH and return the UIDs in the response (UID >= first_uid)"""
+    typ, data = mail.uid('FETCH', uid_set, items)
+    uids = []
+    for item in data or []:
+        response = item[0] if isinstance(item, tuple) else item
+        match = _FETCH_UID.search(response) if response else None
+        if match and int(match.group(1)) >= first_uid:
+            uids.append(int(match.group(1)))
+    return uids
+
+
+def sync_mailbox(mail, state):
+    """Bring state up to date with the server.
+
+    Returns (mode, changes) where mode is one of unchanged, full, qresync,
+    condstore or uidnext and changes counts new messages plus flag updates.
+    """
+    condstore = supports(mail, 'CONDSTORE') or supports(mail, 'QRESYNC')
+    qresync = supports(mail, 'QRESYNC')
+    if qresync and not getattr(mail, '_qresync_enabled', False):
+        # ENABLE is per connection and only valid before a mailbox is selected
+        mail.enable('QRESYNC')
+        mail._qresync_enabled = True
+
+    status = _status(mail, state, condstore)
+    uidnext = status.get('UIDNEXT', 0)
+    modseq = status.get('HIGHESTMODSEQ')
+
+    if state.uidvalidity is None or status.get('UIDVALIDITY') != state.uidvalidity:
+        _select(mail, state, '(CONDSTORE)' if condstore else None)
+        uids = _fetch_uids(mail, '1:*', '(UID FLAGS)') if status.get('MESSAGES') else []
+        state.uidvalidity = status.get('UIDVALIDITY')
+        state.last_uid = max(uids, default=max(uidnext - 1, 0))
+        state.messages = status.get('MESSAGES', len(uids))
+        state.highest_modseq = modseq
+        return 'full', len(uids)
+
+    if (uidnext - 1 <= state.last_uid
+            and status.get('MESSAGES') == state.messages
+            and (not condstore or modseq == state.highest_modseq)):
+        return 'unchanged', 0
+
+    changes = 0
+    if qresync and state.highest_modseq:
+        mode = 'qresync'
+        lines = _select(mail, state, f'(QRESYNC ({state.uidvalidity} {state.highest_modseq}))')
+        changes += len(lines)
+    elif condstore and state.highest_modseq:
+        mode = 'condstore'
+        _select(mail, state, '(CONDSTORE)')
+        if state.last_uid and state.messages:
+            changes += len(_fetch_uids(
+                mail, f'1:{state.last_uid}', f'(UID FLAGS) (CHANGEDSINCE {state.highest_modseq})'
+            ))
+    else:
+        mode = 'uidnext'
+        _select(mail, state)
+        if state.last_uid and state.messages:
+            changes += len(_fetch_uids(mail, f'1:{state.last_uid}', '(UID FLAGS)'))
+
+    new_uids = []
+    if uidnext - 1 > state.last_uid:
+        new_uids = _fetch_uids(mail, f'{state.last_uid + 1}:*', '(UID FLAGS)', first_uid=state.last_uid + 1)
+    changes += len(new_uids)
+    state.last_uid = max(new_uids, default=state.last_uid)
+    state.messages = status.get('MESSAGES', state.messages)
+    state.highest_modseq = modseq
+    return mode, changes
@@ -1,47 +1,87 @@
 # imap_tester.py - IMAP load testing tasks
+import re
 import time
-import ssl
 import imaplib
 import logging
-from locust import User, task, between
+import itertools
+import gevent
+from email.parser import BytesHeaderParser
+from locust import User, task, between, constant
 
 from config import EmailServerConfig
-from user_manager import TestUserManager
+from imap_session import TimedIMAP4, TimedIMAP4_SSL, idle, supports, parse_untagged
+from phase_timer import fire_phases
+from endpoint_discovery import get_endpoint_directory
+from tls_context import get_client_context, TLSSessionCache
+from imap_sync import MailboxSyncState, sync_mailbox
+from delivery_tracker import get_delivery_tracker, TOKEN_HEADER, SENT_HEADER
+from user_manager import get_user_manager, assign_account, get_partition
+from arrival_scheduler import arrival_wait_time, wait_for_first_arrival
+from event_sink import event_recorder
 
 logger = logging.getLogger(__name__)
+trace = event_recorder(__name__)  # per-operation events (see event_sink.py)
 
+_FETCH_UID = re.compile(rb'\bUID (\d+)')
 
-class IMAPLoadTester(User):
-    """IMAP Load Testing User with robust connection handling"""
-    wait_time = between(2, 8)
-    weight = 2
+# FETCH items for each IMAP_FETCH_STRATEGY other than the legacy per-message
+# "rfc822". All of them use BODY.PEEK so fetching does not set \Seen.
+FETCH_STRATEGIES = {
+    # Whole messages for the window in a single UID FETCH
+    "uid_range": "(UID RFC822.SIZE BODY.PEEK[])",
+    # Envelope-only listing from selected header fields
+    "headers": "(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (FROM TO CC SUBJECT DATE MESSAGE-ID)])",
+    # MIME structure plus the first bytes of each message (preview pane)
+    "partial": "(UID BODYSTRUCTURE BODY.PEEK[]<0.{partial_bytes}>)",
+    # Message list view
+    "envelope": "(UID FLAGS ENVELOPE RFC822.SIZE INTERNALDATE)",
+}
+
+
+def _fetched_uids(data):
+    """UIDs in the untagged responses of a FETCH that asked for UID"""
+    uids = set()
+    for item in data or []:
+        response = item[0] if isinstance(item, tuple) else item
+        match = _FETCH_UID.search(response) if response else None
+        if match:
+            uids.add(int(match.group(1)))
+    return uids
+
+
+class IMAPUserBase(User):
+    """Shared IMAP connection handling and mailbox operations"""
+    abstract = True
     
     def on_start(self):
         self.config = EmailServerConfig()
-        self.user_manager = TestUserManager()
-        self.user_account = self.user_manager.get_random_user()
-        self.working_config = None  # Cache working config
-        logger.info(f"Starting IMAP tests for user: {self.user_account['email']}")
+        self.user_manager = get_user_manager()
+        self.user_account, self.rng, self.recipients = self._assign_account()
+        self.tls_sessions = TLSSessionCache(self.config.TLS_SESSION_RESUMPTION)
+        trace.info("imap.user_start", user=self.user_account.email)
+    
+    def _assign_account(self):
+        """Account, random generator and recipient picker of this user"""
+        return assign_account(self.environment)
     
     def _create_ssl_context(self):
-        """Create a more permissive SSL context"""
+        """Return the permissive SSL context shared by all users in this worker"""
         try:
-            context = ssl.create_default_context()
-            # Allow older TLS versions for better compatibility
-            context.minimum_version = ssl.TLSVersion.TLSv1_2
-            # For testing environments with self-signed certificates
-            context.check_hostname = False
-            context.verify_mode = ssl.CERT_NONE
-            return context
+            return get_client_context()
         except Exception as e:
             logger.error(f"SSL context creation failed: {e}")
             return None
     
     def _try_imap_connection(self, config):
-        """Try a specific IMAP configuration"""
+        """Try a specific IMAP configuration.
+
+        Returns (mail, None) on success, (None, error) if the endpoint failed and
+        (None, None) if it worked but the login was refused.
+        """
         mail = None
+        login_refused = False
         try:
-            logger.info(f"Attempting IMAP connection: {config['name']} on port {config['port']} to {self.config.IMAP_SERVER}")
+            trace.info("imap.connect_attempt", endpoint=config['name'], server=self.config.IMAP_SERVER)
             
             if config.get("ssl", False):
                 # Direct SSL connection (port 993)
@@ -49,64 +89,68 @@ class IMAPLoadTester(User):
                 if context is None:
                     raise Exception("Failed to create SSL context")
                 
-                mail = imaplib.IMAP4_SSL(
+                mail = TimedIMAP4_SSL(
                     self.config.IMAP_SERVER, 
                     config["port"],
-                    ssl_context=context
+                    ssl_context=context,
+                    timeout=self.config.CONNECT_TIMEOUT,
+                    read_timeout=self.config.READ_TIMEOUT,
+                    tls_session=self.tls_sessions.get(self.config.IMAP_SERVER, config["port"])
                 )
-                logger.debug(f"SSL connection established on port {config['port']}")
+                trace.debug("imap.connected", port=config['port'], tls="implicit")
             else:
                 # Plain connection (port 143), possibly with STARTTLS
-                mail = imaplib.IMAP4(self.config.IMAP_SERVER, config["port"])
-                logger.debug(f"Plain connection established on port {config['port']}")
+                mail = TimedIMAP4(
+                    self.config.IMAP_SERVER,
+                    config["port"],
+                    timeout=self.config.CONNECT_TIMEOUT,
+                    read_timeout=self.config.READ_TIMEOUT,
+                    tls_session=self.tls_sessions.get(self.config.IMAP_SERVER, config["port"])
+                )
+                trace.debug("imap.connected", port=config['port'], tls="none")
                 
                 if config.get("starttls", False):
                     context = self._create_ssl_context()
                     if context is None:
                         raise Exception("Failed to create SSL context for STARTTLS")
                     mail.starttls(ssl_context=context)
-                    logger.debug("STARTTLS upgrade successful")
+                    trace.debug("imap.starttls", port=config['port'])
             
             # Test login
             try:
-                mail.login(self.user_account['username'], self.user_account['password'])
-                logger.info(f"✅ IMAP login successful using {config['name']} on port {config['port']} for user {self.user_account['username']}")
-                return mail, config
+                mail.login(self.user_account.username, self.user_account.password)
+                self.tls_sessions.save(self.config.IMAP_SERVER, config["port"], mail.sock)
+                trace.info("imap.login", endpoint=config['name'], user=self.user_account.username)
+                return mail, None
             except imaplib.IMAP4.error as login_error:
-                logger.error(f"❌ IMAP login failed on port {config['port']}: {login_error}")
+                trace.error("imap.login_failed", port=config['port'], user=self.user_account.username, error=str(login_error))
+                login_refused = True
                 raise
             
         except Exception as e:
-            logger.warning(f"❌ IMAP connection failed for {config['name']} (port {config['port']}): {type(e).__name__}: {e}")
+            trace.warning("imap.connect_failed", endpoint=config['name'], error=f"{type(e).__name__}: {e}")
             if mail:
                 try: 
                     mail.logout()
-                except: 
+                except Exception: 
                     pass
-            return None, None
+            return None, None if login_refused else e
     
     def _connect_imap(self):
-        """Connect to IMAP with fallback configurations"""
+        """Connect to IMAP with fallback configurations.
+
+        The phases of the successful attempt are reported as connect.<phase>;
+        attempts that fell back to the next configuration are not.
+        """
+        # Endpoints in order of preference, as discovered once per worker; those
+        # with an open circuit breaker are skipped (see endpoint_discovery.py)
+        endpoints = get_endpoint_directory(self.environment)
+        candidates = endpoints.candidates()
         start_time = time.time()
-        
-        # If we have a working config, try it first
-        if self.working_config:
-            mail, config = self._try_imap_connection(self.working_config)
-            if mail:
-                self.environment.events.request.fire(
-                    request_type="IMAP",
-                    name="connect",
-                    response_time=(time.time() - start_time) * 1000,
-                    response_length=0,
-                    exception=None
-                )
-                return mail
-        
-        # Try all configurations until one works
-        for config in self.config.IMAP_CONFIGS:
-            mail, working_config = self._try_imap_connection(config)
+        for endpoint in candidates:
+            mail, error = self._try_imap_connection(endpoint.config)
+            endpoints.record(endpoint, error)
             if mail:
-                self.working_config = working_config  # Cache for future use
                 self.environment.events.request.fire(
                     request_type="IMAP",
                     name="connect",
@@ -114,11 +158,12 @@ class IMAPLoadTester(User):
                     response_length=0,
                     exception=None
                 )
+                fire_phases(self.environment, "IMAP", mail.timer)
                 return mail
         
-        # All configurations failed
+        # All configurations failed or are circuit-broken
         error_msg = f"All IMAP connection methods failed for {self.config.IMAP_SERVER}"
-        logger.error(error_msg)
+        trace.error("imap.connect_exhausted", server=self.config.IMAP_SERVER)
         self.environment.events.request.fire(
             request_type="IMAP",
             name="connect",
@@ -128,6 +173,88 @@ class IMAPLoadTester(User):
         )
         return None
 
+    def _count_messages(self, mail, select=True):
+        """Count messages in INBOX"""
+        if select:
+            mail.select('INBOX')
+        status, messages = mail.search(None, 'ALL')
+        return len(messages[0].split()) if messages[0] else 0
+    
+    def _count_folders(self, mail):
+        """List folders and return how many there are"""
+        status, folders = mail.list()
+        return len(folders) if folders else 0
+    
+    def _fetch_metric_name(self):
+        """Request name for the configured fetch strategy"""
+        strategy = self.config.IMAP_FETCH_STRATEGY
+        return "fetch_messages" if strategy == "rfc822" else f"fetch_messages.{strategy}"
+    
+    def _fetch_messages(self, mail, select=True, uidnext=None, exists=0):
+        """Fetch the most recent messages with the configured strategy.
+        
+        Returns (fetched_count, uidnext) so long-lived sessions can keep track of
+        the next UID without another SELECT.
+        """
+        if self.config.IMAP_FETCH_STRATEGY == "rfc822":
+            return self._fetch_recent(mail, select), uidnext
+        
+        if select:
+            status, data = mail.select('INBOX')
+            exists = int(data[0]) if data and data[0] else 0
+            typ, uidnext_data = mail.response('UIDNEXT')
+            uidnext = int(uidnext_data[0]) if uidnext_data and uidnext_data[0] else None
+        
+        window = self.config.IMAP_FETCH_WINDOW
+        items = FETCH_STRATEGIES[self.config.IMAP_FETCH_STRATEGY].format(
+            partial_bytes=self.config.IMAP_FETCH_PARTIAL_BYTES
+        )
+        if not exists:
+            return 0, uidnext
+        # UIDs can have gaps, so resolve the UIDs of the newest messages by sequence
+        # number; a window below UIDNEXT may hold fewer than IMAP_FETCH_WINDOW
+        status, data = mail.fetch(f'{max(1, exists - window + 1)}:{exists}', '(UID)')
+        window_uids = _fetched_uids(data)
+        if not window_uids:
+            return 0, uidnext
+        status, data = mail.uid('FETCH', f'{min(window_uids)}:{max(window_uids)}', items)
+        
+        uids = _fetched_uids(data)
+        if uids:
+            uidnext = max(max(uids) + 1, uidnext or 0)
+        return len(uids), uidnext
+    
+    def _fetch_recent(self, mail, select=True):
+        """Fetch the most recent messages one RFC822 FETCH at a time (legacy strategy)"""
+        if select:
+            mail.select('INBOX')
+        status, messages = mail.search(None, 'ALL')
+        if not messages[0]:
+            return 0
+        window = self.config.IMAP_FETCH_WINDOW
+        message_ids = messages[0].split()
+        recent_ids = message_ids[-window:] if len(message_ids) >= window else message_ids
+        
+        fetched_count = 0
+        for msg_id in recent_ids:
+            status, msg_data = mail.fetch(msg_id, '(RFC822)')
+            if status == 'OK':
+                fetched_count += 1
+        return fetched_count
+
+
+class IMAPLoadTester(IMAPUserBase):
+    """IMAP Load Testing User with robust connection handling"""
+    # Closed model unless ARRIVAL_MODEL selects an open-model arrival rate
+    wait_time = arrival_wait_time("imap", between(2, 8))
+    weight = 2
+    
+    def on_start(self):
+        super().on_start()
+        # Survives reconnects, like a client's local mailbox cache
+        self.sync_state = MailboxSyncState('INBOX')
+        wait_for_first_arrival(self)
+    
     @task(5)
     def check_inbox(self):
         """Check inbox for new messages"""
@@ -136,25 +263,30 @@ class IMAPLoadTester(User):
             return
             
         start_time = time.time()
+        name = "check_inbox"
         try:
-            mail.select('INBOX')
-            status, messages = mail.search(None, 'ALL')
-            message_count = len(messages[0].split()) if messages[0] else 0
+            if self.config.IMAP_SYNC_MODE == "incremental":
+                # STATUS first; fetch only what changed (reported per sync mode)
+                name = "sync_inbox"
+                mode, message_count = sync_mailbox(mail, self.sync_state)
+                name = f"sync_inbox.{mode}"
+            else:
+                message_count = self._count_messages(mail)
             mail.logout()
             
             self.environment.events.request.fire(
                 request_type="IMAP",
-                name="check_inbox",
+                name=name,
                 response_time=(time.time() - start_time) * 1000,
                 response_length=message_count,
                 exception=None
             )
-            logger.info(f"Inbox check successful: {message_count} messages")
+            trace.info("imap.check_inbox", messages=message_count)
             
         except Exception as e:
             self.environment.events.request.fire(
                 request_type="IMAP",
-                name="check_inbox",
+                name=name,
                 response_time=(time.time() - start_time) * 1000,
                 response_length=0,
                 exception=e
@@ -162,9 +294,9 @@ class IMAPLoadTester(User):
             if mail:
                 try: 
                     mail.logout()
-                except: 
+                except Exception: 
                     pass
-            logger.error(f"Inbox check failed: {e}")
+            trace.error("imap.check_inbox_failed", error=str(e))
 
     @task(3)
     def list_folders(self):
@@ -175,8 +307,7 @@ class IMAPLoadTester(User):
             
         start_time = time.time()
         try:
-            status, folders = mail.list()
-            folder_count = len(folders) if folders else 0
+            folder_count = self._count_folders(mail)
             mail.logout()
             
             self.environment.events.request.fire(
@@ -186,7 +317,7 @@ class IMAPLoadTester(User):
                 response_length=folder_count,
                 exception=None
             )
-            logger.info(f"Folder listing successful: {folder_count} folders")
+            trace.info("imap.list_folders", folders=folder_count)
             
         except Exception as e:
             self.environment.events.request.fire(
@@ -199,9 +330,9 @@ class IMAPLoadTester(User):
             if mail:
                 try: 
                     mail.logout()
-                except: 
+                except Exception: 
                     pass
-            logger.error(f"Folder listing failed: {e}")
+            trace.error("imap.list_folders_failed", error=str(e))
 
     @task(2)
     def fetch_recent_messages(self):
@@ -212,43 +343,22 @@ class IMAPLoadTester(User):
             
         start_time = time.time()
         try:
-            mail.select('INBOX')
-            # Get recent messages (last 5)
-            status, messages = mail.search(None, 'ALL')
-            if messages[0]:
-                message_ids = messages[0].split()
-                recent_ids = message_ids[-5:] if len(message_ids) >= 5 else message_ids
-                
-                fetched_count = 0
-                for msg_id in recent_ids:
-                    status, msg_data = mail.fetch(msg_id, '(RFC822)')
-                    if status == 'OK':
-                        fetched_count += 1
-                
-                mail.logout()
-                
-                self.environment.events.request.fire(
-                    request_type="IMAP",
-                    name="fetch_messages",
-                    response_time=(time.time() - start_time) * 1000,
-                    response_length=fetched_count,
-                    exception=None
-                )
-                logger.info(f"Message fetch successful: {fetched_count} messages")
-            else:
-                mail.logout()
-                self.environment.events.request.fire(
-                    request_type="IMAP",
-                    name="fetch_messages",
-                    response_time=(time.time() - start_time) * 1000,
-                    response_length=0,
-                    exception=None
-                )
+            fetched_count, _ = self._fetch_messages(mail)
+            mail.logout()
+            
+            self.environment.events.request.fire(
+                request_type="IMAP",
+                name=self._fetch_metric_name(),
+                response_time=(time.time() - start_time) * 1000,
+                response_length=fetched_count,
+                exception=None
+            )
+            trace.info("imap.fetch", messages=fetched_count)
                 
         except Exception as e:
             self.environment.events.request.fire(
                 request_type="IMAP",
-                name="fetch_messages",
+                name=self._fetch_metric_name(),
                 response_time=(time.time() - start_time) * 1000,
                 response_length=0,
                 exception=e
@@ -256,6 +366,283 @@ class IMAPLoadTester(User):
             if mail:
                 try: 
                     mail.logout()
-                except: 
+                except Exception: 
                     pass
-            logger.error(f"Message fetch failed: {e}")
\ No newline at end of file
+            trace.error("imap.fetch_failed", error=str(e))
+
+
+class IMAPSessionBase(IMAPUserBase):
+    """Long-lived IMAP session with INBOX kept selected between tasks"""
+    abstract = True
+    
+    def on_start(self):
+        super().on_start()
+        self.mail = None
+        self.exists = 0
+        self.uidnext = None
+    
+    def on_stop(self):
+        self._close_session()
+    
+    def _close_session(self):
+        """Log out and forget the current session"""
+        if self.mail:
+            try:
+                self.mail.logout()
+            except Exception:
+                pass
+        self.mail = None
+    
+    def _session(self):
+        """Return the open session, logging in and selecting INBOX if needed"""
+        if self.mail is not None:
+            return self.mail
+        
+        mail = self._connect_imap()
+        if not mail:
+            return None
+        
+        start_time = time.time()
+        try:
+            status, data = mail.select('INBOX')
+            self.exists = int(data[0]) if data and data[0] else 0
+            uidnext = mail.untagged_responses.get('UIDNEXT')
+            self.uidnext = int(uidnext[-1]) if uidnext else None
+            self.environment.events.request.fire(
+                request_type="IMAP_SESSION",
+                name="select",
+                response_time=(time.time() - start_time) * 1000,
+                response_length=self.exists,
+                exception=None
+            )
+        except Exception as e:
+            self.environment.events.request.fire(
+                request_type="IMAP_SESSION",
+                name="select",
+                response_time=(time.time() - start_time) * 1000,
+                response_length=0,
+                exception=e
+            )
+            try:
+                mail.logout()
+            except Exception:
+                pass
+            return None
+        
+        self.mail = mail
+        self._on_session_selected(mail)
+        return mail
+    
+    def _run(self, name, operation):
+        """Run an operation on the session, reconnecting next time if it fails"""
+        mail = self._session()
+        if not mail:
+            return
+        
+        start_time = time.time()
+        try:
+            result = operation(mail)
+            self.environment.events.request.fire(
+                request_type="IMAP_SESSION",
+                name=name,
+                response_time=(time.time() - start_time) * 1000,
+                response_length=result or 0,
+                exception=None
+            )
+        except Exception as e:
+            self.environment.events.request.fire(
+                request_type="IMAP_SESSION",
+                name=name,
+                response_time=(time.time() - start_time) * 1000,
+                response_length=0,
+                exception=e
+            )
+            trace.debug("imap.session_failed", op=name, error=str(e))
+            self._close_session()
+        finally:
+            # imaplib keeps untagged responses until they are read; don't let a
+            # long-lived session accumulate them
+            if self.mail:
+                self.mail.untagged_responses.clear()
+    
+    def _on_session_selected(self, mail):
+        """Hook run once after a new session has selected INBOX"""
+        pass
+    
+    def _idle_for(self, mail, seconds):
+        """IDLE (or sleep, without server support) and return the untagged lines seen
+        and the time the server pushed the first of them, or None"""
+        if not supports(mail, 'IDLE'):
+            gevent.sleep(seconds)
+            return [], None
+        
+        lines, notified_at = idle(mail, seconds)
+        for number, kind in parse_untagged(lines):
+            if kind == 'EXISTS':
+                self.exists = number
+        return lines, notified_at
+
+
+class IMAPIdleLoadTester(IMAPSessionBase):
+    """Long-lived IMAP session that sits in IDLE like Thunderbird or a mobile client.
+    
+    Logs in once, keeps INBOX selected and alternates IDLE (RFC 2177) with NOOP.
+    The regular tasks run over the same connection; the session is only
+    re-established after the server drops it.
+    """
+    wait_time = between(1, 5)
+    weight = 2
+    
+    def on_start(self):
+        super().on_start()
+        trace.info("imap.idle_start", user=self.user_account.email)
+    
+    def _idle(self, mail):
+        """IDLE until the server reports a change or the IDLE period ends"""
+        # Without IDLE support this polls like a client without push would
+        previous = self.exists
+        lines, notified_at = self._idle_for(mail, self.config.IMAP_IDLE_SECONDS)
+        if notified_at is not None and self.exists > previous:
+            self._report_push_latency(mail, previous + 1, notified_at)
+        return len(lines)
+    
+    def _report_push_latency(self, mail, first, notified_at):
+        """Report send -> IDLE push latency of the new messages stamped by SMTP users"""
+        status, data = mail.fetch(f'{first}:{self.exists}', f'(BODY.PEEK[HEADER.FIELDS ({SENT_HEADER})])')
+        for item in data or []:
+            if not isinstance(item, tuple):
+                continue
+            try:
+                sent_at = float(BytesHeaderParser().parsebytes(item[1]).get(SENT_HEADER, ""))
+            except ValueError:
+                continue  # not sent by this suite, or sent without E2E_TRACKING
+            self.environment.events.request.fire(
+                request_type="IMAP_SESSION",
+                name="idle_notification",
+                response_time=(notified_at - sent_at) * 1000,
+                response_length=0,
+                exception=None
+            )
+    
+    def _noop(self, mail):
+        """NOOP, picking up any mailbox size change"""
+        status, data = mail.noop()
+        exists = mail.untagged_responses.get('EXISTS')
+        if exists:
+            self.exists = int(exists[-1])
+        return self.exists
+    
+    @task(10)
+    def idle_then_noop(self):
+        """Sit in IDLE, then send a NOOP as clients do between IDLE periods"""
+        self._run("idle", self._idle)
+        self._run("noop", self._noop)
+    
+    @task(3)
+    def check_inbox(self):
+        """Count INBOX messages over the open session"""
+        self._run("check_inbox", lambda mail: self._count_messages(mail, select=False))
+    
+    @task(1)
+    def list_folders(self):
+        """List folders over the open session"""
+        self._run("list_folders", self._count_folders)
+    
+    @task(2)
+    def fetch_recent_messages(self):
+        """Fetch recent messages over the open session"""
+        self._run(self._fetch_metric_name(), self._fetch_session_messages)
+    
+    def _fetch_session_messages(self, mail):
+        """Fetch recent messages, remembering the next UID for the following fetch"""
+        fetched_count, self.uidnext = self._fetch_messages(
+            mail, select=False, uidnext=self.uidnext, exists=self.exists
+        )
+        return fetched_count
+
+
+class DeliveryTrackerUser(IMAPSessionBase):
+    """Watches one tracked recipient mailbox and reports end-to-end delivery latency.
+    
+    Holds an IDLE session (or polls without server support) on one of the first
+    E2E_TRACKED_MAILBOXES accounts (of the worker's partition with
+    USER_PARTITIONING) and matches arriving messages against the
+    tokens stamped by SMTPLoadTester, reporting "E2E delivery" latency and
+    "E2E delivery_lost" for messages that never arrive.
+    """
+    wait_time = constant(0)
+    fixed_count = EmailServerConfig.E2E_TRACKED_MAILBOXES
+    _next_mailbox = itertools.count()
+    
+    def _assign_account(self):
+        """A tracked mailbox; trackers take no sender slot of the partition"""
+        if self.config.USER_PARTITIONING:
+            accounts = get_partition(self.environment).accounts
+        else:
+            accounts = self.user_manager.users
+        tracked = accounts[:max(1, self.config.E2E_TRACKED_MAILBOXES)]
+        return tracked[next(DeliveryTrackerUser._next_mailbox) % len(tracked)], None, None
+    
+    def on_start(self):
+        super().on_start()
+        self.last_uid = None
+        self.tracker = get_delivery_tracker(self.config.E2E_TIMEOUT_SECONDS, self.config.E2E_MAX_PENDING)
+        self.tracker.watch(self.user_account.email)
+        logger.info(f"Tracking deliveries to: {self.user_account.email}")
+    
+    def on_stop(self):
+        self.tracker.unwatch(self.user_account.email)
+        super().on_stop()
+    
+    def _on_session_selected(self, mail):
+        """Only messages arriving after tracking started are of interest"""
+        if self.last_uid is None:
+            uidnext = mail.untagged_responses.get('UIDNEXT')
+            self.last_uid = int(uidnext[-1]) - 1 if uidnext else 0
+    
+    def _collect_arrivals(self, mail):
+        """Fetch tracking headers of new messages and report their delivery latency"""
+        status, data = mail.uid(
+            'FETCH', f'{self.last_uid + 1}:*',
+            f'(UID BODY.PEEK[HEADER.FIELDS ({TOKEN_HEADER} {SENT_HEADER})])'
+        )
+        arrived_at = time.time()
+        matched = 0
+        for item in data or []:
+            if not isinstance(item, tuple):
+                continue
+            uid_match = _FETCH_UID.search(item[0])
+            if not uid_match or int(uid_match.group(1)) <= self.last_uid:
+                continue  # "n:*" returns the last message even when nothing is new
+            self.last_uid = int(uid_match.group(1))
+            
+            token = BytesHeaderParser().parsebytes(item[1]).get(TOKEN_HEADER)
+            latency = self.tracker.match(token, self.user_account.email, arrived_at) if token else None
+            if latency is not None:
+                matched += 1
+                self.environment.events.request.fire(
+                    request_type="E2E",
+                    name="delivery",
+                    response_time=latency * 1000,
+                    response_length=0,
+                    exception=None
+                )
+        return matched
+    
+    def _report_lost(self):
+        """Report messages that did not arrive within E2E_TIMEOUT_SECONDS"""
+        for _ in range(self.tracker.expire()):
+            self.environment.events.request.fire(
+                request_type="E2E",
+                name="delivery_lost",
+                response_time=self.config.E2E_TIMEOUT_SECONDS * 1000,
+                response_length=0,
+                exception=Exception(f"not delivered within {self.config.E2E_TIMEOUT_SECONDS}s")
+            )
+    
+    @task
+    def watch_mailbox(self):
+        """Wait for new mail, then match arrivals against in-flight messages"""
+        self._run("track_idle", lambda mail: len(self._idle_for(mail, self.config.E2E_POLL_SECONDS)[0]))
+        self._run("track_fetch", self._collect_arrivals)
+        self._report_lost()
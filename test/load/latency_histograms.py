@@ -0,0 +1,322 @@
+# latency_histograms.py - Full-resolution latency recording (HDR histograms)
+#
+# Locust's own stats round response times into coarse buckets (10 ms above 100 ms,
+# 100 ms above 1 s) and only see completed requests, so the tail of multi-second
+# operations like send_attachment and send_bulk is imprecise and stalls are
+# under-counted. With HDR_STATS enabled every request is also recorded, in
+# microseconds, into a per-operation HdrHistogram: log-linear buckets with
+# HDR_SIGNIFICANT_DIGITS significant digits, stored sparsely so a histogram costs
+# only as much memory as it has distinct buckets. Histograms merge by adding counts,
+# which is how worker data reaches the master (inside the regular worker reports).
+#
+# Coordinated-omission correction (HDR_CO_CORRECTION) fills a second, "corrected"
+# histogram per operation:
+#
+#   interval - HdrHistogram's expected-interval correction: a response of 5 s with
+#              HDR_EXPECTED_INTERVAL_MS=1000 also records 4 s, 3 s, 2 s and 1 s for
+#              the requests that a client on that schedule could not have sent
+#   schedule - open model (see arrival_scheduler.py): each operation also counts the
+#              time its task started late, i.e. latency from the intended start
+#
+# The master (or the single local process) writes one JSON line per operation every
+# HDR_INTERVAL_SECONDS to HDR_LOG, with the slice's histograms as [value_us, count]
+# pairs, and a summary with the full percentile spectrum (p0 to p99.999 and max) of
+# the whole run to HDR_SUMMARY when the test stops. To analyse a log later:
+#
+#   python latency_histograms.py reports/hdr_latency.jsonl --start 60 --end 300
+#
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+
+import gevent
+from locust.runners import MasterRunner, WorkerRunner
+
+from config import EmailServerConfig
+from arrival_scheduler import current_task_lag
+
+logger = logging.getLogger(__name__)
+
+SPECTRUM = (0, 10, 20, 30, 40, 50, 60, 70, 75, 80, 85, 90, 95, 97.5, 99, 99.5, 99.9, 99.95, 99.99, 99.999, 100)
+
+
+class HdrHistogram:
+    """Sparse log-linear histogram of integer values (microseconds)"""
+
+    __slots__ = ("precision_bits", "counts", "total", "min", "max", "sum")
+
+    def __init__(self, significant_digits=3):
+        # Enough sub-bucket bits that adjacent buckets differ by < 10^-digits
+        self.precision_bits = math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _bucket(self, value):
+        shift = value.bit_length() - self.precision_bits
+        return value if shift <= 0 else (value >> shift) << shift
+
+    def _highest_equivalent(self, bucket):
+        shift = bucket.bit_length() - self.precision_bits
+        return bucket if shift <= 0 else bucket + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        """Record a value (negative values count as 0)"""
+        value = max(0, int(value))
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += count
+        self.sum += value * count
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def record_corrected(self, value, expected_interval):
+        """Record value plus the values of requests a fixed-interval client would have queued"""
+        self.record(value)
+        if expected_interval <= 0:
+            return
+        missing = value - expected_interval
+        while missing >= expected_interval:
+            self.record(missing)
+            missing -= expected_interval
+
+    def merge(self, other):
+        """Add another histogram's counts to this one"""
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def value_at_percentile(self, percentile):
+        """Highest value equivalent to the given percentile (0..100)"""
+        if not self.total:
+            return 0
+        if percentile >= 100:
+            return self.max
+        target = max(1, math.ceil(percentile / 100 * self.total))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self._highest_equivalent(bucket), self.max)
+        return self.max
+
+    def summary(self, percentiles=SPECTRUM):
+        """Count, mean and percentile spectrum, in milliseconds"""
+        return {
+            "count": self.total,
+            "mean_ms": round(self.sum / self.total / 1000, 3) if self.total else 0.0,
+            "min_ms": (self.min or 0) / 1000,
+            "max_ms": self.max / 1000,
+            "percentiles_ms": {f"p{p:g}": self.value_at_percentile(p) / 1000 for p in percentiles},
+        }
+
+    def to_pairs(self):
+        """[[bucket, count], ...] plus min/max/sum, for JSON logs and worker reports"""
+        return {"counts": sorted(self.counts.items()), "min": self.min, "max": self.max, "sum": self.sum}
+
+    @classmethod
+    def from_pairs(cls, data, significant_digits=3):
+        histogram = cls(significant_digits)
+        for bucket, count in data["counts"]:
+            histogram.counts[bucket] = histogram.counts.get(bucket, 0) + count
+            histogram.total += count
+        histogram.min, histogram.max, histogram.sum = data["min"], data["max"], data["sum"]
+        return histogram
+
+
+class OperationHistograms:
+    """Raw and (optionally) CO-corrected histograms per "<type> <name>" operation"""
+
+    def __init__(self, significant_digits=3, correction="none", expected_interval_ms=0.0):
+        self.significant_digits = significant_digits
+        self.correction = correction
+        self.expected_interval_us = int(expected_interval_ms * 1000)
+        self.operations = {}
+
+    def _histograms(self, key):
+        histograms = self.operations.get(key)
+        if histograms is None:
+            corrected = HdrHistogram(self.significant_digits) if self.correction != "none" else None
+            histograms = self.operations[key] = (HdrHistogram(self.significant_digits), corrected)
+        return histograms
+
+    def record(self, key, response_time_ms, lag_seconds=0.0):
+        raw, corrected = self._histograms(key)
+        value = int(response_time_ms * 1000)
+        raw.record(value)
+        if corrected is None:
+            return
+        if self.correction == "schedule":
+            corrected.record(value + int(lag_seconds * 1_000_000))
+        else:
+            corrected.record_corrected(value, self.expected_interval_us)
+
+    def merge_pairs(self, data):
+        """Merge the to_pairs() form of another OperationHistograms"""
+        for key, (raw, corrected) in data.items():
+            mine = self._histograms(key)
+            mine[0].merge(HdrHistogram.from_pairs(raw, self.significant_digits))
+            if corrected is not None and mine[1] is not None:
+                mine[1].merge(HdrHistogram.from_pairs(corrected, self.significant_digits))
+
+    def merge(self, other):
+        for key, (raw, corrected) in other.operations.items():
+            mine = self._histograms(key)
+            mine[0].merge(raw)
+            if corrected is not None and mine[1] is not None:
+                mine[1].merge(corrected)
+
+    def to_pairs(self):
+        return {
+            key: (raw.to_pairs(), corrected.to_pairs() if corrected is not None else None)
+            for key, (raw, corrected) in self.operations.items()
+        }
+
+
+class HdrRecorder:
+    """Collects request latencies in this process and writes time slices where reports end up"""
+
+    def __init__(self, environment, config=EmailServerConfig):
+        self.environment = environment
+        self.config = config
+        self.interval = self._new()   # since the last slice (or worker report)
+        self.total = self._new()      # whole run, master/local only
+        self.slice_started = time.time()
+        self.writer = None
+
+    def _new(self):
+        config = self.config
+        return OperationHistograms(config.HDR_SIGNIFICANT_DIGITS, config.HDR_CO_CORRECTION,
+                                   config.HDR_EXPECTED_INTERVAL_MS)
+
+    def on_request(self, request_type, name, response_time, exception=None, **kwargs):
+        if response_time is None:
+            return
+        # Schedule lag and throttle waits are themselves lateness measures; never add twice
+        lag = current_task_lag() if request_type not in ("OPEN_MODEL", "THROTTLE", "PROFILE") else 0.0
+        self.interval.record(f"{request_type} {name}", response_time, lag)
+
+    def report_to_master(self, client_id, data, **kwargs):
+        interval, self.interval = self.interval, self._new()
+        data["hdr_histograms"] = interval.to_pairs()
+
+    def worker_report(self, client_id, data, **kwargs):
+        if "hdr_histograms" in data:
+            self.interval.merge_pairs(data["hdr_histograms"])
+
+    def write_slice(self):
+        """Append the histograms since the last slice to HDR_LOG and add them to the total"""
+        interval, self.interval = self.interval, self._new()
+        started, self.slice_started = self.slice_started, time.time()
+        self.total.merge(interval)
+        if not interval.operations:
+            return
+        path = self.config.HDR_LOG
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            for key, (raw, corrected) in interval.to_pairs().items():
+                line = {"start": round(started, 3), "end": round(self.slice_started, 3), "op": key, "raw": raw}
+                if corrected is not None:
+                    line["corrected"] = corrected
+                f.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    def _slicer(self):
+        while True:
+            gevent.sleep(self.config.HDR_INTERVAL_SECONDS)
+            self.write_slice()
+
+    def test_start(self, **kwargs):
+        self.interval, self.total = self._new(), self._new()
+        self.slice_started = time.time()
+        if self.writer is None:
+            self.writer = gevent.spawn(self._slicer)
+
+    def test_stop(self, **kwargs):
+        if self.writer is not None:
+            self.writer.kill()
+            self.writer = None
+        # Give the workers' final reports a moment to arrive
+        if isinstance(self.environment.runner, MasterRunner):
+            gevent.sleep(1)
+        self.write_slice()
+        self.write_summary()
+
+    def write_summary(self):
+        summary = {
+            "correction": self.config.HDR_CO_CORRECTION,
+            "significant_digits": self.config.HDR_SIGNIFICANT_DIGITS,
+            "operations": {},
+        }
+        for key, (raw, corrected) in sorted(self.total.operations.items()):
+            entry = {"raw": raw.summary()}
+            if corrected is not None:
+                entry["corrected"] = corrected.summary()
+            summary["operations"][key] = entry
+        path = self.config.HDR_SUMMARY
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(f"HDR latency summary of {len(summary['operations'])} operations written to {path}")
+
+
+def register_hdr_stats(environment):
+    """Record every request into HDR histograms; workers forward them to the master"""
+    recorder = HdrRecorder(environment)
+    events = environment.events
+    if isinstance(environment.runner, MasterRunner):
+        events.worker_report.add_listener(recorder.worker_report)
+    else:
+        events.request.add_listener(recorder.on_request)
+    if isinstance(environment.runner, WorkerRunner):
+        events.report_to_master.add_listener(recorder.report_to_master)
+    else:
+        events.test_start.add_listener(recorder.test_start)
+        events.test_stop.add_listener(recorder.test_stop)
+    return recorder
+
+
+def load_log(path, start=None, end=None, significant_digits=3):
+    """Merge the slices of an HDR_LOG, optionally limited to seconds from the first slice"""
+    merged = OperationHistograms(significant_digits, "schedule")
+    first = None
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            first = entry["start"] if first is None else first
+            offset = entry["start"] - first
+            if (start is not None and offset < start) or (end is not None and offset >= end):
+                continue
+            merged.merge_pairs({entry["op"]: (entry["raw"], entry.get("corrected"))})
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Percentile spectrum of an HDR latency log")
+    parser.add_argument("log", help="HDR_LOG file (JSON lines)")
+    parser.add_argument("--start", type=float, help="seconds after the first slice")
+    parser.add_argument("--end", type=float, help="seconds after the first slice")
+    parser.add_argument("--corrected", action="store_true", help="show the CO-corrected histograms")
+    args = parser.parse_args()
+
+    merged = load_log(args.log, args.start, args.end)
+    columns = ("p50", "p90", "p99", "p99.9", "p99.99", "p100")
+    print(f"{'operation':<40} {'count':>8} " + " ".join(f"{c:>9}" for c in columns))
+    for key, (raw, corrected) in sorted(merged.operations.items()):
+        histogram = corrected if args.corrected and corrected.total else raw
+        summary = histogram.summary()
+        print(f"{key:<40} {summary['count']:>8} "
+              + " ".join(f"{summary['percentiles_ms'][c]:>9.1f}" for c in columns))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
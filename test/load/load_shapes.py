@@ -0,0 +1,171 @@
+# load_shapes.py - Mail traffic profiles
+#
+# Each profile maps progress through the run (0..1) to a load level (0..1 of peak):
+#
+#   diurnal    - a working day compressed into the run: quiet night, morning rise,
+#                lunch dip, afternoon peak, evening tail
+#   monday     - weekend trickle, then everyone opens their mail at 9:00; the burst
+#                decays to a normal working level
+#   newsletter - steady baseline with a short blast at full rate and a tail-off
+#   step       - SHAPE_STEPS equal stages stepping up to the peak
+#   ramp       - linear stages "seconds:level,..." (SHAPE_STAGES); by default a
+#                ramp to the peak over the first half, then a hold
+#
+# In the default closed model MailTrafficShape sets the user count to
+# peak_users * level. In the open model (ARRIVAL_MODEL=poisson|constant) the user
+# count stays at peak_users as a concurrency pool and the arrival schedulers scale
+# their rate by the same level instead (see arrival_scheduler.py).
+#
+# Parameters come from .env through config.py and can be overridden on the Locust
+# command line (--load-shape, --shape-duration, ...). Locust forwards them to workers.
+#
+import math
+from collections import namedtuple
+
+from locust import LoadTestShape
+
+from config import EmailServerConfig
+
+ShapeSettings = namedtuple(
+    'ShapeSettings', ['profile', 'duration', 'peak_users', 'spawn_rate', 'steps', 'baseline', 'stages']
+)
+
+# Fraction of peak mail traffic for each hour of the day, 00:00 to 23:00
+DIURNAL_CURVE = (
+    0.10, 0.07, 0.05, 0.05, 0.06, 0.10, 0.20, 0.45, 0.80, 0.95, 1.00, 0.95,
+    0.80, 0.85, 0.95, 0.90, 0.80, 0.65, 0.45, 0.35, 0.30, 0.25, 0.18, 0.13,
+)
+
+
+def add_shape_arguments(parser):
+    """Register the shape and arrival-rate options on Locust's argument parser"""
+    config = EmailServerConfig
+    group = parser.add_argument_group("Mail traffic shape and arrival model")
+    group.add_argument("--load-shape", choices=sorted(PROFILES), default=config.LOAD_SHAPE or None,
+                       help="traffic profile (enables MailTrafficShape)")
+    group.add_argument("--shape-duration", type=float, default=config.SHAPE_DURATION,
+                       help="run length in seconds; the profile is stretched over it")
+    group.add_argument("--shape-peak-users", type=int, default=config.SHAPE_PEAK_USERS,
+                       help="users at level 1.0 (the concurrency pool in the open model)")
+    group.add_argument("--shape-spawn-rate", type=float, default=config.SHAPE_SPAWN_RATE)
+    group.add_argument("--shape-steps", type=int, default=config.SHAPE_STEPS, help="stages of the step profile")
+    group.add_argument("--shape-baseline", type=float, default=config.SHAPE_BASELINE,
+                       help="level outside bursts for monday and newsletter")
+    group.add_argument("--shape-stages", default=config.SHAPE_STAGES,
+                       help='ramp stages as "seconds:level,...", e.g. "60:0.2,300:1,60:0"')
+    group.add_argument("--arrival-model", choices=["closed", "poisson", "constant"], default=config.ARRIVAL_MODEL)
+    group.add_argument("--smtp-arrival-rate", type=float, default=config.SMTP_ARRIVAL_RATE,
+                       help="SMTP tasks per second across all workers at level 1.0")
+    group.add_argument("--imap-arrival-rate", type=float, default=config.IMAP_ARRIVAL_RATE,
+                       help="IMAP tasks per second across all workers at level 1.0")
+
+
+def option(environment, name, default):
+    """A parsed command line option, or the config default outside of the Locust CLI"""
+    options = getattr(environment, "parsed_options", None)
+    value = getattr(options, name, None)
+    return default if value is None else value
+
+
+def shape_settings(environment):
+    """Current ShapeSettings from the command line and config"""
+    config = EmailServerConfig
+    return ShapeSettings(
+        profile=option(environment, "load_shape", config.LOAD_SHAPE),
+        duration=option(environment, "shape_duration", config.SHAPE_DURATION),
+        peak_users=option(environment, "shape_peak_users", config.SHAPE_PEAK_USERS),
+        spawn_rate=option(environment, "shape_spawn_rate", config.SHAPE_SPAWN_RATE),
+        steps=max(1, option(environment, "shape_steps", config.SHAPE_STEPS)),
+        baseline=option(environment, "shape_baseline", config.SHAPE_BASELINE),
+        stages=parse_stages(option(environment, "shape_stages", config.SHAPE_STAGES)),
+    )
+
+
+def parse_stages(spec):
+    """Parse "seconds:level,..." into [(seconds, level)]"""
+    stages = []
+    for item in (spec or "").split(","):
+        if item.strip():
+            seconds, _, level = item.partition(":")
+            stages.append((float(seconds), float(level)))
+    return stages
+
+
+def _diurnal(progress, settings):
+    hour = (progress * 24) % 24
+    index = int(hour)
+    fraction = hour - index
+    return DIURNAL_CURVE[index] + (DIURNAL_CURVE[(index + 1) % 24] - DIURNAL_CURVE[index]) * fraction
+
+
+def _monday(progress, settings):
+    working_level = (1 + settings.baseline) / 2
+    if progress < 0.2:
+        return settings.baseline
+    if progress < 0.25:
+        return settings.baseline + (1 - settings.baseline) * (progress - 0.2) / 0.05
+    if progress < 0.4:
+        return 1.0
+    return working_level + (1 - working_level) * math.exp(-(progress - 0.4) / 0.1)
+
+
+def _newsletter(progress, settings):
+    if 0.3 <= progress < 0.4:
+        return 1.0
+    if 0.4 <= progress < 0.5:
+        return 1.0 - (1.0 - settings.baseline) * (progress - 0.4) / 0.1
+    return settings.baseline
+
+
+def _step(progress, settings):
+    return min(settings.steps, int(progress * settings.steps) + 1) / settings.steps
+
+
+def _ramp(progress, settings):
+    stages = settings.stages or [(settings.duration / 2, 1.0), (settings.duration / 2, 1.0)]
+    elapsed = progress * sum(seconds for seconds, _ in stages)
+    level = 0.0
+    for seconds, target in stages:
+        if elapsed < seconds:
+            return level + (target - level) * (elapsed / seconds if seconds else 1)
+        elapsed -= seconds
+        level = target
+    return level
+
+
+PROFILES = {
+    "diurnal": _diurnal,
+    "monday": _monday,
+    "newsletter": _newsletter,
+    "step": _step,
+    "ramp": _ramp,
+}
+
+
+def run_length(settings):
+    """Seconds the profile runs for (the sum of the stages for ramp)"""
+    if settings.profile == "ramp" and settings.stages:
+        return sum(seconds for seconds, _ in settings.stages)
+    return settings.duration
+
+
+def shape_level(settings, run_time):
+    """Load level (0..1 of peak) at run_time seconds, or None once the profile is over"""
+    length = run_length(settings)
+    if not settings.profile or run_time >= length:
+        return None
+    return max(0.0, PROFILES[settings.profile](run_time / length, settings))
+
+
+class MailTrafficShape(LoadTestShape):
+    """Drive the user count (closed model) or the arrival rate (open model) along a profile"""
+
+    def tick(self):
+        environment = self.runner.environment
+        settings = shape_settings(environment)
+        level = shape_level(settings, self.get_run_time())
+        if level is None:
+            return None
+        if option(environment, "arrival_model", EmailServerConfig.ARRIVAL_MODEL) != "closed":
+            return settings.peak_users, settings.spawn_rate
+        return max(1, round(settings.peak_users * level)), settings.spawn_rate
@@ -7,8 +7,15 @@ The actual implementations are in separate modules for better organization:
 - config.py: Server configuration
 - data_generator.py: Email content and attachment generation
 - user_manager.py: Test user account management
-- smtp_tester.py: SMTP protocol testing
-- imap_tester.py: IMAP protocol testing
+- smtp_tester.py: SMTP protocol testing (and the content-security mix, content_mix.py)
+- mx_relay.py / dkim_signer.py: inbound MX (port 25) senders, greylist retries and DKIM
+- imap_tester.py: IMAP protocol testing (per-task and long-lived IDLE sessions)
+- load_shapes.py / arrival_scheduler.py: traffic profiles and open-model arrival rates
+- capacity_search.py: SLO-driven search for the saturation knee
+- latency_histograms.py: per-operation HDR histograms with coordinated-omission correction
+- event_sink.py: batched structured per-operation event recording
+- harness_profiler.py: client CPU/RSS, loop lag and per-task CPU profiling
+- standin_server.py: local SMTP/IMAP stand-in target (LOADTEST_TARGET=standin)
 """
 
 import os
@@ -19,12 +26,86 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+from locust import events, constant
+from locust.runners import MasterRunner, WorkerRunner
+
+from config import EmailServerConfig
+from data_generator import get_data_generator
+from user_manager import get_user_manager, register_partitioning
+
 # Import all test classes - these will be automatically discovered by Locust
 from smtp_tester import SMTPLoadTester
 from imap_tester import IMAPLoadTester
 
+from load_shapes import add_shape_arguments, option
+from capacity_search import add_capacity_arguments, register_capacity_search
+from latency_histograms import register_hdr_stats
+from event_sink import register_event_sink
+from harness_profiler import register_harness_profiler
+
+# A shape class takes over -u/-r, so only expose one when a profile is selected
+if EmailServerConfig.CAPACITY_SEARCH or "--capacity-search" in sys.argv:
+    from capacity_search import CapacitySearchShape
+elif EmailServerConfig.LOAD_SHAPE or any(arg.startswith("--load-shape") for arg in sys.argv):
+    from load_shapes import MailTrafficShape
+if EmailServerConfig.IMAP_IDLE_USERS:
+    from imap_tester import IMAPIdleLoadTester
+if EmailServerConfig.E2E_TRACKING:
+    from imap_tester import DeliveryTrackerUser
+if EmailServerConfig.CONTENT_MIX_USERS:
+    from smtp_tester import ContentMixLoadTester
+    from content_mix import log_verdict_summary
+if EmailServerConfig.MX_RELAY_USERS:
+    from smtp_tester import MXRelayLoadTester
+    from mx_relay import log_mx_summary
+
+
+@events.init_command_line_parser.add_listener
+def on_command_line_parser(parser):
+    """Traffic shape and arrival model options (defaults from config.py / .env)"""
+    add_shape_arguments(parser)
+    add_capacity_arguments(parser)
+
+
+@events.init.add_listener
+def on_locust_init(environment, **kwargs):
+    """Prepare per-worker shared state before any user is spawned"""
+    if environment.runner is not None:
+        register_partitioning(environment)
+        register_capacity_search(environment)
+        if EmailServerConfig.HDR_STATS:
+            register_hdr_stats(environment)
+        if EmailServerConfig.EVENT_SINK:
+            register_event_sink(environment)
+        register_harness_profiler(environment)
+        if EmailServerConfig.CONTENT_MIX_USERS and not isinstance(environment.runner, WorkerRunner):
+            environment.events.test_stop.add_listener(log_verdict_summary)
+        if EmailServerConfig.MX_RELAY_USERS and not isinstance(environment.runner, WorkerRunner):
+            environment.events.test_stop.add_listener(log_mx_summary)
+    # Only in the closed model; open-model users already wait for their arrivals
+    closed = option(environment, "arrival_model", EmailServerConfig.ARRIVAL_MODEL) == "closed"
+    if EmailServerConfig.LOADTEST_WAIT_TIME is not None and closed:
+        for user_class in environment.user_classes:
+            user_class.wait_time = constant(EmailServerConfig.LOADTEST_WAIT_TIME)
+    if isinstance(environment.runner, MasterRunner):
+        return
+    # Load the shared user table and data generator once, before the ramp-up
+    get_user_manager()
+    generator = get_data_generator()
+    if EmailServerConfig.MESSAGE_CORPUS_ENABLED:
+        corpus = generator.build_corpus()
+        logger.info(f"Message corpus ready: {corpus.stats()}")
+
 # Expose classes for Locust to discover
 __all__ = ['SMTPLoadTester', 'IMAPLoadTester']
+if EmailServerConfig.IMAP_IDLE_USERS:
+    __all__.append('IMAPIdleLoadTester')
+if EmailServerConfig.E2E_TRACKING:
+    __all__.append('DeliveryTrackerUser')
+if EmailServerConfig.CONTENT_MIX_USERS:
+    __all__.append('ContentMixLoadTester')
+if EmailServerConfig.MX_RELAY_USERS:
+    __all__.append('MXRelayLoadTester')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,461 @@
+# mailbox_seeder.py - Bulk IMAP mailbox pre-seeding
+"""
+Fill the test accounts (test_data/users.csv, see user_manager.py) with a realistic
+mailbox-size distribution before a load test, so FETCH, SEARCH and sync run against
+thousands of messages per account instead of an empty INBOX.
+
+Every account gets a deterministic plan drawn from --seed and its address:
+
+  messages  log-normal count (--messages-median, --messages-sigma, --messages-max)
+  folders   share of the messages per folder (--folders); "/" separates levels
+            and is translated to the server's hierarchy delimiter
+  sizes     weighted size classes (--sizes); each message is 0.5x-1.5x its class,
+            large ones carry a generated base64 attachment (message_stream.py)
+  flags     independent probability per flag (--flags)
+
+Messages are uploaded with MULTIAPPEND (RFC 3502, --batch messages per command)
+using non-synchronizing literals (LITERAL+, RFC 7888) and --pipeline commands in
+flight per connection; servers without those extensions get one synchronizing
+APPEND per message. --connections accounts/folders are seeded in parallel.
+
+Seeding is resumable and idempotent: each message carries
+"X-Loadtest-Seed: s<seed>:<index>", and before uploading a folder the seeder
+searches it for that header and only appends the indexes that are missing. Rerun
+after an interruption (or twice in a row) and the mailboxes converge on the plan.
+
+Ingest throughput (messages/s, MB/s, APPEND latency percentiles) is printed at the
+end and, with --report, written as JSON, so a run doubles as a delivery benchmark.
+
+Usage (from test/load):
+    python mailbox_seeder.py --dry-run
+    python mailbox_seeder.py --accounts 20 --connections 8 --report reports/seed.json
+"""
+import re
+import sys
+import json
+import math
+import time
+import queue
+import random
+import hashlib
+import imaplib
+import argparse
+import threading
+import statistics
+
+from config import MAIL_DOMAIN, EmailServerConfig
+from tls_context import get_client_context
+from user_manager import get_user_manager
+from message_stream import GeneratedAttachment
+
+SEED_HEADER = "X-Loadtest-Seed"
+_SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 * 1024}
+_LIST_DELIMITER = re.compile(rb'\([^)]*\) "(.)"')
+_SEED_VALUE = re.compile(rb'X-Loadtest-Seed:\s*s\d+:(\d+)', re.IGNORECASE)
+_WORDS = ("load", "test", "mail", "server", "queue", "relay", "report", "meeting", "invoice", "update",
+          "project", "review", "draft", "schedule", "budget", "release", "status", "notes", "team", "plan")
+
+
+def parse_weights(spec, value=float):
+    """Parse "name:weight,..." into [(name, weight)]"""
+    pairs = []
+    for item in spec.split(","):
+        if item.strip():
+            name, _, weight = item.strip().rpartition(":")
+            pairs.append((name, value(weight)))
+    return pairs
+
+
+def parse_size(text):
+    """Parse 2k / 200K / 2m / 512 into bytes"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([kKmM]?)[bB]?', text.strip())
+    if not match:
+        raise ValueError(f"Invalid size {text!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+
+class SeedPlan:
+    """Deterministic per-account message plan"""
+
+    def __init__(self, args):
+        self.seed = args.seed
+        self.median = args.messages_median
+        self.sigma = args.messages_sigma
+        self.maximum = args.messages_max
+        self.folders = parse_weights(args.folders)
+        self.sizes = [(parse_size(name), weight) for name, weight in parse_weights(args.sizes)]
+        self.flags = parse_weights(args.flags)
+        self.domain = args.domain
+
+    def _rng(self, *parts):
+        key = ":".join(str(part) for part in (self.seed,) + parts).encode()
+        return random.Random(int.from_bytes(hashlib.sha256(key).digest()[:8], "big"))
+
+    def folder_counts(self, email):
+        """{folder: message count} for one account"""
+        rng = self._rng(email)
+        total = min(self.maximum, int(round(rng.lognormvariate(math.log(self.median), self.sigma))))
+        weight_sum = sum(weight for _, weight in self.folders)
+        counts = {folder: int(total * weight / weight_sum) for folder, weight in self.folders}
+        # The rounding remainder goes to the first (usually largest) folder
+        first = self.folders[0][0]
+        counts[first] += total - sum(counts.values())
+        return counts
+
+    def message(self, email, folder, index):
+        """(flags, message bytes) of message index in folder"""
+        rng = self._rng(email, folder, index)
+        size_class = rng.choices([size for size, _ in self.sizes], [weight for _, weight in self.sizes])[0]
+        size = max(256, int(size_class * rng.uniform(0.5, 1.5)))
+        flags = [flag for flag, probability in self.flags if rng.random() < probability]
+        sender = f"sender{rng.randrange(1000):03d}@{self.domain}"
+        stamp = time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(1_600_000_000 + rng.randrange(10 ** 8)))
+        subject = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+        headers = (
+            f"From: {sender}\r\nTo: {email}\r\nSubject: {subject}\r\nDate: {stamp}\r\n"
+            f"Message-ID: <seed{self.seed}.{rng.getrandbits(48):012x}.{index}@{self.domain}>\r\n"
+            f"{SEED_HEADER}: s{self.seed}:{index}\r\nMIME-Version: 1.0\r\n"
+        ).encode()
+        if size < 64 * 1024:
+            return flags, headers + b"Content-Type: text/plain; charset=utf-8\r\n\r\n" + _text_body(rng, size)
+        boundary = f"seed-{rng.getrandbits(64):016x}"
+        attachment = GeneratedAttachment(size, rng.getrandbits(64))
+        return flags, b"".join([
+            headers,
+            f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode(),
+            f"--{boundary}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n".encode(),
+            _text_body(rng, 512),
+            f"--{boundary}\r\nContent-Type: application/octet-stream\r\n"
+            f'Content-Transfer-Encoding: base64\r\nContent-Disposition: attachment; filename="file{index}.bin"\r\n\r\n'.encode(),
+            *attachment.chunks(),
+            f"--{boundary}--\r\n".encode(),
+        ])
+
+
+def _text_body(rng, size):
+    """size bytes of CRLF-wrapped words"""
+    lines, length = [], 0
+    while length < size:
+        line = " ".join(rng.choice(_WORDS) for _ in range(12)).encode() + b"\r\n"
+        lines.append(line)
+        length += len(line)
+    return b"".join(lines)
+
+
+def quote_mailbox(name):
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class IngestStats:
+    """Thread-safe ingest counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.errors = 0
+        self.latencies = []  # seconds per APPEND/MULTIAPPEND command
+        self.per_connection = {}
+
+    def add(self, connection, messages, size, latency):
+        with self.lock:
+            self.messages += messages
+            self.bytes += size
+            self.latencies.append(latency)
+            counters = self.per_connection.setdefault(connection, {"messages": 0, "bytes": 0, "commands": 0})
+            counters["messages"] += messages
+            counters["bytes"] += size
+            counters["commands"] += 1
+
+
+class Seeder:
+    """Seed (account, folder) units over a pool of IMAP connections"""
+
+    def __init__(self, args, plan):
+        self.args = args
+        self.plan = plan
+        self.config = EmailServerConfig()
+        self.stats = IngestStats()
+        self._imap_config = None  # first IMAP_CONFIGS entry that worked
+
+    def connect(self, user):
+        """Log in as user, trying the configured IMAP endpoints in order"""
+        configs = [self._imap_config] if self._imap_config else self.config.IMAP_CONFIGS
+        last_error = None
+        for config in configs:
+            try:
+                if config["ssl"]:
+                    mail = imaplib.IMAP4_SSL(self.config.IMAP_SERVER, config["port"],
+                                             ssl_context=get_client_context(), timeout=self.config.TIMEOUT)
+                else:
+                    mail = imaplib.IMAP4(self.config.IMAP_SERVER, config["port"], timeout=self.config.TIMEOUT)
+                    if config["starttls"]:
+                        mail.starttls(ssl_context=get_client_context())
+                mail.login(user.username, user.password)
+                self._imap_config = config
+                return mail
+            except (OSError, imaplib.IMAP4.error) as e:
+                last_error = e
+        raise ConnectionError(f"IMAP login failed for {user.username}: {last_error}")
+
+    def run(self, units):
+        work = queue.Queue()
+        for unit in units:
+            work.put(unit)
+        threads = [threading.Thread(target=self._worker, args=(i, work), daemon=True)
+                   for i in range(min(self.args.connections, len(units)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _worker(self, connection, work):
+        mail, current = None, None
+        while True:
+            try:
+                user, folder, count = work.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if current is not user:
+                    _logout(mail)
+                    mail, current = None, None
+                    mail = self.connect(user)
+                    current = user
+                self.seed_folder(connection, mail, user, folder, count)
+            except (OSError, imaplib.IMAP4.error, ConnectionError) as e:
+                print(f"  {user.username} {folder}: {type(e).__name__}: {e}", file=sys.stderr)
+                with self.stats.lock:
+                    self.stats.errors += 1
+                _logout(mail)
+                mail, current = None, None
+        _logout(mail)
+
+    def seed_folder(self, connection, mail, user, folder, count):
+        """Append the messages of folder that are not on the server yet"""
+        name = self._server_name(mail, folder)
+        if name.upper() != "INBOX":
+            self._create(mail, name)
+        present = self._seeded_indexes(mail, name)
+        missing = [index for index in range(count) if index not in present]
+        with self.stats.lock:
+            self.stats.skipped += count - len(missing)
+        if not missing:
+            return
+        batch = self.args.batch if supports(mail, "MULTIAPPEND") else 1
+        batches = [missing[i:i + batch] for i in range(0, len(missing), batch)]
+        if supports(mail, "LITERAL+"):
+            self._append_pipelined(connection, mail, user, name, folder, batches)
+        else:
+            for indexes in batches:
+                self._append_synchronizing(connection, mail, user, name, folder, indexes)
+
+    def _server_name(self, mail, folder):
+        """Translate "/" in a folder path to the server's hierarchy delimiter"""
+        if "/" not in folder:
+            return folder
+        delimiter = getattr(mail, "_seed_delimiter", None)
+        if delimiter is None:
+            typ, data = mail.list('""', '""')
+            match = _LIST_DELIMITER.search(data[0] or b"") if typ == "OK" and data else None
+            delimiter = match.group(1).decode() if match else "/"
+            mail._seed_delimiter = delimiter
+        return folder.replace("/", delimiter)
+
+    def _create(self, mail, name):
+        """CREATE name and its parents; an existing mailbox is fine"""
+        delimiter = getattr(mail, "_seed_delimiter", "/")
+        parts = name.split(delimiter)
+        for depth in range(1, len(parts) + 1):
+            # NO means it already exists (or the server created it with a child)
+            mail.create(quote_mailbox(delimiter.join(parts[:depth])))
+
+    def _seeded_indexes(self, mail, name):
+        """Indexes of this plan's messages already in the mailbox"""
+        typ, data = mail.select(quote_mailbox(name), readonly=True)
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"SELECT {name} failed: {data}")
+        present = set()
+        if int(data[0] or 0):
+            typ, data = mail.uid("SEARCH", "HEADER", SEED_HEADER, f'"s{self.plan.seed}:"')
+            uids = data[0].split() if typ == "OK" and data and data[0] else []
+            for start in range(0, len(uids), 1000):
+                uid_set = b",".join(uids[start:start + 1000]).decode()
+                typ, data = mail.uid("FETCH", uid_set, f"(BODY.PEEK[HEADER.FIELDS ({SEED_HEADER})])")
+                for item in data if typ == "OK" else ():
+                    if isinstance(item, tuple):
+                        match = _SEED_VALUE.search(item[1])
+                        if match:
+                            present.add(int(match.group(1)))
+        mail.close()
+        return present
+
+    def _build(self, user, folder, indexes):
+        messages = [self.plan.message(user.email, folder, index) for index in indexes]
+        return messages, sum(len(data) for _, data in messages)
+
+    def _append_pipelined(self, connection, mail, user, name, folder, batches):
+        """MULTIAPPEND with LITERAL+, keeping --pipeline commands in flight"""
+        in_flight = {}  # tag -> (sent at, messages, bytes)
+        pending = list(batches)
+        serial = 0
+        while pending or in_flight:
+            while pending and len(in_flight) < self.args.pipeline:
+                indexes = pending.pop(0)
+                messages, size = self._build(user, folder, indexes)
+                serial += 1
+                tag = f"S{connection}.{serial}"
+                parts = [f"{tag} APPEND {quote_mailbox(name)}".encode()]
+                for flags, data in messages:
+                    parts.append(f" ({' '.join(flags)}) {{{len(data)}+}}\r\n".encode())
+                    parts.append(data)
+                parts.append(b"\r\n")
+                mail.send(b"".join(parts))
+                in_flight[tag] = (time.perf_counter(), len(indexes), size)
+            line = mail.readline()
+            if not line:
+                raise ConnectionError("connection closed during APPEND")
+            tag, _, rest = line.decode("utf-8", "replace").partition(" ")
+            if tag not in in_flight:
+                continue  # untagged data
+            sent_at, count, size = in_flight.pop(tag)
+            if rest.upper().startswith("OK"):
+                self.stats.add(connection, count, size, time.perf_counter() - sent_at)
+            else:
+                print(f"  {user.username} {folder}: APPEND failed: {rest.strip()}", file=sys.stderr)
+                with self.stats.lock:
+                    self.stats.errors += 1
+
+    def _append_synchronizing(self, connection, mail, user, name, folder, indexes):
+        """One APPEND/MULTIAPPEND command, waiting for a continuation before each literal"""
+        messages, size = self._build(user, folder, indexes)
+        started = time.perf_counter()
+        tag = f"S{connection}.{indexes[0]}"
+        prefix = f"{tag} APPEND {quote_mailbox(name)}"
+        for flags, data in messages:
+            mail.send(f"{prefix} ({' '.join(flags)}) {{{len(data)}}}\r\n".encode())
+            line = mail.readline()
+            if not line.startswith(b"+"):
+                raise imaplib.IMAP4.error(f"APPEND refused: {line.decode('utf-8', 'replace').strip()}")
+            mail.send(data)
+            prefix = ""
+        mail.send(b"\r\n")
+        while True:
+            line = mail.readline()
+            if not line:
+                raise ConnectionError("connection closed during APPEND")
+            if line.startswith(tag.encode() + b" "):
+                break
+        if line.split(b" ", 2)[1].upper() != b"OK":
+            raise imaplib.IMAP4.error(f"APPEND failed: {line.decode('utf-8', 'replace').strip()}")
+        self.stats.add(connection, len(indexes), size, time.perf_counter() - started)
+
+
+def supports(mail, capability):
+    return capability in mail.capabilities
+
+
+def _logout(mail):
+    if mail is not None:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def print_plan(plan, users):
+    """Distribution summary of the plan without touching the server"""
+    totals = [sum(plan.folder_counts(user.email).values()) for user in users]
+    per_folder = {}
+    for user in users:
+        for folder, count in plan.folder_counts(user.email).items():
+            per_folder[folder] = per_folder.get(folder, 0) + count
+    sample = [len(plan.message(users[0].email, "INBOX", index)[1]) for index in range(200)]
+    print(f"{len(users)} accounts, {sum(totals)} messages "
+          f"(per account min {min(totals)}, median {statistics.median(totals):.0f}, max {max(totals)})")
+    for folder, count in per_folder.items():
+        print(f"  {folder:<24} {count:>8}")
+    print(f"message size: median {statistics.median(sample) / 1024:.1f} KB, "
+          f"mean {statistics.mean(sample) / 1024:.1f} KB, "
+          f"estimated total {sum(totals) * statistics.mean(sample) / 1024 ** 2:.0f} MB")
+
+
+def report(stats, elapsed, args):
+    megabytes = stats.bytes / 1024 ** 2
+    result = {
+        "messages": stats.messages,
+        "megabytes": round(megabytes, 2),
+        "already_present": stats.skipped,
+        "errors": stats.errors,
+        "elapsed_seconds": round(elapsed, 2),
+        "messages_per_second": round(stats.messages / elapsed, 1) if elapsed else 0.0,
+        "megabytes_per_second": round(megabytes / elapsed, 2) if elapsed else 0.0,
+        "append_latency_ms": {
+            name: round(percentile(stats.latencies, fraction) * 1000, 1)
+            for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))
+        },
+        "connections": args.connections,
+        "batch": args.batch,
+        "pipeline": args.pipeline,
+        "per_connection": stats.per_connection,
+    }
+    print(f"Seeded {result['messages']} messages ({result['megabytes']} MB) in {result['elapsed_seconds']}s: "
+          f"{result['messages_per_second']} msg/s, {result['megabytes_per_second']} MB/s; "
+          f"{result['already_present']} already present, {result['errors']} errors")
+    latency = result["append_latency_ms"]
+    print(f"APPEND command latency ms: p50 {latency['p50']}, p95 {latency['p95']}, "
+          f"p99 {latency['p99']}, max {latency['max']}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Report written to {args.report}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users-file", default="test_data/users.csv")
+    parser.add_argument("--accounts", type=int, help="seed only the first N accounts")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--messages-median", type=float, default=200, help="median messages per account")
+    parser.add_argument("--messages-sigma", type=float, default=1.0, help="log-normal sigma of the count")
+    parser.add_argument("--messages-max", type=int, default=5000)
+    parser.add_argument("--folders", default="INBOX:60,Sent:15,Archive/2024:10,Archive/2023:10,Projects/Load:5",
+                        help="folder:weight,...")
+    parser.add_argument("--sizes", default="2k:55,8k:25,40k:14,300k:5,2m:1", help="size:weight,...")
+    parser.add_argument("--flags", default="\\Seen:0.7,\\Answered:0.15,\\Flagged:0.05",
+                        help="flag:probability,...")
+    parser.add_argument("--domain", default=MAIL_DOMAIN, help="sender domain")
+    parser.add_argument("--connections", type=int, default=8, help="concurrent IMAP connections")
+    parser.add_argument("--batch", type=int, default=20, help="messages per MULTIAPPEND")
+    parser.add_argument("--pipeline", type=int, default=4, help="APPEND commands in flight (LITERAL+ only)")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without connecting")
+    parser.add_argument("--report", help="write the ingest report as JSON")
+    args = parser.parse_args()
+
+    users = list(get_user_manager(args.users_file).users)[:args.accounts]
+    if not users:
+        print(f"No accounts to seed in {args.users_file}", file=sys.stderr)
+        return 0
+    plan = SeedPlan(args)
+    print_plan(plan, users)
+    if args.dry_run:
+        return 0
+
+    units = [(user, folder, count) for user in users
+             for folder, count in plan.folder_counts(user.email).items() if count]
+    seeder = Seeder(args, plan)
+    started = time.perf_counter()
+    seeder.run(units)
+    result = report(seeder.stats, time.perf_counter() - started, args)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
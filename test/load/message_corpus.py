@@ -0,0 +1,105 @@
+# message_corpus.py - Pre-rendered message corpus
+#
+# Building a MIME tree with Faker content and serializing it on every send makes the
+# Locust worker CPU the bottleneck long before Postfix. The corpus pre-builds a pool
+# of fully serialized messages per (template type, size class) once per worker
+# process. At send time only the per-message headers (From, To, Date, Message-ID,
+# plus any tracking headers) are prepended to the cached bytes, and the result is
+# handed to sendmail().
+#
+# Memory is bounded: the pools are kept in LRU order and whole pools are evicted
+# once the total cached bytes exceed the configured limit. An evicted pool is simply
+# rebuilt the next time it is requested.
+#
+import os
+import time
+import random
+import itertools
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+
+
+class MessageCorpus:
+    """Bounded LRU pool of pre-serialized messages keyed by template type and size class"""
+
+    # Extra body bytes added on top of the rendered template for each size class
+    SIZE_CLASSES = {
+        "small": 0,
+        "medium": 16 * 1024,
+        "large": 128 * 1024,
+    }
+
+    def __init__(self, build_message, variants_per_key=20, max_bytes=64 * 1024 * 1024, domain="localhost"):
+        # build_message(email_type, size_class) -> serialized message without envelope headers
+        self.build_message = build_message
+        self.variants_per_key = max(1, variants_per_key)
+        self.max_bytes = max_bytes
+        self.domain = domain
+        self.total_bytes = 0
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._id_prefix = f"{os.getpid()}.{random.getrandbits(32):08x}"
+        self._date_second = None
+        self._date_header = None
+
+    def warm(self, email_types, size_classes):
+        """Pre-build pools for every combination of template type and size class"""
+        for email_type in email_types:
+            for size_class in size_classes:
+                self._get_pool(email_type, size_class)
+
+    def _get_pool(self, email_type, size_class):
+        """Return the pool for a key, building it (and evicting old pools) if needed"""
+        key = (email_type, size_class)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                self._pools.move_to_end(key)
+                return pool
+
+        pool = [self.build_message(email_type, size_class) for _ in range(self.variants_per_key)]
+        pool_bytes = sum(len(message) for message in pool)
+
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = pool
+                self.total_bytes += pool_bytes
+            # Evict least recently used pools, but always keep the one just requested
+            while self.total_bytes > self.max_bytes and len(self._pools) > 1:
+                _, evicted = self._pools.popitem(last=False)
+                self.total_bytes -= sum(len(message) for message in evicted)
+            return self._pools[key]
+
+    def _date(self):
+        """RFC 5322 date header value, formatted at most once per second"""
+        now = int(time.time())
+        if now != self._date_second:
+            self._date_header = formatdate(now).encode()
+            self._date_second = now
+        return self._date_header
+
+    def render(self, email_type, size_class, sender, recipients, extra_headers=None, cc=None):
+        """Return a complete message as bytes ready for sendmail()"""
+        body = random.choice(self._get_pool(email_type, size_class))
+        message_id = f"<{self._id_prefix}.{next(self._counter)}@{self.domain}>"
+        headers = (
+            b"From: " + sender.encode() + b"\r\n"
+            b"To: " + ", ".join(recipients).encode() + b"\r\n"
+            + (b"Cc: " + ", ".join(cc).encode() + b"\r\n" if cc else b"")
+            + b"Date: " + self._date() + b"\r\n"
+            b"Message-ID: " + message_id.encode() + b"\r\n"
+        )
+        if extra_headers:
+            headers += "".join(f"{name}: {value}\r\n" for name, value in extra_headers.items()).encode()
+        return headers + body
+
+    def stats(self):
+        """Current number of pools, messages and cached bytes"""
+        with self._lock:
+            return {
+                "pools": len(self._pools),
+                "messages": sum(len(pool) for pool in self._pools.values()),
+                "bytes": self.total_bytes,
+            }
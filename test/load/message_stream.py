@@ -0,0 +1,57 @@
+# message_stream.py - Streaming large-message generation
+#
+# ATTACHMENT_MODE=mime holds the raw file, its base64 encoding and the serialized
+# MIMEMultipart in memory at once, so many users sending 5-8 MB attachments blow up
+# the worker's RSS. In ATTACHMENT_MODE=stream the attachment is not read from a file
+# at all: GeneratedAttachment produces pseudo-random bytes from a per-message seed
+# and base64-encodes them block by block as the SMTP stream consumes them. Only the
+# small envelope (headers, text part, MIME boundaries) is serialized with the email
+# package, so per-user memory is O(STREAM_CHUNK_KB) whatever the message size.
+#
+# The chunks feed either DATA (smtp_session.send_raw_message) or, when the server
+# advertises CHUNKING and SMTP_USE_BDAT is on, BDAT (smtp_session.send_bdat_message).
+# Sizes are drawn between STREAM_ATTACHMENT_MIN_MB and STREAM_ATTACHMENT_MAX_MB and
+# deliberately not capped by MAX_ATTACHMENT_SIZE_MB, so Postfix's
+# message_size_limit rejection path can be driven at high concurrency.
+#
+import base64
+import random
+
+from attachment_cache import encoded_size
+
+# 57 input bytes encode to one 76-character base64 line
+_LINE_INPUT_BYTES = 57
+
+
+class GeneratedAttachment:
+    """Seeded pseudo-random attachment, base64-encoded on the fly"""
+
+    def __init__(self, raw_size, seed, filename="attachment.bin"):
+        self.raw_size = raw_size
+        self.seed = seed
+        self.filename = filename
+        self.encoded_size = encoded_size(raw_size)
+
+    def chunks(self, chunk_size=256 * 1024):
+        """Yield CRLF-wrapped base64 chunks of roughly chunk_size bytes"""
+        rng = random.Random(self.seed)
+        # Whole lines per block, so every chunk ends on a line boundary
+        lines = max(1, chunk_size // 78)
+        block = lines * _LINE_INPUT_BYTES
+        remaining = self.raw_size
+        while remaining > 0:
+            size = min(block, remaining)
+            remaining -= size
+            yield base64.encodebytes(rng.randbytes(size)).replace(b"\n", b"\r\n")
+
+
+def split_envelope(message_bytes, placeholder):
+    """Split a serialized message around the attachment body placeholder.
+
+    Returns (prefix, suffix) as raw bytes (not dot-stuffed); the encoded body goes
+    between them and already ends with CRLF.
+    """
+    prefix, suffix = message_bytes.split(placeholder)
+    if suffix.startswith(b"\r\n"):
+        suffix = suffix[2:]
+    return prefix, suffix
@@ -0,0 +1,217 @@
+# mx_relay.py - External sender identities and greylist retries for the MX workload
+#
+# Submission (port 587) is authenticated and comes from a few known clients. The MX
+# (port 25) takes unauthenticated mail from many external MTAs, and that is where
+# Silver's abuse handling runs: the Postfix client rate limits per source address,
+# SPF, DKIM and DMARC checks, and the rspamd milter with greylisting. The
+# MXRelayLoadTester users of a worker share one MXIdentityPool of external senders:
+#
+#   - MX_IDENTITIES identities, each with a sender domain (from MX_SENDER_DOMAINS,
+#     or a synthetic senderNNNN.example.net), an EHLO name and, with
+#     MX_SOURCE_ADDRESSES, a source address of its own. A few large senders send
+#     most of the mail (Zipf over the identities, MX_IDENTITY_ZIPF_EXPONENT)
+#   - MX_DKIM_SHARE of the identities, spread evenly over the popularity ranks,
+#     DKIM-sign everything they send (see dkim_signer.py); the rest send unsigned
+#   - a session delivers MX_MESSAGES_PER_SESSION messages, the way Postfix's
+#     connection cache does towards a busy destination
+#   - a greylisted message is kept and retried unchanged from the same identity
+#     (same source address, sender, recipients and body) after
+#     MX_GREYLIST_RETRY_SECONDS, like a real MTA's deferred queue. When it gets
+#     through, "MX greylist.delay" reports how long it was held up
+#
+# Source addresses must be local. On Linux all of 127.0.0.0/8 is, so against the
+# stand-in MX_SOURCE_ADDRESSES=127.0.1.0/24 gives every identity its own client
+# address for rate limits and greylisting; against a real server the addresses
+# have to be added to the load generator's interface first.
+#
+import time
+import bisect
+import logging
+import ipaddress
+import itertools
+import threading
+import collections
+from collections import namedtuple
+
+from locust import events
+
+from config import EmailServerConfig
+from user_manager import parse_fanout, zipf_cum_weights
+from throttle import smtp_codes
+from dkim_signer import DKIMSigner, ensure_private_key
+
+logger = logging.getLogger(__name__)
+
+SENDER_LOCAL_PARTS = ("newsletter", "noreply", "info", "billing", "alerts", "support", "notifications", "orders")
+# Reply texts of rspamd ("451 4.7.1 Try again later") and postgrey ("450 4.2.0 ... Greylisted")
+_GREYLIST_REPLIES = ("greylist", "graylist", "try again later")
+_MAX_PENDING_RETRIES = 10000  # per worker; later greylisted messages are given up
+
+# A message as sent; recipients is the envelope, first_attempt set once it was greylisted
+OutboundMessage = namedtuple('OutboundMessage', ['sender', 'recipients', 'data', 'signed', 'first_attempt'])
+
+
+def is_greylisting(exception):
+    """True for a temporary rejection that reads like greylisting"""
+    text = str(exception).lower()
+    return (any(400 <= code < 500 for code in smtp_codes(exception))
+            and any(reply in text for reply in _GREYLIST_REPLIES))
+
+
+def source_addresses(spec, limit):
+    """Expand MX_SOURCE_ADDRESSES, e.g. "192.0.2.10,127.0.1.0/24", into at most limit addresses"""
+    addresses = []
+    for item in spec.split(","):
+        item = item.strip()
+        if item:
+            network = ipaddress.ip_network(item, strict=False)
+            addresses.extend(str(address) for address in itertools.islice(network.hosts(), limit - len(addresses)))
+    return addresses
+
+
+class SenderIdentity:
+    """One external MTA"""
+
+    __slots__ = ("index", "hostname", "domain", "source_address", "signed")
+
+    def __init__(self, index, hostname, domain, source_address, signed):
+        self.index = index
+        self.hostname = hostname  # EHLO name
+        self.domain = domain  # MAIL FROM and From: domain
+        self.source_address = source_address  # (address, 0) for smtplib, or None
+        self.signed = signed
+
+    def sender(self, rng):
+        """A sender address of this identity"""
+        return f"{rng.choice(SENDER_LOCAL_PARTS)}@{self.domain}"
+
+
+class MXIdentityPool:
+    """External senders and their greylisted messages, shared per worker"""
+
+    def __init__(self, config=EmailServerConfig):
+        count = max(1, config.MX_IDENTITIES)
+        addresses = source_addresses(config.MX_SOURCE_ADDRESSES, count)
+        domains = config.MX_SENDER_DOMAINS
+        share = min(max(config.MX_DKIM_SHARE, 0.0), 1.0)
+        self.identities = []
+        for index in range(count):
+            if domains:
+                domain = domains[index % len(domains)]
+                hostname = f"mta{index}.{domain}"
+            else:
+                domain = f"sender{index:04d}.example.net"
+                hostname = f"mail.{domain}"
+            self.identities.append(SenderIdentity(
+                index, hostname, domain,
+                (addresses[index % len(addresses)], 0) if addresses else None,
+                int((index + 1) * share) > int(index * share)
+            ))
+        self.cum_weights = zipf_cum_weights(count, config.MX_IDENTITY_ZIPF_EXPONENT)
+        self.session_sizes = parse_fanout(config.MX_MESSAGES_PER_SESSION, "MX_MESSAGES_PER_SESSION")
+        self._size_weights = list(itertools.accumulate(weight for _, _, weight in self.session_sizes))
+        self.retry_after = config.MX_GREYLIST_RETRY_SECONDS
+        self.retries = collections.defaultdict(collections.deque)  # identity index -> [(due, message)]
+        self.pending = 0
+        self._due = collections.deque()  # (due, identity index), in due order
+        self.dkim_domain = config.MX_DKIM_DOMAIN
+        self.signer = None
+        signing = sum(identity.signed for identity in self.identities)
+        if signing:
+            self.signer = DKIMSigner(ensure_private_key(config.MX_DKIM_KEY), config.MX_DKIM_SELECTOR)
+            where = self.dkim_domain or (", ".join(domains) if domains else "each sender domain")
+            logger.info(f"MX: {signing} of {count} sender identities sign; for signatures that verify publish "
+                        f"{config.MX_DKIM_SELECTOR}._domainkey TXT \"{self.signer.record()}\" at {where}")
+
+    def pick(self, rng):
+        """Identity for the next session: one with a greylisted message due, else by popularity"""
+        if self._due and self._due[0][0] <= time.monotonic():
+            return self.identities[self._due.popleft()[1]]
+        index = bisect.bisect(self.cum_weights, rng.random() * self.cum_weights[-1], 0, len(self.cum_weights) - 1)
+        return self.identities[index]
+
+    def session_size(self, rng):
+        """Draw a number of messages for one session from MX_MESSAGES_PER_SESSION"""
+        index = bisect.bisect(self._size_weights, rng.random() * self._size_weights[-1],
+                              0, len(self._size_weights) - 1)
+        low, high, _ = self.session_sizes[index]
+        return rng.randint(low, high)
+
+    def sign(self, identity, data):
+        """data (bytes with CRLF line endings), DKIM-signed if identity signs"""
+        if not identity.signed:
+            return data
+        return self.signer.sign(data, self.dkim_domain or identity.domain)
+
+    def next_retry(self, identity):
+        """A greylisted message of identity that is due for its retry, or None"""
+        queue = self.retries.get(identity.index)
+        if not queue or queue[0][0] > time.monotonic():
+            return None
+        self.pending -= 1
+        return queue.popleft()[1]
+
+    def retry_later(self, identity, message):
+        """Keep a greylisted message for a retry; False if retries are off or too many are pending"""
+        if not self.retry_after or self.pending >= _MAX_PENDING_RETRIES:
+            return False
+        if message.first_attempt is None:
+            message = message._replace(first_attempt=time.time())
+        due = time.monotonic() + self.retry_after
+        self.retries[identity.index].append((due, message))
+        self._due.append((due, identity.index))
+        self.pending += 1
+        return True
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+@events.test_start.add_listener
+def _reset_pool(**kwargs):
+    """Start every run without greylisted messages from the previous one"""
+    global _shared_pool
+    with _shared_pool_lock:
+        _shared_pool = None
+
+
+def get_mx_identities():
+    """Return the MXIdentityPool shared by all MX users in this worker"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = MXIdentityPool()
+    return _shared_pool
+
+
+def log_mx_summary(environment, **kwargs):
+    """test_stop listener: outcome rates of signed and unsigned deliveries"""
+    entries = environment.stats.entries
+    lines = []
+    for kind in ("dkim", "unsigned"):
+        name = f"deliver_{kind}"
+        accepted = entries.get((name, "MX"))
+        outcomes = [entries.get((f"{name}{suffix}", "MX")) for suffix in (".greylisted", ".deferred", "_rate_limited")]
+        counts = [entry.num_requests if entry else 0 for entry in outcomes]
+        sent = accepted.num_requests if accepted else 0
+        failed = accepted.num_failures if accepted else 0
+        total = sent + sum(counts)
+        if not total:
+            continue
+        ok = sent - failed
+        p95 = accepted.get_response_time_percentile(0.95) if ok else 0
+        lines.append(
+            f"  {kind:<9} {total:>7} sent  {ok / total:>6.1%} accepted  {counts[0] / total:>6.1%} greylisted  "
+            f"{counts[1] / total:>6.1%} deferred  {counts[2] / total:>6.1%} rate limited  "
+            f"{failed / total:>6.1%} errors  accepted p95 {p95:.0f} ms"
+        )
+    delay = entries.get(("greylist.delay", "MX"))
+    if delay and delay.num_requests:
+        lines.append(f"  {delay.num_requests} greylisted messages got through on retry after "
+                     f"{delay.avg_response_time / 1000:.0f}s on average")
+    sessions = entries.get(("session", "MX"))
+    if sessions and sessions.num_requests:
+        lines.append(f"  {sessions.num_requests} sessions, {sessions.avg_content_length:.1f} messages accepted per session")
+    if lines:
+        logger.info("MX deliveries:\n" + "\n".join(lines))
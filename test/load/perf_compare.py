@@ -0,0 +1,374 @@
+# perf_compare.py - Baseline vs candidate performance comparison
+"""
+Run a fixed, seeded workload against a target and store it as a baseline, then
+compare later runs (a Postfix, rspamd or Raven image bump, a config change) with
+it per operation and exit non-zero on a significant regression.
+
+A run directory holds Locust's CSV stats, the HDR latency log of every request
+(see latency_histograms.py) and meta.json with the workload, the git revision of
+this suite and free-form labels such as image versions. Per operation the
+comparison checks:
+
+  latency     Mann-Whitney U test on the full latency histograms, plus the
+              relative change of p50 and p95 in the same direction
+  throughput  Welch's t-test on the per-slice request rates
+  errors      two-proportion z-test on the failure rate
+
+A change counts as a regression only if it is significant (p < --alpha) and
+larger than the practical thresholds (--latency-threshold, --min-delta-ms,
+--throughput-threshold, --error-threshold), so a big sample alone cannot fail the
+build on noise. An operation of the baseline that the candidate never ran is a
+regression as well.
+
+Usage (from test/load):
+    python perf_compare.py run baselines/postfix-3.8 --label postfix=3.8.1 --users 20 --duration 300
+    python perf_compare.py run baselines/postfix-3.9 --label postfix=3.9.0 --users 20 --duration 300
+    python perf_compare.py compare baselines/postfix-3.8 baselines/postfix-3.9 --html compare.html
+"""
+import os
+import re
+import csv
+import sys
+import json
+import html
+import math
+import time
+import argparse
+import statistics
+import subprocess
+
+from latency_histograms import HdrHistogram
+
+SCHEMA_VERSION = 1
+LOAD_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def git_revision():
+    """Commit of this suite, so a baseline can be traced to the workload that made it"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=LOAD_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_workload(args):
+    """Run the seeded workload headless and store it in args.directory"""
+    directory = os.path.abspath(args.directory)
+    os.makedirs(directory, exist_ok=True)
+    workload = {
+        "users": args.users,
+        "spawn_rate": args.spawn_rate or args.users,
+        "duration": args.duration,
+        "seed": args.seed,
+        "arrival_model": args.arrival_model,
+        "smtp_arrival_rate": args.smtp_rate,
+        "imap_arrival_rate": args.imap_rate,
+        "user_classes": args.user_classes,
+    }
+    env = dict(
+        os.environ,
+        LOADTEST_SEED=str(args.seed),
+        USER_PARTITIONING="true",
+        HDR_STATS="true",
+        HDR_LOG=os.path.join(directory, "hdr_latency.jsonl"),
+        HDR_SUMMARY=os.path.join(directory, "hdr_summary.json"),
+    )
+    for stale in (env["HDR_LOG"], os.path.join(directory, "meta.json")):
+        if os.path.exists(stale):
+            os.remove(stale)
+    command = [
+        sys.executable, "-m", "locust", "-f", "locustfile.py", "--headless",
+        "-u", str(args.users), "-r", str(workload["spawn_rate"]), "-t", f"{args.duration}s",
+        "--arrival-model", args.arrival_model,
+        "--smtp-arrival-rate", str(args.smtp_rate), "--imap-arrival-rate", str(args.imap_rate),
+        "--csv", os.path.join(directory, "locust"), "--only-summary",
+        # Failed requests are part of the result; any other exit code means locust itself failed
+        "--exit-code-on-error", "0",
+    ] + args.user_classes
+    started = time.time()
+    returncode = subprocess.call(command, cwd=LOAD_DIR, env=env)
+    if returncode != 0 or not os.path.exists(env["HDR_LOG"]):
+        problem = f"exited with code {returncode}" if returncode != 0 else f"wrote no {env['HDR_LOG']}"
+        print(f"locust {problem}; not storing the run in {directory}", file=sys.stderr)
+        return returncode or 1
+    meta = {
+        "schema": SCHEMA_VERSION,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(started)),
+        "wall_seconds": round(time.time() - started, 1),
+        "suite_revision": git_revision(),
+        "target": os.getenv("LOADTEST_TARGET", "server"),
+        "mail_domain": os.getenv("MAIL_DOMAIN"),
+        "labels": dict(label.split("=", 1) for label in args.label),
+        "workload": workload,
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"Stored run in {directory}")
+    return 0
+
+
+class RunData:
+    """Latency histograms, per-slice rates and failure counts of a stored run"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        for name in ("meta.json", "hdr_latency.jsonl"):
+            if not os.path.exists(os.path.join(directory, name)):
+                raise ValueError(f"{directory} is not a stored run: {name} is missing")
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.histograms = {}
+        self.slice_rates = {}
+        self._read_log(os.path.join(directory, "hdr_latency.jsonl"))
+        self.requests, self.failures = self._read_stats(os.path.join(directory, "locust_stats.csv"))
+
+    def _read_log(self, path):
+        slices = {}
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                histogram = HdrHistogram.from_pairs(entry["raw"])
+                operation = entry["op"]
+                if operation in self.histograms:
+                    self.histograms[operation].merge(histogram)
+                else:
+                    self.histograms[operation] = histogram
+                slices.setdefault(entry["start"], (entry["end"] - entry["start"], {}))[1][operation] = histogram.total
+        # Full slices only; the first and last are partial and would skew the rates
+        for start in sorted(slices)[1:-1]:
+            seconds, counts = slices[start]
+            if seconds <= 0:
+                continue
+            for operation in self.histograms:
+                self.slice_rates.setdefault(operation, []).append(counts.get(operation, 0) / seconds)
+
+    def _read_stats(self, path):
+        requests, failures = {}, {}
+        if not os.path.exists(path):
+            return requests, failures
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                if row["Name"] == "Aggregated":
+                    continue
+                key = f"{row['Type']} {row['Name']}"
+                requests[key] = int(row["Request Count"])
+                failures[key] = int(row["Failure Count"])
+        return requests, failures
+
+
+def mann_whitney(baseline, candidate):
+    """Mann-Whitney U on two histograms (ties per bucket); returns (P(candidate slower), p-value)"""
+    n1, n2 = baseline.total, candidate.total
+    if not n1 or not n2:
+        return 0.5, 1.0
+    rank = 0.0
+    candidate_rank_sum = 0.0
+    ties = 0.0
+    for bucket in sorted(set(baseline.counts) | set(candidate.counts)):
+        a = baseline.counts.get(bucket, 0)
+        b = candidate.counts.get(bucket, 0)
+        t = a + b
+        average_rank = rank + (t + 1) / 2
+        candidate_rank_sum += b * average_rank
+        ties += t ** 3 - t
+        rank += t
+    n = n1 + n2
+    u = candidate_rank_sum - n2 * (n2 + 1) / 2
+    mean = n1 * n2 / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))) if n > 1 else 0.0
+    if variance <= 0:
+        return 0.5, 1.0
+    z = (u - mean) / math.sqrt(variance)
+    return u / (n1 * n2), math.erfc(abs(z) / math.sqrt(2))
+
+
+def welch(baseline, candidate):
+    """Welch's t-test (normal approximation); returns (relative change of the mean, p-value)"""
+    if len(baseline) < 2 or len(candidate) < 2:
+        return 0.0, 1.0
+    mean1, mean2 = statistics.fmean(baseline), statistics.fmean(candidate)
+    error = math.sqrt(statistics.variance(baseline) / len(baseline) + statistics.variance(candidate) / len(candidate))
+    change = (mean2 - mean1) / mean1 if mean1 else 0.0
+    if error == 0:
+        return change, 1.0 if mean1 == mean2 else 0.0
+    return change, math.erfc(abs(mean2 - mean1) / error / math.sqrt(2))
+
+
+def two_proportions(failures1, total1, failures2, total2):
+    """Two-proportion z-test; returns (rate1, rate2, p-value)"""
+    if not total1 or not total2:
+        return 0.0, 0.0, 1.0
+    rate1, rate2 = failures1 / total1, failures2 / total2
+    pooled = (failures1 + failures2) / (total1 + total2)
+    error = math.sqrt(pooled * (1 - pooled) * (1 / total1 + 1 / total2))
+    if error == 0:
+        return rate1, rate2, 1.0
+    return rate1, rate2, math.erfc(abs(rate2 - rate1) / error / math.sqrt(2))
+
+
+def compare_operation(operation, baseline, candidate, args):
+    """One row of the diff report"""
+    base, cand = baseline.histograms[operation], candidate.histograms[operation]
+    row = {"operation": operation, "count": (base.total, cand.total), "findings": []}
+
+    p50 = (base.value_at_percentile(50) / 1000, cand.value_at_percentile(50) / 1000)
+    p95 = (base.value_at_percentile(95) / 1000, cand.value_at_percentile(95) / 1000)
+    slower, p_latency = mann_whitney(base, cand)
+    row.update(p50=p50, p95=p95, p_latency=p_latency, slower=slower)
+
+    def relative(pair):
+        return (pair[1] - pair[0]) / pair[0] if pair[0] else 0.0
+
+    if p_latency < args.alpha:
+        for label, pair in (("p50", p50), ("p95", p95)):
+            change = relative(pair)
+            # The percentile must move the same way as the distribution as a whole
+            if (change > 0) != (slower > 0.5):
+                continue
+            if abs(change) > args.latency_threshold and abs(pair[1] - pair[0]) >= args.min_delta_ms:
+                row["findings"].append(("regression" if change > 0 else "improvement",
+                                        f"{label} {pair[0]:.1f} -> {pair[1]:.1f} ms ({change:+.0%})"))
+
+    rates = (baseline.slice_rates.get(operation, []), candidate.slice_rates.get(operation, []))
+    rate_change, p_rate = welch(*rates)
+    row.update(rate=tuple(statistics.fmean(r) if r else 0.0 for r in rates), rate_change=rate_change, p_rate=p_rate)
+    if p_rate < args.alpha and abs(rate_change) > args.throughput_threshold:
+        row["findings"].append(("regression" if rate_change < 0 else "improvement",
+                                f"throughput {rate_change:+.0%}"))
+
+    rate1, rate2, p_errors = two_proportions(
+        baseline.failures.get(operation, 0), baseline.requests.get(operation, base.total),
+        candidate.failures.get(operation, 0), candidate.requests.get(operation, cand.total),
+    )
+    row.update(errors=(rate1, rate2), p_errors=p_errors)
+    if p_errors < args.alpha and abs(rate2 - rate1) > args.error_threshold:
+        row["findings"].append(("regression" if rate2 > rate1 else "improvement",
+                                f"errors {rate1:.2%} -> {rate2:.2%}"))
+    return row
+
+
+def verdict(row):
+    kinds = {kind for kind, _ in row["findings"]}
+    return "REGRESSION" if "regression" in kinds else "improved" if kinds else "same"
+
+
+def print_report(rows, missing, baseline, candidate):
+    print(f"baseline:  {baseline.directory} {baseline.meta.get('labels', {})} ({baseline.meta.get('started')})")
+    print(f"candidate: {candidate.directory} {candidate.meta.get('labels', {})} ({candidate.meta.get('started')})")
+    if baseline.meta.get("workload") != candidate.meta.get("workload"):
+        print("warning: the runs used different workloads")
+    print(f"{'operation':<34} {'count':>13} {'p50 ms':>15} {'p95 ms':>15} {'p(lat)':>8} "
+          f"{'req/s':>13} {'p(rate)':>8} {'errors':>15}  verdict")
+    for row in rows:
+        print(
+            f"{row['operation']:<34} {row['count'][0]:>6}/{row['count'][1]:<6} "
+            f"{row['p50'][0]:>7.1f}/{row['p50'][1]:<7.1f} {row['p95'][0]:>7.1f}/{row['p95'][1]:<7.1f} "
+            f"{row['p_latency']:>8.3g} {row['rate'][0]:>6.2f}/{row['rate'][1]:<6.2f} {row['p_rate']:>8.3g} "
+            f"{row['errors'][0]:>7.2%}/{row['errors'][1]:<7.2%}  {verdict(row)}"
+        )
+        for kind, text in row["findings"]:
+            print(f"    {kind}: {text}")
+    for operation in missing:
+        print(f"{operation:<34} {baseline.histograms[operation].total:>6}/{'-':<6}{'':>80}  REGRESSION")
+        print("    regression: missing in candidate")
+
+
+def write_html(path, rows, missing, baseline, candidate, args):
+    colors = {"REGRESSION": "#f8d7da", "improved": "#d4edda", "same": "#ffffff"}
+    lines = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Performance comparison</title>",
+        "<style>body{font-family:sans-serif}table{border-collapse:collapse}"
+        "td,th{border:1px solid #ccc;padding:4px 8px;text-align:right}td:first-child{text-align:left}</style>",
+        "</head><body><h1>Performance comparison</h1>",
+    ]
+    for title, run in (("Baseline", baseline), ("Candidate", candidate)):
+        lines.append(f"<p><b>{title}:</b> {html.escape(run.directory)} "
+                     f"<code>{html.escape(json.dumps(run.meta.get('labels', {})))}</code> "
+                     f"{html.escape(str(run.meta.get('started')))}, suite {html.escape(str(run.meta.get('suite_revision')))}</p>")
+    lines.append(f"<p>alpha {args.alpha}, latency threshold {args.latency_threshold:.0%}, "
+                 f"throughput threshold {args.throughput_threshold:.0%}, error threshold {args.error_threshold:.2%}</p>")
+    lines.append("<table><tr><th>Operation</th><th>Count</th><th>p50 ms</th><th>p95 ms</th><th>p (latency)</th>"
+                 "<th>Requests/s</th><th>p (rate)</th><th>Error rate</th><th>Verdict</th><th>Findings</th></tr>")
+    for row in rows:
+        findings = "<br>".join(html.escape(f"{kind}: {text}") for kind, text in row["findings"])
+        lines.append(
+            f"<tr style='background:{colors[verdict(row)]}'><td>{html.escape(row['operation'])}</td>"
+            f"<td>{row['count'][0]} / {row['count'][1]}</td>"
+            f"<td>{row['p50'][0]:.1f} / {row['p50'][1]:.1f}</td><td>{row['p95'][0]:.1f} / {row['p95'][1]:.1f}</td>"
+            f"<td>{row['p_latency']:.3g}</td><td>{row['rate'][0]:.2f} / {row['rate'][1]:.2f}</td>"
+            f"<td>{row['p_rate']:.3g}</td><td>{row['errors'][0]:.2%} / {row['errors'][1]:.2%}</td>"
+            f"<td>{verdict(row)}</td><td style='text-align:left'>{findings}</td></tr>"
+        )
+    for operation in missing:
+        lines.append(
+            f"<tr style='background:{colors['REGRESSION']}'><td>{html.escape(operation)}</td>"
+            f"<td>{baseline.histograms[operation].total} / -</td>" + "<td>-</td>" * 6 +
+            "<td>REGRESSION</td><td style='text-align:left'>regression: missing in candidate</td></tr>"
+        )
+    lines.append("</table></body></html>")
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+    print(f"HTML report written to {path}")
+
+
+def compare_runs(args):
+    try:
+        baseline, candidate = RunData(args.baseline), RunData(args.candidate)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    pattern = re.compile(args.operations) if args.operations else None
+    selected = sorted(
+        operation for operation in baseline.histograms
+        if not operation.startswith(("OPEN_MODEL", "THROTTLE", "PROFILE")) and (pattern is None or pattern.search(operation))
+    )
+    operations = [operation for operation in selected if operation in candidate.histograms]
+    missing = [operation for operation in selected if operation not in candidate.histograms]
+    rows = [compare_operation(operation, baseline, candidate, args) for operation in operations]
+    print_report(rows, missing, baseline, candidate)
+    if args.html:
+        write_html(args.html, rows, missing, baseline, candidate, args)
+    regressions = [row["operation"] for row in rows if verdict(row) == "REGRESSION"] + missing
+    if regressions:
+        print(f"{len(regressions)} operation(s) regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the seeded workload and store it")
+    run.add_argument("directory", help="where to store the run, e.g. baselines/postfix-3.8")
+    run.add_argument("--label", action="append", default=[], help="key=value, e.g. postfix=3.8.1 (repeatable)")
+    run.add_argument("--users", type=int, default=20)
+    run.add_argument("--spawn-rate", type=float)
+    run.add_argument("--duration", type=int, default=300, help="seconds")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--arrival-model", choices=["closed", "poisson", "constant"], default="constant",
+                     help="constant keeps the offered load identical between runs")
+    run.add_argument("--smtp-rate", type=float, default=5.0, help="SMTP tasks/s in the open model")
+    run.add_argument("--imap-rate", type=float, default=3.0, help="IMAP tasks/s in the open model")
+    run.add_argument("user_classes", nargs="*", help="Locust user classes (default: all)")
+
+    diff = commands.add_parser("compare", help="compare a candidate run with a baseline")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.add_argument("--alpha", type=float, default=0.01, help="significance level")
+    diff.add_argument("--latency-threshold", type=float, default=0.10, help="relative p50/p95 change")
+    diff.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore smaller absolute latency changes")
+    diff.add_argument("--throughput-threshold", type=float, default=0.05, help="relative requests/s change")
+    diff.add_argument("--error-threshold", type=float, default=0.005, help="absolute error rate change")
+    diff.add_argument("--operations", help="regex selecting the operations to compare")
+    diff.add_argument("--html", help="also write an HTML report")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        return run_workload(args)
+    return compare_runs(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
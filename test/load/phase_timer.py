@@ -0,0 +1,92 @@
+# phase_timer.py - Per-phase protocol timing
+#
+# A single "connect" time mixes DNS resolution, the TCP handshake, the greeting
+# banner (postscreen delay), EHLO, the TLS handshake and AUTH (a Thunder SASL
+# lookup). The Timed* connection classes in smtp_session.py and imap_session.py
+# record each phase into a PhaseTimer, and fire_phases() reports them as separate
+# Locust requests such as "SMTP connect.tls" or "SMTP send.queue_ack".
+#
+# Timing costs two perf_counter() calls and a tuple per phase, so it is always on.
+# With HARNESS_PROFILE, PhaseTimer.profiler also gets each phase's CPU time (see
+# harness_profiler.py).
+#
+import time
+import socket
+
+
+class PhaseTimer:
+    """Durations of consecutive protocol phases, in milliseconds"""
+
+    __slots__ = ("phases", "current", "_started", "_cpu_started")
+
+    profiler = None  # HarnessProfiler while HARNESS_PROFILE is on
+
+    def __init__(self):
+        self.phases = []
+        self.current = None
+        self._started = 0.0
+        self._cpu_started = 0.0
+
+    def start(self, name):
+        """Begin timing a phase"""
+        self.current = name
+        if self.profiler is not None:
+            self._cpu_started = self.profiler.greenlet_cpu()
+        self._started = time.perf_counter()
+
+    def stop(self, name=None):
+        """Finish the current phase, optionally renaming it (e.g. once a handshake is done)"""
+        elapsed = (time.perf_counter() - self._started) * 1000
+        name = name or self.current
+        self.phases.append((name, elapsed))
+        self.current = None
+        if self.profiler is not None:
+            self.profiler.phase(name, elapsed, (self.profiler.greenlet_cpu() - self._cpu_started) * 1000)
+
+    def failed(self):
+        """(name, milliseconds) of a phase that was started but never finished, or None"""
+        if self.current is None:
+            return None
+        return self.current, (time.perf_counter() - self._started) * 1000
+
+    def drain(self):
+        """Return and forget the finished phases"""
+        phases, self.phases = self.phases, []
+        return phases
+
+
+def create_connection(timer, host, port, timeout=None, source_address=None, read_timeout=None):
+    """socket.create_connection() with DNS and TCP connect timed as separate phases.
+
+    timeout bounds the TCP connect; read_timeout, if given, replaces it for every
+    later read and write (TLS handshake, greeting, commands).
+    """
+    timer.start("connect.dns")
+    addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    timer.stop()
+
+    timer.start("connect.tcp")
+    error = None
+    for family, _, _, _, address in addresses:
+        try:
+            sock = socket.create_connection(address[:2], timeout, source_address)
+            timer.stop()
+            if read_timeout is not None:
+                sock.settimeout(read_timeout)
+            return sock
+        except OSError as e:
+            error = e
+    raise error or OSError(f"getaddrinfo returned no addresses for {host}")
+
+
+def fire_phases(environment, request_type, timer, exception=None):
+    """Report finished phases; with an exception, also report the phase it interrupted"""
+    fire = environment.events.request.fire
+    for name, response_time in timer.drain():
+        fire(request_type=request_type, name=name, response_time=response_time,
+             response_length=0, exception=None)
+    failed = timer.failed() if exception is not None else None
+    if failed:
+        fire(request_type=request_type, name=failed[0], response_time=failed[1],
+             response_length=0, exception=exception)
+    timer.current = None
@@ -0,0 +1,345 @@
+# smtp_session.py - Reusable authenticated SMTP sessions and raw message transfer
+#
+# A session wraps an authenticated smtplib.SMTP connection so a Locust user can
+# send many messages over it, the way real MUAs and relays do. Between messages
+# the session is reset with RSET; after being idle it is health-checked with NOOP.
+# Sessions that hit a 421, a timeout or a disconnect are dropped and reconnected
+# by the caller.
+#
+# send_raw_message() runs the MAIL/RCPT/DATA transaction itself and writes the
+# message as a sequence of byte chunks, so large pre-encoded payloads can be sent
+# straight from a buffer or memory map without being joined into one bytes object.
+# send_pipelined() sends MAIL FROM, every RCPT TO and DATA in one write when the
+# server offers PIPELINING (RFC 2920), as MTAs relaying to an MX do.
+#
+# TimedSMTP records connect.dns/tcp/banner/ehlo/tls_full|tls_resumed/auth and
+# send.mail_from/rcpt_to/data/queue_ack into a PhaseTimer (see phase_timer.py);
+# send_pipelined() reports send.envelope instead of mail_from and rcpt_to.
+#
+import re
+import time
+import socket
+import smtplib
+
+from phase_timer import PhaseTimer, create_connection
+from tls_context import get_client_context, with_session, handshake_phase
+
+_LEADING_DOT = re.compile(rb'(?m)^\.')
+
+
+class TimedSMTP(smtplib.SMTP):
+    """smtplib.SMTP that times each protocol phase.
+
+    The connection is opened by connect(), not the constructor, so a timer passed
+    in still holds the phases completed before a failure.
+    """
+
+    def __init__(self, timer=None, read_timeout=None, **kwargs):
+        self.timer = timer or PhaseTimer()
+        self.read_timeout = read_timeout  # replaces timeout (connect only) once connected
+        super().__init__(**kwargs)
+
+    def connect(self, host='localhost', port=0, source_address=None):
+        self._host = host  # used as the TLS server name by starttls()
+        code, msg = super().connect(host, port, source_address)
+        self.timer.stop()
+        return code, msg
+
+    def _get_socket(self, host, port, timeout):
+        sock = create_connection(self.timer, host, port, timeout, self.source_address, self.read_timeout)
+        self.timer.start("connect.banner")  # finished in connect() once the greeting arrived
+        return sock
+
+    def ehlo(self, name=''):
+        self.timer.start("connect.ehlo")
+        reply = super().ehlo(name)
+        self.timer.stop()
+        return reply
+
+    def starttls(self, context=None, session=None):
+        """STARTTLS, offering session for resumption; timed as connect.tls_full/_resumed"""
+        self.ehlo_or_helo_if_needed()
+        self.timer.start("connect.tls")
+        if session is not None:
+            context = with_session(context or get_client_context(), session)
+        reply = super().starttls(context=context)
+        # RFC 3207 requires a new EHLO after the handshake; count it as TLS setup
+        smtplib.SMTP.ehlo(self)
+        self.timer.stop(handshake_phase(self.sock))
+        return reply
+
+    def login(self, user, password, **kwargs):
+        self.ehlo_or_helo_if_needed()
+        self.timer.start("connect.auth")
+        reply = super().login(user, password, **kwargs)
+        self.timer.stop()
+        return reply
+
+    def mail(self, sender, options=()):
+        self.timer.start("send.mail_from")
+        reply = super().mail(sender, options)
+        self.timer.stop()
+        return reply
+
+    def rcpt(self, recip, options=()):
+        self.timer.start("send.rcpt_to")
+        reply = super().rcpt(recip, options)
+        self.timer.stop()
+        return reply
+
+    def data(self, msg):
+        """DATA with the transfer and the final queue acknowledgment timed separately"""
+        self.timer.start("send.data")
+        self.putcmd("data")
+        code, repl = self.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, repl)
+        if isinstance(msg, str):
+            msg = smtplib._fix_eols(msg).encode('ascii')
+        q = smtplib._quote_periods(msg)
+        if q[-2:] != smtplib.bCRLF:
+            q = q + smtplib.bCRLF
+        self.send(q + b"." + smtplib.bCRLF)
+        self.timer.stop()
+        self.timer.start("send.queue_ack")
+        reply = self.getreply()
+        self.timer.stop()
+        return reply
+
+
+class SMTPSession:
+    """Authenticated SMTP connection that can be reused across messages"""
+
+    def __init__(self, server, max_messages, healthcheck_after):
+        self.server = server
+        self.max_messages = max_messages
+        self.healthcheck_after = healthcheck_after
+        self.messages_sent = 0
+        self.last_used = time.time()
+
+    @property
+    def exhausted(self):
+        """True once the per-session message cap has been reached"""
+        return self.max_messages > 0 and self.messages_sent >= self.max_messages
+
+    def prepare(self):
+        """Make the session ready for the next message.
+
+        Runs NOOP if the session has been idle, then RSET. Returns False if the
+        server has closed or is refusing the session (421, timeout, disconnect).
+        """
+        try:
+            if time.time() - self.last_used >= self.healthcheck_after:
+                code, _ = self.server.noop()
+                if code != 250:
+                    return False
+            code, _ = self.server.rset()
+            return code == 250
+        except (smtplib.SMTPException, socket.timeout, OSError):
+            return False
+
+    def mark_used(self, messages=1):
+        """Record messages sent over this session"""
+        self.messages_sent += messages
+        self.last_used = time.time()
+
+    def close(self):
+        """Close the session, tolerating an already dead connection"""
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+def dot_stuff(data):
+    """Escape lines starting with '.' for the DATA stream (RFC 5321 4.5.2)"""
+    return _LEADING_DOT.sub(b'..', data)
+
+
+def _send_envelope(server, from_addr, to_addrs, size=None):
+    """MAIL FROM (with SIZE= when advertised) and RCPT TO; returns refused recipients"""
+    server.ehlo_or_helo_if_needed()
+    options = [f"SIZE={size}"] if size is not None and server.has_extn('size') else []
+    code, resp = server.mail(from_addr, options)
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server._rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+    refused = {}
+    for addr in to_addrs:
+        code, resp = server.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+        if code == 421:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(to_addrs):
+        server._rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    return refused
+
+
+def _data_failed(server, code, resp):
+    if code == 421:
+        server.close()
+    else:
+        server._rset()
+    raise smtplib.SMTPDataError(code, resp)
+
+
+def send_raw_message(server, from_addr, to_addrs, chunks, size=None):
+    """Send a message given as CRLF-terminated, dot-stuffed byte chunks.
+
+    Mirrors smtplib.SMTP.sendmail() but writes each chunk to the socket as-is.
+    With size, declares it on MAIL FROM (RFC 1870) if the server supports SIZE.
+    Returns the dict of refused recipients, like sendmail().
+    """
+    refused = _send_envelope(server, from_addr, to_addrs, size)
+
+    timer = getattr(server, 'timer', None)
+    if timer:
+        timer.start("send.data")
+    code, resp = server.docmd("data")
+    if code != 354:
+        _data_failed(server, code, resp)
+
+    for chunk in chunks:
+        server.sock.sendall(chunk)
+    server.sock.sendall(b".\r\n")
+
+    if timer:
+        timer.stop()
+        timer.start("send.queue_ack")
+    code, resp = server.getreply()
+    if timer:
+        timer.stop()
+    if code != 250:
+        _data_failed(server, code, resp)
+    return refused
+
+
+def send_bdat_message(server, from_addr, to_addrs, chunks, size=None):
+    """Send a message as BDAT chunks (RFC 3030 CHUNKING); chunks are NOT dot-stuffed.
+
+    With PIPELINING the reply to each chunk is read after the next chunk has been
+    written, so the transfer does not stall for a round trip per chunk. The reply to
+    the LAST chunk is the queue acknowledgment.
+    """
+    refused = _send_envelope(server, from_addr, to_addrs, size)
+    timer = getattr(server, 'timer', None)
+    if timer:
+        timer.start("send.data")
+    window = 1 if server.has_extn('pipelining') else 0
+    outstanding = 0
+
+    def send_chunk(chunk, last):
+        server.sock.sendall(b"BDAT %d%s\r\n" % (len(chunk), b" LAST" if last else b""))
+        server.sock.sendall(chunk)
+
+    def read_reply():
+        code, resp = server.getreply()
+        if code != 250:
+            # Replies to chunks already in flight would desynchronize an RSET
+            server.close()
+            raise smtplib.SMTPDataError(code, resp)
+
+    previous = None
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if previous is not None:
+            send_chunk(previous, False)
+            outstanding += 1
+            while outstanding > window:
+                read_reply()
+                outstanding -= 1
+        previous = chunk
+    send_chunk(previous if previous is not None else b"", True)
+    while outstanding:
+        read_reply()
+        outstanding -= 1
+
+    if timer:
+        timer.stop()
+        timer.start("send.queue_ack")
+    code, resp = server.getreply()
+    if timer:
+        timer.stop()
+    if code != 250:
+        _data_failed(server, code, resp)
+    return refused
+
+
+def send_pipelined(server, from_addr, to_addrs, msg, size=None):
+    """Send msg (bytes with CRLF line endings) with the envelope pipelined (RFC 2920).
+
+    MAIL FROM, the RCPT TOs and DATA go out in one write and their replies are read
+    together, timed as send.envelope. Without PIPELINING this falls back to one
+    round trip per command. Returns the dict of refused recipients, like sendmail().
+    """
+    server.ehlo_or_helo_if_needed()
+    if not server.has_extn('pipelining'):
+        refused = _send_envelope(server, from_addr, to_addrs, size)
+        code, resp = server.data(msg)
+        if code != 250:
+            _data_failed(server, code, resp)
+        return refused
+
+    timer = getattr(server, 'timer', None)
+    options = f" SIZE={size}" if size is not None and server.has_extn('size') else ""
+    commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}{options}"]
+    commands += [f"RCPT TO:{smtplib.quoteaddr(addr)}" for addr in to_addrs]
+    commands.append("DATA")
+    if timer:
+        timer.start("send.envelope")
+    server.send("".join(f"{command}\r\n" for command in commands))
+
+    code, resp = server.getreply()
+    if code == 421:
+        server.close()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    sender_refused = (code, resp) if code != 250 else None
+    refused = {}
+    for addr in to_addrs:
+        code, resp = server.getreply()
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+        if code == 421:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    code, resp = server.getreply()
+    if timer:
+        timer.stop()
+
+    if sender_refused or len(refused) == len(to_addrs):
+        if code == 354:
+            server.send(b"." + smtplib.bCRLF)  # the server opened DATA anyway; send nothing
+            server.getreply()
+        server._rset()
+        if sender_refused:
+            raise smtplib.SMTPSenderRefused(*sender_refused, from_addr)
+        raise smtplib.SMTPRecipientsRefused(refused)
+    if code != 354:
+        _data_failed(server, code, resp)
+
+    if timer:
+        timer.start("send.data")
+    q = smtplib._quote_periods(msg)
+    if q[-2:] != smtplib.bCRLF:
+        q = q + smtplib.bCRLF
+    server.send(q + b"." + smtplib.bCRLF)
+    if timer:
+        timer.stop()
+        timer.start("send.queue_ack")
+    code, resp = server.getreply()
+    if timer:
+        timer.stop()
+    if code != 250:
+        _data_failed(server, code, resp)
+    return refused
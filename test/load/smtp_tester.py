@@ -8,37 +8,103 @@
 # This is expected behavior during load testing and is treated as a successful test
 # scenario rather than a failure. Rate-limited requests are logged and counted
 # separately (with "_rate_limited" suffix) but do not cause the test to fail.
+# With THROTTLE_ENABLED these replies (and any other 4xx) also slow the worker's
+# connection and message rates down until the server stops rejecting them (see
+# throttle.py), so the send_* rows measure the accepted throughput.
+#
+# Session Reuse:
+# With SMTP_SESSION_REUSE enabled each Locust user keeps one authenticated session
+# alive (see smtp_session.py) and only pays for connect + STARTTLS + AUTH when the
+# session is new, exhausted or dropped by the server. "connect" and "send_*" are
+# always reported separately, so the cost of a new connection can be compared with
+# the cost of a message on an existing one. "session_check" times the RSET/NOOP
+# done before reusing a session.
+#
+# Phase Timing:
+# "connect" is also reported per phase (connect.dns, .tcp, .banner, .ehlo, .tls,
+# .auth) and every message per SMTP step (send.mail_from, .rcpt_to, .data,
+# .queue_ack), so a regression can be attributed to DNS, postscreen, TLS, SASL or
+# the queue (see phase_timer.py). The STARTTLS handshake is reported as
+# connect.tls_full or connect.tls_resumed; with TLS_SESSION_RESUMPTION each user
+# offers its previous TLS session when it reconnects (see tls_context.py).
+#
+# Attachments:
+# ATTACHMENT_MODE=stream generates the attachment on the fly and streams it in
+# bounded memory, over BDAT when the server offers CHUNKING (see message_stream.py).
+# A 552 size rejection is reported as "send_attachment_size_rejected", not a failure.
+#
+# Content Mix:
+# With CONTENT_MIX_USERS, ContentMixLoadTester sends spam-like, URL-heavy,
+# nested-archive, EICAR, GTUBE and large-text messages and reports latency and
+# rspamd/ClamAV verdicts per content class (see content_mix.py).
+#
+# Inbound MX:
+# With MX_RELAY_USERS, MXRelayLoadTester delivers to port 25 as external MTAs do:
+# no AUTH, opportunistic STARTTLS, the envelope pipelined, several messages per
+# session, from many sender identities, signed and unsigned (see mx_relay.py). Its
+# rows are of type MX: "deliver_dkim"/"deliver_unsigned" for accepted messages,
+# ".greylisted" and ".deferred" for 4xx replies (not failures), "greylist.delay"
+# for greylisted messages that got through on retry, and "session".
 #
 import time
-import random
 import smtplib
 import logging
 import os
+import itertools
 from locust import User, task, between
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
+from email.policy import SMTP
+from email.utils import formatdate, make_msgid
 from email import encoders
 
 from config import EmailServerConfig
-from data_generator import TestDataGenerator
-from user_manager import TestUserManager
+from data_generator import get_data_generator
+from user_manager import get_user_manager, assign_account, fanout_bucket
+from smtp_session import SMTPSession, TimedSMTP, send_raw_message, send_bdat_message, send_pipelined, dot_stuff
+from message_stream import GeneratedAttachment, split_envelope
+from phase_timer import PhaseTimer, fire_phases
+from tls_context import get_client_context, TLSSessionCache
+from attachment_cache import get_attachment_cache
+from delivery_tracker import get_delivery_tracker
+from arrival_scheduler import arrival_wait_time, wait_for_first_arrival
+from throttle import get_throttle, smtp_codes
+from content_mix import get_content_mix
+from mx_relay import get_mx_identities, is_greylisting, OutboundMessage
+from event_sink import event_recorder
 
 logger = logging.getLogger(__name__)
+trace = event_recorder(__name__)  # per-operation events (see event_sink.py)
 
+# Stands in for the attachment body while the MIME envelope is serialized
+_ATTACHMENT_PLACEHOLDER = b"@@ENCODED-ATTACHMENT-BODY@@"
 
-class SMTPLoadTester(User):
-    """SMTP Load Testing User"""
-    wait_time = between(1, 5)
-    weight = 3
+
+class SMTPUserBase(User):
+    """Shared SMTP connection handling and message sending"""
+    abstract = True
     
     def on_start(self):
         """Initialize user session"""
         self.config = EmailServerConfig()
-        self.data_generator = TestDataGenerator()
-        self.user_manager = TestUserManager()
-        self.user_account = self.user_manager.get_random_user()
-        logger.info(f"Starting SMTP tests for user: {self.user_account['email']}")
+        self.data_generator = get_data_generator()
+        self.user_manager = get_user_manager()
+        self.user_account, self.rng, self.recipients = assign_account(self.environment)
+        self.smtp_session = None
+        self.tls_sessions = TLSSessionCache(self.config.TLS_SESSION_RESUMPTION)
+        self.delivery_tracker = get_delivery_tracker(
+            self.config.E2E_TIMEOUT_SECONDS, self.config.E2E_MAX_PENDING
+        ) if self.config.E2E_TRACKING else None
+        self.throttle = get_throttle(self.environment) if self.config.THROTTLE_ENABLED else None
+        trace.info("smtp.user_start", user=self.user_account.email)
+        wait_for_first_arrival(self)
+    
+    def on_stop(self):
+        """Close any session kept open for reuse"""
+        if self.smtp_session:
+            self.smtp_session.close()
+            self.smtp_session = None
     
     def _is_rate_limit_error(self, exception):
         """Check if exception is a rate limit error (421 - too many connections)"""
@@ -47,23 +113,49 @@ class SMTPLoadTester(User):
             if len(exception.args) >= 1:
                 code = exception.args[0]
                 return code == 421
-        # Also check for errors during connection that contain '421'
+        # Also check for errors during connection that contain '421', and for
+        # smtpd_client_message/recipient_rate_limit replies (450 4.7.1 too much mail)
         error_str = str(exception).lower()
-        return '421' in error_str or 'too many connections' in error_str
+        return ('421' in error_str or 'too many connections' in error_str
+                or 'too much mail' in error_str or 'too many recipients' in error_str)
+    
+    def _is_size_limit_error(self, exception):
+        """Check if exception is a message size rejection (552 5.3.4, message_size_limit)"""
+        code = getattr(exception, 'smtp_code', None)
+        return code == 552 or '5.3.4' in str(exception)
+    
+    def _throttle_wait(self, kind, tokens=1):
+        """Wait for the adaptive throttle, if enabled, before a connection or send"""
+        if self.throttle:
+            self.throttle.wait(kind, tokens)
+    
+    def _throttle_feedback(self, kind, exception=None):
+        """Report a connection or send outcome to the adaptive throttle"""
+        if self.throttle:
+            self.throttle.feedback(kind, exception)
     
     def _connect_smtp(self):
         """Establish SMTP connection"""
+        self._throttle_wait("connect")
         start_time = time.time()
         server = None
+        timer = PhaseTimer()
         
         try:
+            server = TimedSMTP(timer=timer, timeout=self.config.CONNECT_TIMEOUT,
+                               read_timeout=self.config.READ_TIMEOUT)
+            code, message = server.connect(self.config.SMTP_SERVER, self.config.SMTP_PORT)
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, message)
             if self.config.USE_TLS:
-                server = smtplib.SMTP(self.config.SMTP_SERVER, self.config.SMTP_PORT)
-                server.starttls()
-            else:
-                server = smtplib.SMTP(self.config.SMTP_SERVER, self.config.SMTP_PORT)
+                server.starttls(
+                    context=get_client_context(),
+                    session=self.tls_sessions.get(self.config.SMTP_SERVER, self.config.SMTP_PORT)
+                )
             
-            server.login(self.user_account['username'], self.user_account['password'])
+            server.login(self.user_account.username, self.user_account.password)
+            if self.config.USE_TLS:
+                self.tls_sessions.save(self.config.SMTP_SERVER, self.config.SMTP_PORT, server.sock)
             
             response_time = (time.time() - start_time) * 1000
             self.environment.events.request.fire(
@@ -73,14 +165,17 @@ class SMTPLoadTester(User):
                 response_length=0,
                 exception=None
             )
+            fire_phases(self.environment, "SMTP", timer)
+            self._throttle_feedback("connect")
             return server
             
         except Exception as e:
             response_time = (time.time() - start_time) * 1000
+            self._throttle_feedback("connect", e)
             
             # Check if this is a rate limit error (expected during load testing)
             if self._is_rate_limit_error(e):
-                logger.info(f"SMTP rate limit hit (expected): {e}")
+                trace.info("smtp.rate_limited", op="connect", error=str(e))
                 # Report as success with a special marker
                 self.environment.events.request.fire(
                     request_type="SMTP",
@@ -98,50 +193,252 @@ class SMTPLoadTester(User):
                     response_length=0,
                     exception=e
                 )
+            fire_phases(self.environment, "SMTP", timer, None if self._is_rate_limit_error(e) else e)
             
             if server:
                 try:
                     server.quit()
-                except:
+                except Exception:
                     pass
             return None
     
+    def _acquire_smtp(self):
+        """Get an authenticated SMTP connection, reusing the user's session if enabled"""
+        if not self.config.SMTP_SESSION_REUSE:
+            return self._connect_smtp()
+        
+        if self.smtp_session:
+            start_time = time.time()
+            if self.smtp_session.prepare():
+                self.environment.events.request.fire(
+                    request_type="SMTP",
+                    name="session_check",
+                    response_time=(time.time() - start_time) * 1000,
+                    response_length=self.smtp_session.messages_sent,
+                    exception=None
+                )
+                return self.smtp_session.server
+            # Server closed the session (421, timeout, idle disconnect) - reconnect
+            trace.debug("smtp.session_reconnect", user=self.user_account.email)
+            self.smtp_session.close()
+            self.smtp_session = None
+        
+        server = self._connect_smtp()
+        if server:
+            self.smtp_session = SMTPSession(
+                server,
+                self.config.SMTP_MAX_MESSAGES_PER_SESSION,
+                self.config.SMTP_SESSION_HEALTHCHECK_SECONDS
+            )
+        return server
+    
+    def _release_smtp(self, server, messages=1):
+        """Return a connection after a successful send"""
+        fire_phases(self.environment, "SMTP", server.timer)
+        if self.smtp_session and self.smtp_session.server is server:
+            self.smtp_session.mark_used(messages)
+            if not self.smtp_session.exhausted:
+                return
+            self.smtp_session = None
+        try:
+            server.quit()
+        except Exception:
+            pass
+    
+    def _discard_smtp(self, server):
+        """Drop a connection after a failed send so it is never reused"""
+        if server:
+            fire_phases(self.environment, "SMTP", server.timer)
+        if self.smtp_session and self.smtp_session.server is server:
+            self.smtp_session = None
+        if server:
+            try:
+                server.quit()
+            except Exception:
+                pass
+    
+    def _tracking_headers(self, recipients):
+        """Headers that let DeliveryTrackerUser match the message on arrival"""
+        if not self.delivery_tracker:
+            return {}
+        headers, evicted = self.delivery_tracker.stamp(recipients)
+        for _ in range(evicted):
+            self.environment.events.request.fire(
+                request_type="E2E",
+                name="delivery_lost",
+                response_time=0,
+                response_length=0,
+                exception=Exception("evicted from full pending table before delivery")
+            )
+        return headers
+    
+    def _address(self, msg, recipients):
+        """Add To/Cc (Bcc stays in the envelope) and end-to-end tracking headers"""
+        msg['To'] = ", ".join(recipients.to)
+        if recipients.cc:
+            msg['Cc'] = ", ".join(recipients.cc)
+        for name, value in self._tracking_headers(recipients.envelope).items():
+            msg[name] = value
+    
+    def _report_fanout(self, recipients, response_time):
+        """Report a sent message as "fanout.<bucket>" when multi-recipient mail is enabled"""
+        if self.recipients.max_fanout == 1:
+            return
+        count = len(recipients.envelope)
+        self.environment.events.request.fire(
+            request_type="SMTP",
+            name=f"fanout.{fanout_bucket(count, self.config.RECIPIENT_FANOUT_BUCKETS)}",
+            response_time=response_time,
+            response_length=count,
+            exception=None
+        )
+    
+    def _send_from_corpus(self, server, email_type, recipients):
+        """Send a pre-rendered corpus message as raw bytes, returning its size"""
+        sender = self.user_account.email
+        raw_message = self.data_generator.render_message(
+            email_type, sender, recipients.to, cc=recipients.cc,
+            extra_headers=self._tracking_headers(recipients.envelope)
+        )
+        server.sendmail(sender, recipients.envelope, raw_message)
+        return len(raw_message)
+    
+    def _attachment_envelope(self, content, recipients, filename):
+        """Serialize the message around an attachment body; returns raw (prefix, suffix)"""
+        msg = MIMEMultipart()
+        msg['Subject'] = content['subject']
+        msg['From'] = self.user_account.email
+        self._address(msg, recipients)
+        msg.attach(MIMEText(content['body'], 'html'))
+        
+        part = MIMEBase('application', 'octet-stream')
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', f'attachment; filename= {filename}')
+        part.set_payload(_ATTACHMENT_PLACEHOLDER.decode())
+        msg.attach(part)
+        
+        # Serialize only the small envelope, then splice the encoded body in
+        return split_envelope(msg.as_bytes(policy=SMTP), _ATTACHMENT_PLACEHOLDER)
+    
+    def _send_encoded_attachment(self, server, content, recipients, encoded):
+        """Send a message whose base64 attachment body comes from encoded.chunks()"""
+        sender = self.user_account.email
+        prefix, suffix = self._attachment_envelope(content, recipients, encoded.filename)
+        size = len(prefix) + encoded.encoded_size + len(suffix)
+        declared = size if self.config.SMTP_DECLARE_SIZE else None
+        chunk_size = self.config.STREAM_CHUNK_KB * 1024
+        if self.config.SMTP_USE_BDAT and server.has_extn('chunking'):
+            send_bdat_message(
+                server, sender, recipients.envelope,
+                itertools.chain((prefix,), encoded.chunks(chunk_size), (suffix,)), declared
+            )
+        else:
+            send_raw_message(
+                server, sender, recipients.envelope,
+                itertools.chain((dot_stuff(prefix),), encoded.chunks(chunk_size), (dot_stuff(suffix),)), declared
+            )
+        return size
+    
+    def _send_cached_attachment(self, server, content, recipients, attachment):
+        """Send a message whose attachment body comes from the shared encoded cache"""
+        encoded = get_attachment_cache(self.config.ATTACHMENT_CACHE_DIR).get(attachment['path'])
+        return self._send_encoded_attachment(server, content, recipients, encoded)
+    
+    def _send_streamed_attachment(self, server, content, recipients):
+        """Send a message with a generated attachment, streamed in O(chunk) memory"""
+        low = self.config.STREAM_ATTACHMENT_MIN_MB * 1024 * 1024
+        high = self.config.STREAM_ATTACHMENT_MAX_MB * 1024 * 1024
+        attachment = GeneratedAttachment(
+            self.rng.randint(int(low), int(max(low, high))), self.rng.getrandbits(64),
+            f"generated-{self.rng.getrandbits(32):08x}.bin"
+        )
+        return self._send_encoded_attachment(server, content, recipients, attachment)
+    
+    def _send_mime_attachment(self, server, content, recipients, attachment):
+        """Build the attachment message with the email package and send it"""
+        msg = MIMEMultipart()
+        msg['Subject'] = content['subject']
+        msg['From'] = self.user_account.email
+        self._address(msg, recipients)
+        
+        # Add body
+        msg.attach(MIMEText(content['body'], 'html'))
+        
+        # Add attachment with size check (enforced by config)
+        if os.path.exists(attachment['path']):
+            file_size = os.path.getsize(attachment['path'])
+            
+            # Skip attachment if it exceeds configured limit
+            # Note: Base64 encoding adds ~33% overhead to the size
+            if file_size > self.config.MAX_ATTACHMENT_SIZE_BYTES:
+                trace.warning("smtp.attachment_skipped", path=attachment['path'], size=file_size,
+                              limit_mb=self.config.MAX_ATTACHMENT_SIZE_MB)
+            else:
+                with open(attachment['path'], "rb") as attachment_file:
+                    part = MIMEBase('application', 'octet-stream')
+                    part.set_payload(attachment_file.read())
+                
+                encoders.encode_base64(part)
+                part.add_header(
+                    'Content-Disposition',
+                    f'attachment; filename= {os.path.basename(attachment["path"])}'
+                )
+                msg.attach(part)
+        
+        server.send_message(msg, to_addrs=recipients.envelope)
+
+
+class SMTPLoadTester(SMTPUserBase):
+    """SMTP Load Testing User"""
+    # Closed model unless ARRIVAL_MODEL selects an open-model arrival rate
+    wait_time = arrival_wait_time("smtp", between(1, 5))
+    weight = 3
+    
     @task(5)
     def send_plain_text_email(self):
         """Send plain text email"""
-        server = self._connect_smtp()
+        self._throttle_wait("message")
+        server = self._acquire_smtp()
         if not server:
             return
         
         start_time = time.time()
         
         try:
-            content = self.data_generator.generate_email_content("plain_text")
-            recipient = self.user_manager.get_random_user()['email']
-            
-            msg = MIMEText(content['body'], 'plain')
-            msg['Subject'] = content['subject']
-            msg['From'] = self.user_account['email']
-            msg['To'] = recipient
+            recipients = self.recipients.pick_message()
             
-            server.send_message(msg)
-            server.quit()
+            if self.config.MESSAGE_CORPUS_ENABLED:
+                message_size = self._send_from_corpus(server, "plain_text", recipients)
+            else:
+                content = self.data_generator.generate_email_content("plain_text")
+                
+                msg = MIMEText(content['body'], 'plain')
+                msg['Subject'] = content['subject']
+                msg['From'] = self.user_account.email
+                self._address(msg, recipients)
+                
+                server.send_message(msg, to_addrs=recipients.envelope)
+                message_size = len(content['body'])
             
             response_time = (time.time() - start_time) * 1000
             self.environment.events.request.fire(
                 request_type="SMTP",
                 name="send_text",
                 response_time=response_time,
-                response_length=len(content['body']),
+                response_length=message_size,
                 exception=None
             )
+            self._report_fanout(recipients, response_time)
+            self._throttle_feedback("message")
+            self._release_smtp(server)
             
         except Exception as e:
             response_time = (time.time() - start_time) * 1000
+            self._throttle_feedback("message", e)
             
             # Check if this is a rate limit error
             if self._is_rate_limit_error(e):
-                logger.info(f"SMTP rate limit hit during send (expected): {e}")
+                trace.info("smtp.rate_limited", op="send_text", error=str(e))
                 self.environment.events.request.fire(
                     request_type="SMTP",
                     name="send_text_rate_limited",
@@ -158,51 +455,56 @@ class SMTPLoadTester(User):
                     exception=e
                 )
             
-            if server:
-                try:
-                    server.quit()
-                except:
-                    pass
+            self._discard_smtp(server)
     
     @task(3)
     def send_html_email(self):
         """Send HTML email"""
-        server = self._connect_smtp()
+        self._throttle_wait("message")
+        server = self._acquire_smtp()
         if not server:
             return
         
         start_time = time.time()
         
         try:
-            content = self.data_generator.generate_email_content("marketing")
-            recipient = self.user_manager.get_random_user()['email']
-            
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = content['subject']
-            msg['From'] = self.user_account['email']
-            msg['To'] = recipient
-            
-            html_part = MIMEText(content['body'], 'html')
-            msg.attach(html_part)
+            recipients = self.recipients.pick_message()
             
-            server.send_message(msg)
-            server.quit()
+            if self.config.MESSAGE_CORPUS_ENABLED:
+                message_size = self._send_from_corpus(server, "marketing", recipients)
+            else:
+                content = self.data_generator.generate_email_content("marketing")
+                
+                msg = MIMEMultipart('alternative')
+                msg['Subject'] = content['subject']
+                msg['From'] = self.user_account.email
+                self._address(msg, recipients)
+                
+                html_part = MIMEText(content['body'], 'html')
+                msg.attach(html_part)
+                
+                server.send_message(msg, to_addrs=recipients.envelope)
+                message_size = len(content['body'])
             
             response_time = (time.time() - start_time) * 1000
             self.environment.events.request.fire(
                 request_type="SMTP",
                 name="send_html",
                 response_time=response_time,
-                response_length=len(content['body']),
+                response_length=message_size,
                 exception=None
             )
+            self._report_fanout(recipients, response_time)
+            self._throttle_feedback("message")
+            self._release_smtp(server)
             
         except Exception as e:
             response_time = (time.time() - start_time) * 1000
+            self._throttle_feedback("message", e)
             
             # Check if this is a rate limit error
             if self._is_rate_limit_error(e):
-                logger.info(f"SMTP rate limit hit during send (expected): {e}")
+                trace.info("smtp.rate_limited", op="send_html", error=str(e))
                 self.environment.events.request.fire(
                     request_type="SMTP",
                     name="send_html_rate_limited",
@@ -219,16 +521,13 @@ class SMTPLoadTester(User):
                     exception=e
                 )
             
-            if server:
-                try:
-                    server.quit()
-                except:
-                    pass
+            self._discard_smtp(server)
     
     @task(1)
     def send_email_with_attachment(self):
-        """Send email with attachment (max 10MB)"""
-        server = self._connect_smtp()
+        """Send email with attachment (max 10MB, or the streamed size range)"""
+        self._throttle_wait("message")
+        server = self._acquire_smtp()
         if not server:
             return
         
@@ -236,58 +535,47 @@ class SMTPLoadTester(User):
         
         try:
             content = self.data_generator.generate_email_content("transactional")
-            recipient = self.user_manager.get_random_user()['email']
+            recipients = self.recipients.pick_message()
             attachment = self.data_generator.get_random_attachment()
             
-            msg = MIMEMultipart()
-            msg['Subject'] = content['subject']
-            msg['From'] = self.user_account['email']
-            msg['To'] = recipient
-            
-            # Add body
-            msg.attach(MIMEText(content['body'], 'html'))
-            
-            # Add attachment with size check (enforced by config)
-            if os.path.exists(attachment['path']):
-                file_size = os.path.getsize(attachment['path'])
-                
-                # Skip attachment if it exceeds configured limit
-                # Note: Base64 encoding adds ~33% overhead to the size
-                if file_size > self.config.MAX_ATTACHMENT_SIZE_BYTES:
-                    logger.warning(
-                        f"Skipping attachment {attachment['path']}: "
-                        f"size {file_size//(1024*1024)}MB exceeds {self.config.MAX_ATTACHMENT_SIZE_MB}MB limit"
-                    )
-                else:
-                    with open(attachment['path'], "rb") as attachment_file:
-                        part = MIMEBase('application', 'octet-stream')
-                        part.set_payload(attachment_file.read())
-                    
-                    encoders.encode_base64(part)
-                    part.add_header(
-                        'Content-Disposition',
-                        f'attachment; filename= {os.path.basename(attachment["path"])}'
-                    )
-                    msg.attach(part)
-            
-            server.send_message(msg)
-            server.quit()
+            message_size = len(content['body'])
+            if self.config.ATTACHMENT_MODE == "stream":
+                message_size = self._send_streamed_attachment(server, content, recipients)
+            elif (self.config.ATTACHMENT_MODE == "cached"
+                    and os.path.exists(attachment['path'])
+                    and os.path.getsize(attachment['path']) <= self.config.MAX_ATTACHMENT_SIZE_BYTES):
+                message_size = self._send_cached_attachment(server, content, recipients, attachment)
+            else:
+                self._send_mime_attachment(server, content, recipients, attachment)
             
             response_time = (time.time() - start_time) * 1000
             self.environment.events.request.fire(
                 request_type="SMTP",
                 name="send_attachment",
                 response_time=response_time,
-                response_length=len(content['body']),
+                response_length=message_size,
                 exception=None
             )
+            self._report_fanout(recipients, response_time)
+            self._throttle_feedback("message")
+            self._release_smtp(server)
             
         except Exception as e:
             response_time = (time.time() - start_time) * 1000
+            self._throttle_feedback("message", e)
             
-            # Check if this is a rate limit error
-            if self._is_rate_limit_error(e):
-                logger.info(f"SMTP rate limit hit during send (expected): {e}")
+            # Check if the message was too large or rate limited
+            if self._is_size_limit_error(e):
+                # Oversized streamed messages exercise message_size_limit on purpose
+                self.environment.events.request.fire(
+                    request_type="SMTP",
+                    name="send_attachment_size_rejected",
+                    response_time=response_time,
+                    response_length=0,
+                    exception=None
+                )
+            elif self._is_rate_limit_error(e):
+                trace.info("smtp.rate_limited", op="send_attachment", error=str(e))
                 self.environment.events.request.fire(
                     request_type="SMTP",
                     name="send_attachment_rate_limited",
@@ -304,37 +592,37 @@ class SMTPLoadTester(User):
                     exception=e
                 )
             
-            if server:
-                try:
-                    server.quit()
-                except:
-                    pass
+            self._discard_smtp(server)
     
     @task(2)
     def send_bulk_emails(self):
         """Send multiple emails in one session"""
-        server = self._connect_smtp()
+        # Send 5-10 emails in one session
+        num_emails = self.rng.randint(5, 10)
+        self._throttle_wait("message", num_emails)
+        server = self._acquire_smtp()
         if not server:
             return
         
         start_time = time.time()
         
         try:
-            # Send 5-10 emails in one session
-            num_emails = random.randint(5, 10)
-            
             for i in range(num_emails):
-                content = self.data_generator.generate_email_content()
-                recipient = self.user_manager.get_random_user()['email']
+                recipients = self.recipients.pick_message()
+                message_started = time.time()
                 
-                msg = MIMEText(content['body'], 'plain' if content['type'] == 'plain_text' else 'html')
-                msg['Subject'] = f"Bulk Test {i+1}: {content['subject']}"
-                msg['From'] = self.user_account['email']
-                msg['To'] = recipient
-                
-                server.send_message(msg)
-            
-            server.quit()
+                if self.config.MESSAGE_CORPUS_ENABLED:
+                    self._send_from_corpus(server, "random", recipients)
+                else:
+                    content = self.data_generator.generate_email_content()
+                    
+                    msg = MIMEText(content['body'], 'plain' if content['type'] == 'plain_text' else 'html')
+                    msg['Subject'] = f"Bulk Test {i+1}: {content['subject']}"
+                    msg['From'] = self.user_account.email
+                    self._address(msg, recipients)
+                    
+                    server.send_message(msg, to_addrs=recipients.envelope)
+                self._report_fanout(recipients, (time.time() - message_started) * 1000)
             
             response_time = (time.time() - start_time) * 1000
             self.environment.events.request.fire(
@@ -344,13 +632,16 @@ class SMTPLoadTester(User):
                 response_length=num_emails,
                 exception=None
             )
+            self._throttle_feedback("message")
+            self._release_smtp(server, messages=num_emails)
             
         except Exception as e:
             response_time = (time.time() - start_time) * 1000
+            self._throttle_feedback("message", e)
             
             # Check if this is a rate limit error
             if self._is_rate_limit_error(e):
-                logger.info(f"SMTP rate limit hit during bulk send (expected): {e}")
+                trace.info("smtp.rate_limited", op="send_bulk", error=str(e))
                 self.environment.events.request.fire(
                     request_type="SMTP",
                     name="send_bulk_rate_limited",
@@ -367,8 +658,186 @@ class SMTPLoadTester(User):
                     exception=e
                 )
             
+            self._discard_smtp(server)
+
+
+
+class ContentMixLoadTester(SMTPUserBase):
+    """Messages that exercise rspamd and ClamAV, reported per content class"""
+    wait_time = between(1, 5)
+    weight = 1
+    
+    def on_start(self):
+        super().on_start()
+        self.content_mix = get_content_mix()
+    
+    @task
+    def send_content_mix(self):
+        """Send one message of a CONTENT_MIX class"""
+        content_class = self.content_mix.pick_class(self.rng)
+        self._throttle_wait("message")
+        server = self._acquire_smtp()
+        if not server:
+            return
+        
+        start_time = time.time()
+        name = f"content.{content_class}"
+        try:
+            msg, message_size = self.content_mix.build(content_class, self.rng)
+            recipients = self.recipients.pick_message()
+            msg['From'] = self.user_account.email
+            self._address(msg, recipients)
+            server.send_message(msg, to_addrs=recipients.envelope)
+            
+            self.environment.events.request.fire(
+                request_type="SMTP",
+                name=name,
+                response_time=(time.time() - start_time) * 1000,
+                response_length=message_size,
+                exception=None
+            )
+            self._throttle_feedback("message")
+            self._release_smtp(server)
+            
+        except Exception as e:
+            response_time = (time.time() - start_time) * 1000
+            self._throttle_feedback("message", e)
+            codes = smtp_codes(e)
+            # Verdicts are expected outcomes (rspamd reject, virus found, greylisting)
+            if codes and all(code >= 500 for code in codes):
+                name, exception = f"{name}.rejected", None
+            elif codes and all(400 <= code < 500 for code in codes):
+                name, exception = f"{name}.deferred", None
+            else:
+                exception = e
+            trace.info("smtp.content_verdict", content=content_class, codes=codes, error=str(e))
+            self.environment.events.request.fire(
+                request_type="SMTP",
+                name=name,
+                response_time=response_time,
+                response_length=0,
+                exception=exception
+            )
+            self._discard_smtp(server)
+
+
+class MXRelayLoadTester(SMTPUserBase):
+    """External MTAs delivering inbound mail to the MX (port 25)"""
+    wait_time = between(1, 5)
+    weight = 3
+    
+    def on_start(self):
+        super().on_start()
+        self.identities = get_mx_identities()
+    
+    def _fire_mx(self, name, started, response_length=0, exception=None):
+        """Report an MX row timed from started (a time.time() value)"""
+        self.environment.events.request.fire(
+            request_type="MX",
+            name=name,
+            response_time=(time.time() - started) * 1000,
+            response_length=response_length,
+            exception=exception
+        )
+    
+    def _connect_mx(self, identity):
+        """Open an unauthenticated ESMTP session as identity, with STARTTLS if offered"""
+        start_time = time.time()
+        server = None
+        timer = PhaseTimer()
+        
+        try:
+            server = TimedSMTP(timer=timer, timeout=self.config.CONNECT_TIMEOUT, read_timeout=self.config.READ_TIMEOUT,
+                               local_hostname=identity.hostname, source_address=identity.source_address)
+            code, message = server.connect(self.config.MX_SERVER, self.config.MX_PORT)
+            if code != 220:
+                raise smtplib.SMTPConnectError(code, message)
+            server.ehlo()
+            if self.config.MX_STARTTLS and server.has_extn('starttls'):
+                server.starttls(context=get_client_context())
+            
+            self._fire_mx("connect", start_time)
+            fire_phases(self.environment, "MX", timer)
+            return server
+            
+        except Exception as e:
+            # 421 at the greeting: smtpd_client_connection_rate_limit for this source address
+            rate_limited = self._is_rate_limit_error(e)
+            if rate_limited:
+                trace.info("mx.rate_limited", op="connect", identity=identity.hostname, error=str(e))
+            self._fire_mx("connect_rate_limited" if rate_limited else "connect", start_time,
+                          exception=None if rate_limited else e)
+            fire_phases(self.environment, "MX", timer, None if rate_limited else e)
             if server:
                 try:
-                    server.quit()
-                except:
-                    pass
\ No newline at end of file
+                    server.close()
+                except Exception:
+                    pass
+            return None
+    
+    def _mx_message(self, identity):
+        """A new message from identity, serialized (and signed) as it goes on the wire"""
+        content = self.data_generator.generate_email_content()
+        recipients = self.recipients.pick_message()
+        sender = identity.sender(self.rng)
+        
+        msg = MIMEText(content['body'], 'plain' if content['type'] == 'plain_text' else 'html')
+        msg['Subject'] = content['subject']
+        msg['From'] = sender
+        self._address(msg, recipients)
+        msg['Date'] = formatdate(localtime=True)
+        msg['Message-ID'] = make_msgid(domain=identity.domain)
+        data = self.identities.sign(identity, msg.as_bytes(policy=SMTP))
+        return OutboundMessage(sender, recipients.envelope, data, identity.signed, None)
+    
+    @task
+    def relay_session(self):
+        """Deliver one session's worth of messages (greylisted ones that are due first)"""
+        identity = self.identities.pick(self.rng)
+        count = self.identities.session_size(self.rng)
+        start_time = time.time()
+        server = self._connect_mx(identity)
+        if not server:
+            return
+
+        delivered = 0
+        error = None
+        name = "deliver_dkim" if identity.signed else "deliver_unsigned"
+        try:
+            for _ in range(count):
+                message_started = time.time()
+                try:
+                    message = self.identities.next_retry(identity) or self._mx_message(identity)
+                    send_pipelined(server, message.sender, message.recipients, message.data,
+                                   len(message.data) if self.config.SMTP_DECLARE_SIZE else None)
+                    self._fire_mx(name, message_started, len(message.data))
+                    if message.first_attempt is not None:
+                        self._fire_mx("greylist.delay", message.first_attempt, len(message.data))
+                    delivered += 1
+                except Exception as e:
+                    codes = smtp_codes(e)
+                    if codes and all(400 <= code < 500 for code in codes):
+                        # Temporary failures are part of the MX's job, not errors
+                        if is_greylisting(e):
+                            self.identities.retry_later(identity, message)
+                            outcome = f"{name}.greylisted"
+                        elif self._is_rate_limit_error(e):
+                            outcome = f"{name}_rate_limited"
+                        else:
+                            outcome = f"{name}.deferred"
+                        trace.info("mx.deferred", identity=identity.hostname, outcome=outcome, error=str(e))
+                        self._fire_mx(outcome, message_started)
+                    else:
+                        self._fire_mx(name, message_started, exception=e)
+                    if not codes:
+                        error = e  # message generation failed, timeout or disconnect
+                        break
+                    if server.sock is None:
+                        break  # closed after a 421
+        finally:
+            fire_phases(self.environment, "MX", server.timer, error)
+            self._fire_mx("session", start_time, delivered)
+            try:
+                server.quit()
+            except Exception:
+                server.close()
@@ -0,0 +1,1257 @@
+# standin_server.py - Local SMTP/IMAP stand-in target
+#
+# A full Silver deployment (Postfix, Raven, rspamd, Thunder) makes it impossible to
+# tell whether a throughput ceiling comes from the server or from the Locust client.
+# This module is a deliberately cheap stand-in that speaks just enough of both
+# protocols for every user class in this suite:
+#
+#   SMTP  - ESMTP submission with STARTTLS, AUTH PLAIN/LOGIN, PIPELINING, SIZE,
+#           8BITMIME and CHUNKING (BDAT); any credentials are accepted
+#   MX    - the same without AUTH on --mx-port, for MXRelayLoadTester; with
+#           --greylist N the first attempt of every (client address, sender,
+#           recipients) triplet gets "451 4.7.1 Try again later" at the end of
+#           DATA, like rspamd's greylisting, until N seconds have passed
+#   IMAP  - IMAP4rev1 on an implicit-TLS port and a STARTTLS port with LOGIN,
+#           SELECT/EXAMINE, STATUS, LIST, SEARCH, (UID) FETCH/STORE, APPEND
+#           (LITERAL+, MULTIAPPEND), IDLE, ENABLE and CONDSTORE
+#
+# Messages accepted over SMTP are delivered to an in-memory store keyed by the
+# local part of the recipient, which is also the IMAP login name, so the E2E
+# tracker and IDLE users see deliveries immediately. Each mailbox keeps at most
+# --max-messages messages (oldest dropped) so long benchmark runs stay bounded.
+# Like Postfix's message_size_limit, --message-size-limit is advertised with SIZE,
+# enforced on MAIL FROM SIZE= and, after reading the whole message, on DATA/BDAT.
+# --connection-rate-limit and --message-rate-limit mimic Postfix's anvil limits
+# (smtpd_client_connection_rate_limit, smtpd_client_message_rate_limit): per client
+# address and minute, answered with 421 4.7.0 and 450 4.7.1 respectively.
+# --reject-test-signatures answers DATA/BDAT with 554 5.7.1 for messages carrying
+# the GTUBE string or a bare EICAR attachment, like rspamd and ClamAV would (no
+# MIME decoding or archive unpacking), to exercise content_mix.py offline.
+#
+# A self-signed certificate is created with the openssl CLI on first start. Point
+# the suite at the stand-in with LOADTEST_TARGET=standin (see config.py), or run
+# benchmarks/bench_harness.py, which starts it for you.
+#
+# Usage (from test/load):
+#     python standin_server.py
+#     python standin_server.py --processes 4 --max-messages 200
+#
+import os
+import re
+import ssl
+import sys
+import time
+import base64
+import signal
+import asyncio
+import fnmatch
+import logging
+import argparse
+import itertools
+import collections
+import subprocess
+from email import message_from_bytes
+from email.parser import BytesHeaderParser
+from email.utils import getaddresses
+
+from config import STANDIN_HOST, STANDIN_SMTP_PORT, STANDIN_IMAPS_PORT, STANDIN_IMAP_PORT, STANDIN_MX_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FOLDERS = ("INBOX", "Sent", "Drafts", "Trash", "Junk")
+MAX_MESSAGE_SIZE = 50 * 1024 * 1024
+# asyncio stream buffer limit; DATA is read with readuntil() and must fit
+STREAM_LIMIT = MAX_MESSAGE_SIZE + 1024 * 1024
+# GTUBE, and EICAR as it appears base64-encoded at the start of an attachment part
+# (split so that scanners do not flag this file)
+_TEST_SIGNATURES = (
+    (b"XJS*C4JDBQADN1.NSBN3*2IDNEN*" + b"GTUBE-STANDARD-ANTI-UBE-TEST-EMAIL*C.34X", "Spam message rejected"),
+    (base64.b64encode(b"X5O!P%@AP[4\\PZX54(P^)7CC)7}$" + b"EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*")[:60],
+     "Virus found: Eicar-Signature"),
+)
+
+
+def ensure_certificate(cert_dir):
+    """Return (certfile, keyfile), creating a self-signed pair with openssl if needed"""
+    certfile = os.path.join(cert_dir, "standin.crt")
+    keyfile = os.path.join(cert_dir, "standin.key")
+    if os.path.exists(certfile) and os.path.exists(keyfile):
+        return certfile, keyfile
+    os.makedirs(cert_dir, exist_ok=True)
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "365",
+         "-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return certfile, keyfile
+
+
+def create_tls_context(cert_dir):
+    """Server-side TLS context, or None when no certificate can be created"""
+    try:
+        certfile, keyfile = ensure_certificate(cert_dir)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"No TLS certificate ({e}); STARTTLS and implicit TLS disabled")
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+class StoredMessage:
+    """One message in a mailbox"""
+
+    __slots__ = ("uid", "data", "flags", "internaldate", "modseq", "_headers", "_parsed")
+
+    def __init__(self, uid, data, flags, internaldate, modseq):
+        self.uid = uid
+        self.data = data
+        self.flags = set(flags)
+        self.internaldate = internaldate
+        self.modseq = modseq
+        self._headers = None
+        self._parsed = None
+
+    @property
+    def header_bytes(self):
+        end = self.data.find(b"\r\n\r\n")
+        return self.data if end < 0 else self.data[:end + 4]
+
+    @property
+    def text_bytes(self):
+        end = self.data.find(b"\r\n\r\n")
+        return b"" if end < 0 else self.data[end + 4:]
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = BytesHeaderParser().parsebytes(self.header_bytes)
+        return self._headers
+
+    @property
+    def parsed(self):
+        if self._parsed is None:
+            self._parsed = message_from_bytes(self.data)
+        return self._parsed
+
+
+class Mailbox:
+    """A folder: messages in UID order plus the counters IMAP clients sync against"""
+
+    def __init__(self, name, uidvalidity):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.highest_modseq = 1
+        self.messages = []
+        self.waiters = set()  # asyncio.Events of sessions in IDLE
+
+    def append(self, data, flags=(), internaldate=None):
+        self.highest_modseq += 1
+        message = StoredMessage(self.uidnext, data, flags, internaldate or time.time(), self.highest_modseq)
+        self.uidnext += 1
+        self.messages.append(message)
+        self.notify()
+        return message.uid
+
+    def touch(self, message):
+        """Give a message a new mod-sequence after a flag change"""
+        self.highest_modseq += 1
+        message.modseq = self.highest_modseq
+
+    def expunge(self, predicate):
+        """Remove matching messages; returns their sequence numbers, highest first"""
+        removed = [seq for seq, message in enumerate(self.messages, 1) if predicate(message)]
+        for seq in reversed(removed):
+            del self.messages[seq - 1]
+        if removed:
+            self.highest_modseq += 1
+            self.notify()
+        return list(reversed(removed))
+
+    def notify(self):
+        for waiter in self.waiters:
+            waiter.set()
+
+
+class MailStore:
+    """In-memory mailboxes for every user, created on first use"""
+
+    def __init__(self, max_messages=1000):
+        self.max_messages = max_messages
+        self._users = {}
+        self._uidvalidity = itertools.count(int(time.time()))
+        self.stats = {"smtp_sessions": 0, "imap_sessions": 0, "delivered": 0, "bytes": 0, "greylisted": 0}
+
+    @staticmethod
+    def user_key(name):
+        """Mailbox owner for a login name or an email address"""
+        return name.split("@", 1)[0].strip().lower()
+
+    def folders(self, user):
+        folders = self._users.get(user)
+        if folders is None:
+            folders = {name: Mailbox(name, next(self._uidvalidity)) for name in DEFAULT_FOLDERS}
+            self._users[user] = folders
+        return folders
+
+    def mailbox(self, user, name):
+        folders = self.folders(user)
+        return folders.get("INBOX" if name.upper() == "INBOX" else name)
+
+    def create(self, user, name):
+        folders = self.folders(user)
+        if name in folders or name.upper() == "INBOX":
+            return False
+        folders[name] = Mailbox(name, next(self._uidvalidity))
+        return True
+
+    def deliver(self, recipients, data):
+        """Deliver a message to the INBOX of every recipient"""
+        for recipient in recipients:
+            inbox = self.folders(self.user_key(recipient))["INBOX"]
+            inbox.append(data)
+            if len(inbox.messages) > self.max_messages:
+                del inbox.messages[:len(inbox.messages) - self.max_messages]
+        self.stats["delivered"] += len(recipients)
+        self.stats["bytes"] += len(data)
+
+
+_ADDRESS = re.compile(r'^(?:FROM|TO):\s*<([^>]*)>(.*)$', re.IGNORECASE)
+_SIZE_PARAMETER = re.compile(r'\bSIZE=(\d+)', re.IGNORECASE)
+
+
+def declared_size(parameters):
+    """Message size from a MAIL FROM SIZE= parameter (RFC 1870), or 0"""
+    match = _SIZE_PARAMETER.search(parameters)
+    return int(match.group(1)) if match else 0
+
+
+class RateLimiter:
+    """Attempts per client over a sliding minute, like Postfix's anvil (0 disables).
+
+    Rejected attempts count too, so a client that keeps retrying stays locked out.
+    """
+
+    def __init__(self, limit, window=60.0):
+        self.limit = limit
+        self.window = window
+        self._events = collections.defaultdict(collections.deque)
+
+    def allow(self, client):
+        """Count one attempt by client; False once the limit is exceeded"""
+        if not self.limit:
+            return True
+        now = time.monotonic()
+        events = self._events[client]
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        events.append(now)
+        return len(events) <= self.limit
+
+
+class Greylist:
+    """Defers new (client, sender, recipients) triplets for delay seconds (0 disables)"""
+
+    def __init__(self, delay, expire=86400.0):
+        self.delay = delay
+        self.expire = expire
+        self._first_seen = collections.OrderedDict()
+
+    def allow(self, client, sender, recipients):
+        """False while the triplet is younger than the delay"""
+        if not self.delay:
+            return True
+        now = time.monotonic()
+        while self._first_seen and next(iter(self._first_seen.values())) <= now - self.expire:
+            self._first_seen.popitem(last=False)
+        key = (client, sender.lower(), tuple(sorted(recipient.lower() for recipient in recipients)))
+        return now - self._first_seen.setdefault(key, now) >= self.delay
+
+
+class SMTPConnection:
+    """One ESMTP session; handlers are the smtp_<verb> methods"""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.tls = writer.get_extra_info("sslcontext") is not None
+        self.client = (writer.get_extra_info("peername") or ("unknown",))[0]
+        self.user = None
+        self.queue_ids = itertools.count(1)
+        self._reset()
+
+    def _reset(self):
+        self.mail_from = None
+        self.rcpt_to = []
+        self.chunks = []
+        self.chunk_bytes = 0
+
+    def reply(self, text):
+        self.writer.write(text.encode() + b"\r\n")
+
+    async def run(self):
+        if not self.server.connection_rate.allow(self.client):
+            self.reply(f"421 4.7.0 {self.server.hostname} Error: too many connections from {self.client}")
+            return
+        self.reply(f"220 {self.server.hostname} ESMTP stand-in ready")
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            verb, _, arg = line.decode("utf-8", "replace").strip().partition(" ")
+            handler = getattr(self, f"smtp_{verb.lower()}", None)
+            if handler is None:
+                self.reply("502 5.5.2 Command not recognized")
+            elif await handler(arg.strip()) is False:
+                await self.writer.drain()
+                return
+            await self.writer.drain()
+
+    async def smtp_helo(self, arg):
+        self._reset()
+        self.reply(f"250 {self.server.hostname}")
+
+    async def smtp_ehlo(self, arg):
+        self._reset()
+        lines = [self.server.hostname, "PIPELINING", f"SIZE {self.server.size_limit}", "8BITMIME", "CHUNKING"]
+        if self.server.tls_context is not None and not self.tls:
+            lines.append("STARTTLS")
+        if self.server.offer_auth:
+            lines.append("AUTH PLAIN LOGIN")
+        for line in lines[:-1]:
+            self.reply(f"250-{line}")
+        self.reply(f"250 {lines[-1]}")
+
+    async def smtp_starttls(self, arg):
+        if self.server.tls_context is None or self.tls:
+            self.reply("454 4.7.0 TLS not available")
+            return
+        self.reply("220 2.0.0 Ready to start TLS")
+        await self.writer.drain()
+        await self.writer.start_tls(self.server.tls_context)
+        self.tls = True
+        self.user = None
+        self._reset()
+
+    async def _read_auth_line(self, challenge):
+        self.reply(f"334 {challenge}")
+        await self.writer.drain()
+        line = (await self.reader.readline()).strip()
+        return base64.b64decode(line) if line != b"*" else None
+
+    async def smtp_auth(self, arg):
+        if not self.server.offer_auth:
+            self.reply("503 5.5.1 Error: authentication not enabled")
+            return
+        if self.user is not None:
+            self.reply("503 5.5.1 Already authenticated")
+            return
+        mechanism, _, initial = arg.partition(" ")
+        try:
+            if mechanism.upper() == "PLAIN":
+                response = base64.b64decode(initial) if initial else await self._read_auth_line("")
+                if response is None:
+                    self.reply("501 5.7.0 Authentication cancelled")
+                    return
+                user = response.split(b"\0")[1].decode()
+            elif mechanism.upper() == "LOGIN":
+                user = base64.b64decode(initial) if initial else await self._read_auth_line("VXNlcm5hbWU6")
+                password = await self._read_auth_line("UGFzc3dvcmQ6") if user is not None else None
+                if user is None or password is None:
+                    self.reply("501 5.7.0 Authentication cancelled")
+                    return
+                user = user.decode()
+            else:
+                self.reply("504 5.5.4 Unrecognized authentication type")
+                return
+        except (ValueError, IndexError):
+            self.reply("501 5.5.2 Cannot decode response")
+            return
+        self.user = user
+        self.reply("235 2.7.0 Authentication successful")
+
+    async def smtp_mail(self, arg):
+        match = _ADDRESS.match(arg)
+        if self.server.require_auth and self.user is None:
+            self.reply("530 5.7.0 Authentication required")
+        elif self.mail_from is not None:
+            self.reply("503 5.5.1 Nested MAIL command")
+        elif not match or not arg.upper().startswith("FROM"):
+            self.reply("501 5.5.4 Syntax: MAIL FROM:<address>")
+        elif self._too_big(declared_size(match.group(2))):
+            self.reply("552 5.3.4 Message size exceeds fixed limit")
+        elif not self.server.message_rate.allow(self.client):
+            self.reply(f"450 4.7.1 Error: too much mail from {self.client}")
+        else:
+            self.mail_from = match.group(1)
+            self.reply("250 2.1.0 Ok")
+
+    async def smtp_rcpt(self, arg):
+        match = _ADDRESS.match(arg)
+        if self.mail_from is None:
+            self.reply("503 5.5.1 Need MAIL command")
+        elif not match or not arg.upper().startswith("TO") or not match.group(1):
+            self.reply("501 5.5.4 Syntax: RCPT TO:<address>")
+        else:
+            self.rcpt_to.append(match.group(1))
+            self.reply("250 2.1.5 Ok")
+
+    async def _read_data(self):
+        """Read a dot-terminated DATA body and undo dot-stuffing"""
+        parts = []
+        while True:
+            part = await self.reader.readuntil(b".\r\n")
+            parts.append(part)
+            # The terminator is ".\r\n" at the start of a line; the body always
+            # starts at a line boundary
+            if part.endswith(b"\r\n.\r\n") or (part == b".\r\n" and (len(parts) == 1 or parts[-2].endswith(b"\r\n"))):
+                break
+        data = b"".join(parts)[:-3]
+        if data.startswith(b".."):
+            data = data[1:]
+        return data.replace(b"\r\n..", b"\r\n.")
+
+    def _too_big(self, size):
+        return size > self.server.size_limit
+
+    def _deliver(self, data):
+        if self._too_big(len(data)):
+            self.reply("552 5.3.4 Message size exceeds fixed limit")
+            self._reset()
+            return
+        if self.server.reject_test_signatures:
+            for signature, verdict in _TEST_SIGNATURES:
+                if signature in data:
+                    self.reply(f"554 5.7.1 {verdict}")
+                    self._reset()
+                    return
+        if not self.server.greylist.allow(self.client, self.mail_from, self.rcpt_to):
+            self.server.store.stats["greylisted"] += 1
+            self.reply("451 4.7.1 Try again later")
+            self._reset()
+            return
+        self.server.store.deliver(self.rcpt_to, data)
+        self.reply(f"250 2.0.0 Ok: queued as {id(self):x}.{next(self.queue_ids)}")
+        self._reset()
+
+    async def smtp_data(self, arg):
+        if not self.rcpt_to:
+            self.reply("503 5.5.1 Need RCPT command")
+            return
+        self.reply("354 End data with <CR><LF>.<CR><LF>")
+        await self.writer.drain()
+        try:
+            data = await self._read_data()
+        except asyncio.LimitOverrunError:
+            self.reply("552 5.3.4 Message too big")
+            return False
+        self._deliver(data)
+
+    async def smtp_bdat(self, arg):
+        size, _, last = arg.partition(" ")
+        if not size.isdigit():
+            self.reply("501 5.5.4 Syntax: BDAT <size> [LAST]")
+            return
+        chunk = await self.reader.readexactly(int(size))
+        if not self.rcpt_to:
+            self.reply("503 5.5.1 Need RCPT command")
+            self.chunks = []
+            return
+        # Past the limit the rest is read and discarded, like Postfix does
+        self.chunk_bytes += len(chunk)
+        self.chunks.append(chunk if not self._too_big(self.chunk_bytes) else b"")
+        if last.strip().upper() == "LAST":
+            if self._too_big(self.chunk_bytes):
+                self.reply("552 5.3.4 Message size exceeds fixed limit")
+                self._reset()
+                return
+            self._deliver(b"".join(self.chunks))
+        else:
+            self.reply(f"250 2.0.0 {len(chunk)} octets received")
+
+    async def smtp_rset(self, arg):
+        self._reset()
+        self.reply("250 2.0.0 Ok")
+
+    async def smtp_noop(self, arg):
+        self.reply("250 2.0.0 Ok")
+
+    async def smtp_vrfy(self, arg):
+        self.reply("252 2.0.0 Cannot VRFY user")
+
+    async def smtp_quit(self, arg):
+        self.reply("221 2.0.0 Bye")
+        return False
+
+
+class SMTPServer:
+    """Accepts SMTP connections and delivers to a MailStore"""
+
+    def __init__(self, store, tls_context=None, require_auth=True, hostname="standin.localhost",
+                 size_limit=MAX_MESSAGE_SIZE, connection_rate_limit=0, message_rate_limit=0,
+                 reject_test_signatures=False, offer_auth=True, greylist=0):
+        self.store = store
+        self.tls_context = tls_context
+        self.require_auth = require_auth
+        self.offer_auth = offer_auth
+        self.hostname = hostname
+        self.size_limit = size_limit
+        self.connection_rate = RateLimiter(connection_rate_limit)
+        self.message_rate = RateLimiter(message_rate_limit)
+        self.reject_test_signatures = reject_test_signatures
+        self.greylist = Greylist(greylist)
+
+    async def handle(self, reader, writer):
+        self.store.stats["smtp_sessions"] += 1
+        try:
+            await SMTPConnection(self, reader, writer).run()
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+
+_LITERAL = re.compile(rb'\{(\d+)(\+?)\}\r?\n$')
+_BODY_SECTION = re.compile(r'^BODY(\.PEEK)?\[([^\]]*)\](?:<(\d+)(?:\.(\d+))?>)?$', re.IGNORECASE)
+_FETCH_MACROS = {
+    "ALL": ["FLAGS", "INTERNALDATE", "RFC822.SIZE", "ENVELOPE"],
+    "FAST": ["FLAGS", "INTERNALDATE", "RFC822.SIZE"],
+    "FULL": ["FLAGS", "INTERNALDATE", "RFC822.SIZE", "ENVELOPE", "BODY"],
+}
+
+
+class IMAPError(Exception):
+    """A command failed; status is NO or BAD"""
+
+    def __init__(self, status, text):
+        super().__init__(text)
+        self.status = status
+        self.text = text
+
+
+def tokenize(segments):
+    """Parse a command into atoms/strings (str), literals (bytes) and lists.
+
+    segments alternates command text and literal payloads. Atoms keep bracketed
+    sections intact, so BODY.PEEK[HEADER.FIELDS (FROM TO)]<0.100> is one token.
+    """
+    stack = [[]]
+    for segment in segments:
+        if isinstance(segment, bytes):
+            stack[-1].append(segment)
+            continue
+        i, end = 0, len(segment)
+        while i < end:
+            char = segment[i]
+            if char in " \r\n":
+                i += 1
+            elif char == "(":
+                stack.append([])
+                i += 1
+            elif char == ")":
+                if len(stack) == 1:
+                    raise IMAPError("BAD", "Unbalanced parentheses")
+                closed = stack.pop()
+                stack[-1].append(closed)
+                i += 1
+            elif char == '"':
+                value, i = [], i + 1
+                while i < end and segment[i] != '"':
+                    if segment[i] == "\\" and i + 1 < end:
+                        i += 1
+                    value.append(segment[i])
+                    i += 1
+                stack[-1].append("".join(value))
+                i += 1
+            else:
+                start, depth = i, 0
+                while i < end and (depth or segment[i] not in ' ()"\r\n'):
+                    if segment[i] == "[":
+                        depth += 1
+                    elif segment[i] == "]":
+                        depth -= 1
+                    i += 1
+                stack[-1].append(segment[start:i])
+    if len(stack) != 1:
+        raise IMAPError("BAD", "Unbalanced parentheses")
+    return stack[0]
+
+
+def parse_set(spec, largest):
+    """Parse a sequence or UID set into inclusive (low, high) ranges"""
+    ranges = []
+    try:
+        for item in spec.split(","):
+            low, _, high = item.partition(":")
+            low = largest if low == "*" else int(low)
+            high = low if not high else (largest if high == "*" else int(high))
+            ranges.append((min(low, high), max(low, high)))
+    except ValueError:
+        raise IMAPError("BAD", f"Invalid sequence set {spec}")
+    return ranges
+
+
+def quote(value):
+    """IMAP quoted string (NIL for None), with non-ASCII replaced"""
+    if value is None:
+        return "NIL"
+    value = str(value).replace("\r", " ").replace("\n", " ")
+    value = value.encode("ascii", "replace").decode()
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _address_list(header_value):
+    if not header_value:
+        return "NIL"
+    addresses = []
+    for name, address in getaddresses([str(header_value)]):
+        mailbox, _, host = address.partition("@")
+        addresses.append(f"({quote(name or None)} NIL {quote(mailbox)} {quote(host or None)})")
+    return "(" + "".join(addresses) + ")" if addresses else "NIL"
+
+
+def envelope(message):
+    headers = message.headers
+    sender = headers.get("Sender") or headers.get("From")
+    reply_to = headers.get("Reply-To") or headers.get("From")
+    return "({} {} {} {} {} {} {} {} {} {})".format(
+        quote(headers.get("Date")), quote(headers.get("Subject")),
+        _address_list(headers.get("From")), _address_list(sender), _address_list(reply_to),
+        _address_list(headers.get("To")), _address_list(headers.get("Cc")), _address_list(headers.get("Bcc")),
+        quote(headers.get("In-Reply-To")), quote(headers.get("Message-ID")),
+    )
+
+
+def bodystructure(part):
+    """Simplified BODYSTRUCTURE of a parsed message or MIME part"""
+    if part.is_multipart():
+        children = "".join(bodystructure(child) for child in part.get_payload())
+        return f"({children} {quote(part.get_content_subtype().upper())})"
+    params = part.get_params()[1:] if part.get_params() else []
+    params = "(" + " ".join(f"{quote(k.upper())} {quote(v)}" for k, v in params) + ")" if params else "NIL"
+    payload = part.get_payload()
+    payload = payload if isinstance(payload, str) else ""
+    structure = "({} {} {} NIL NIL {} {}".format(
+        quote(part.get_content_maintype().upper()), quote(part.get_content_subtype().upper()), params,
+        quote(part.get("Content-Transfer-Encoding", "7BIT").upper()), len(payload.encode("utf-8", "replace")),
+    )
+    if part.get_content_maintype() == "text":
+        structure += f" {payload.count(chr(10))}"
+    return structure + ")"
+
+
+def _header_fields(message, fields, exclude):
+    """Raw header lines for HEADER.FIELDS / HEADER.FIELDS.NOT"""
+    wanted = {field.upper() for field in fields}
+    lines, keep = [], False
+    for line in message.header_bytes.split(b"\r\n"):
+        if not line:
+            continue
+        if line[:1] not in (b" ", b"\t"):
+            name = line.split(b":", 1)[0].decode("ascii", "replace").strip().upper()
+            keep = (name in wanted) != exclude
+        if keep:
+            lines.append(line)
+    return b"\r\n".join(lines) + b"\r\n\r\n" if lines else b"\r\n"
+
+
+class IMAPConnection:
+    """One IMAP session; handlers are the cmd_<COMMAND> methods.
+
+    A handler returns the text of the tagged OK (None for the default), True when
+    it already sent the tagged response, or False to end the session.
+    """
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.tls = writer.get_extra_info("sslcontext") is not None
+        self.tag = None
+        self.user = None
+        self.mailbox = None
+        self.readonly = False
+        self.condstore = False
+        self.known_exists = 0
+
+    def capabilities(self):
+        caps = ["IMAP4rev1", "LITERAL+", "SASL-IR", "IDLE", "UIDPLUS", "MULTIAPPEND", "ENABLE",
+                "CONDSTORE", "NAMESPACE", "ID", "UNSELECT"]
+        if self.server.tls_context is not None and not self.tls:
+            caps.append("STARTTLS")
+        caps.append("AUTH=PLAIN")
+        return " ".join(caps)
+
+    def send(self, data):
+        self.writer.write(data if isinstance(data, bytes) else data.encode() + b"\r\n")
+
+    async def read_command(self):
+        """Read one command line including any literals; returns segments or None at EOF"""
+        segments = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return None
+            match = _LITERAL.search(line)
+            if not match:
+                segments.append(line.decode("utf-8", "replace"))
+                return segments
+            segments.append(line[:match.start()].decode("utf-8", "replace"))
+            if not match.group(2):
+                self.send("+ Ready for literal data")
+                await self.writer.drain()
+            segments.append(await self.reader.readexactly(int(match.group(1))))
+
+    async def run(self):
+        self.send(f"* OK [CAPABILITY {self.capabilities()}] stand-in IMAP4rev1 ready")
+        await self.writer.drain()
+        while True:
+            segments = await self.read_command()
+            if segments is None:
+                return
+            try:
+                tokens = tokenize(segments)
+                if len(tokens) < 2 or not isinstance(tokens[0], str) or not isinstance(tokens[1], str):
+                    raise IMAPError("BAD", "Missing command")
+            except IMAPError as e:
+                self.send(f"* BAD {e.text}")
+                await self.writer.drain()
+                continue
+            tag, command, args = tokens[0], tokens[1].upper(), tokens[2:]
+            self.tag = tag
+            if command == "UID" and args and isinstance(args[0], str):
+                command, args = f"UID_{args[0].upper()}", args[1:]
+            handler = getattr(self, f"cmd_{command}", None)
+            try:
+                if handler is None:
+                    raise IMAPError("BAD", f"Unknown command {command}")
+                result = await handler(args)
+                if result is False:
+                    self.send(f"{tag} OK LOGOUT completed")
+                    await self.writer.drain()
+                    return
+                if self.mailbox is not None:
+                    self._send_updates()
+                if result is not True:
+                    self.send(f"{tag} OK {result or command.replace('_', ' ') + ' completed'}")
+            except IMAPError as e:
+                self.send(f"{tag} {e.status} {e.text}")
+            await self.writer.drain()
+
+    def _require_auth(self):
+        if self.user is None:
+            raise IMAPError("NO", "Not authenticated")
+
+    def _require_selected(self):
+        if self.mailbox is None:
+            raise IMAPError("BAD", "No mailbox selected")
+
+    def _find_mailbox(self, name):
+        self._require_auth()
+        mailbox = self.server.store.mailbox(self.user, name if isinstance(name, str) else name.decode())
+        if mailbox is None:
+            raise IMAPError("NO", "[TRYCREATE] Mailbox does not exist")
+        return mailbox
+
+    def _send_updates(self):
+        """Tell the client about messages that arrived or vanished since it last looked"""
+        exists = len(self.mailbox.messages)
+        if exists != self.known_exists:
+            self.send(f"* {exists} EXISTS")
+            self.known_exists = exists
+
+    def _select_messages(self, spec, uid):
+        """[(sequence number, message)] for a sequence or UID set"""
+        messages = self.mailbox.messages
+        if not messages:
+            return []
+        if uid:
+            ranges = parse_set(spec, messages[-1].uid)
+            return [(seq, m) for seq, m in enumerate(messages, 1) if any(lo <= m.uid <= hi for lo, hi in ranges)]
+        selected = {}
+        for low, high in parse_set(spec, len(messages)):
+            for seq in range(max(low, 1), min(high, len(messages)) + 1):
+                selected[seq] = messages[seq - 1]
+        return sorted(selected.items())
+
+    async def cmd_CAPABILITY(self, args):
+        self.send(f"* CAPABILITY {self.capabilities()}")
+
+    async def cmd_NOOP(self, args):
+        pass
+
+    async def cmd_CHECK(self, args):
+        self._require_selected()
+
+    async def cmd_ID(self, args):
+        self.send('* ID ("name" "silver-standin")')
+
+    async def cmd_LOGOUT(self, args):
+        self.send("* BYE stand-in closing connection")
+        return False
+
+    async def cmd_STARTTLS(self, args):
+        if self.server.tls_context is None or self.tls:
+            raise IMAPError("BAD", "STARTTLS not available")
+        # The tagged OK must go out in clear text before the handshake
+        self.send(f"{self.tag} OK Begin TLS negotiation now")
+        await self.writer.drain()
+        await self.writer.start_tls(self.server.tls_context)
+        self.tls = True
+        return True
+
+    async def cmd_LOGIN(self, args):
+        if len(args) != 2:
+            raise IMAPError("BAD", "LOGIN expects user and password")
+        user = args[0] if isinstance(args[0], str) else args[0].decode()
+        self.user = self.server.store.user_key(user)
+        return f"[CAPABILITY {self.capabilities()}] LOGIN completed"
+
+    async def cmd_AUTHENTICATE(self, args):
+        if not args or str(args[0]).upper() != "PLAIN":
+            raise IMAPError("NO", "Unsupported authentication mechanism")
+        if len(args) > 1:
+            response = str(args[1])
+        else:
+            self.send("+ ")
+            await self.writer.drain()
+            response = (await self.reader.readline()).decode().strip()
+        try:
+            user = base64.b64decode(response).split(b"\0")[1].decode()
+        except (ValueError, IndexError):
+            raise IMAPError("BAD", "Invalid SASL response")
+        self.user = self.server.store.user_key(user)
+        return "AUTHENTICATE completed"
+
+    async def cmd_ENABLE(self, args):
+        self._require_auth()
+        enabled = [str(arg).upper() for arg in args if str(arg).upper() == "CONDSTORE"]
+        if enabled:
+            self.condstore = True
+        self.send("* ENABLED" + "".join(f" {cap}" for cap in enabled))
+
+    async def cmd_SELECT(self, args, readonly=False):
+        if not args:
+            raise IMAPError("BAD", "Missing mailbox")
+        self.mailbox = None
+        mailbox = self._find_mailbox(args[0])
+        if len(args) > 1 and isinstance(args[1], list) and any(str(p).upper() == "CONDSTORE" for p in args[1]):
+            self.condstore = True
+        self.mailbox, self.readonly = mailbox, readonly
+        self.known_exists = len(mailbox.messages)
+        unseen = next((seq for seq, m in enumerate(mailbox.messages, 1) if "\\Seen" not in m.flags), None)
+        self.send("* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)")
+        self.send("* OK [PERMANENTFLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft \\*)] Flags permitted")
+        self.send(f"* {self.known_exists} EXISTS")
+        self.send("* 0 RECENT")
+        if unseen:
+            self.send(f"* OK [UNSEEN {unseen}] First unseen")
+        self.send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid")
+        self.send(f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID")
+        self.send(f"* OK [HIGHESTMODSEQ {mailbox.highest_modseq}] Highest")
+        mode = "READ-ONLY" if readonly else "READ-WRITE"
+        return f"[{mode}] {'EXAMINE' if readonly else 'SELECT'} completed"
+
+    async def cmd_EXAMINE(self, args):
+        return await self.cmd_SELECT(args, readonly=True)
+
+    async def cmd_STATUS(self, args):
+        if len(args) != 2 or not isinstance(args[1], list):
+            raise IMAPError("BAD", "STATUS expects mailbox and item list")
+        mailbox = self._find_mailbox(args[0])
+        values = {
+            "MESSAGES": len(mailbox.messages),
+            "RECENT": 0,
+            "UIDNEXT": mailbox.uidnext,
+            "UIDVALIDITY": mailbox.uidvalidity,
+            "UNSEEN": sum(1 for m in mailbox.messages if "\\Seen" not in m.flags),
+            "HIGHESTMODSEQ": mailbox.highest_modseq,
+        }
+        items = " ".join(f"{item.upper()} {values[item.upper()]}" for item in args[1] if item.upper() in values)
+        self.send(f"* STATUS {quote(mailbox.name)} ({items})")
+
+    async def cmd_LIST(self, args):
+        self._require_auth()
+        if len(args) != 2:
+            raise IMAPError("BAD", "LIST expects reference and pattern")
+        pattern = str(args[0]) + str(args[1])
+        if not str(args[1]):
+            self.send('* LIST (\\Noselect) "/" ""')
+            return
+        glob = pattern.replace("*", "\0").replace("%", "[!/]*").replace("\0", "*")
+        for name in self.server.store.folders(self.user):
+            if fnmatch.fnmatchcase(name, glob) or fnmatch.fnmatchcase(name.upper(), glob.upper()):
+                self.send(f'* LIST (\\HasNoChildren) "/" {quote(name)}')
+
+    async def cmd_LSUB(self, args):
+        await self.cmd_LIST(args)
+
+    async def cmd_NAMESPACE(self, args):
+        self.send('* NAMESPACE (("" "/")) NIL NIL')
+
+    async def cmd_CREATE(self, args):
+        self._require_auth()
+        if not args or not self.server.store.create(self.user, str(args[0])):
+            raise IMAPError("NO", "Mailbox already exists")
+
+    async def cmd_SUBSCRIBE(self, args):
+        self._find_mailbox(args[0] if args else "")
+
+    async def cmd_APPEND(self, args):
+        if not args:
+            raise IMAPError("BAD", "Missing mailbox")
+        mailbox = self._find_mailbox(args[0])
+        uids, flags, rest = [], (), args[1:]
+        while rest:
+            item = rest.pop(0)
+            if isinstance(item, list):
+                flags = [str(flag) for flag in item]
+            elif isinstance(item, bytes):
+                uids.append(mailbox.append(item, flags))
+                self.server.store.stats["bytes"] += len(item)
+                flags = ()
+            # a quoted date-time is accepted and ignored
+        if not uids:
+            raise IMAPError("BAD", "APPEND without message literal")
+        uid_set = str(uids[0]) if len(uids) == 1 else f"{uids[0]}:{uids[-1]}"
+        return f"[APPENDUID {mailbox.uidvalidity} {uid_set}] APPEND completed"
+
+    async def cmd_IDLE(self, args):
+        self._require_auth()
+        self.send("+ idling")
+        await self.writer.drain()
+        event = asyncio.Event()
+        if self.mailbox is not None:
+            self.mailbox.waiters.add(event)
+        done = asyncio.ensure_future(self.reader.readline())
+        try:
+            while True:
+                if self.mailbox is not None:
+                    self._send_updates()
+                    await self.writer.drain()
+                waiter = asyncio.ensure_future(event.wait())
+                finished, _ = await asyncio.wait({done, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                if done in finished:
+                    waiter.cancel()
+                    break
+                event.clear()
+        finally:
+            if self.mailbox is not None:
+                self.mailbox.waiters.discard(event)
+        line = done.result()
+        if not line:
+            raise ConnectionError("client closed during IDLE")
+        if line.strip().upper() != b"DONE":
+            raise IMAPError("BAD", "Expected DONE")
+        return "IDLE terminated"
+
+    async def cmd_CLOSE(self, args):
+        self._require_selected()
+        if not self.readonly:
+            self.mailbox.expunge(lambda m: "\\Deleted" in m.flags)
+        self.mailbox = None
+
+    async def cmd_UNSELECT(self, args):
+        self._require_selected()
+        self.mailbox = None
+
+    async def cmd_EXPUNGE(self, args):
+        self._require_selected()
+        for seq in self.mailbox.expunge(lambda m: "\\Deleted" in m.flags):
+            self.send(f"* {seq} EXPUNGE")
+        self.known_exists = len(self.mailbox.messages)
+
+    async def _search(self, args, uid):
+        self._require_selected()
+        if len(args) >= 2 and str(args[0]).upper() == "CHARSET":
+            args = args[2:]
+        results = []
+        for seq, message in enumerate(self.mailbox.messages, 1):
+            if self._matches(args, seq, message):
+                results.append(message.uid if uid else seq)
+        self.send("* SEARCH" + "".join(f" {n}" for n in results))
+
+    def _matches(self, criteria, seq, message):
+        criteria = list(criteria)
+        while criteria:
+            key = criteria.pop(0)
+            if isinstance(key, list):
+                if not self._matches(key, seq, message):
+                    return False
+                continue
+            key = str(key).upper()
+            if key == "ALL":
+                continue
+            if key in ("SEEN", "UNSEEN", "DELETED", "UNDELETED", "FLAGGED", "UNFLAGGED", "ANSWERED", "UNANSWERED"):
+                flag = "\\" + key.replace("UN", "", 1).capitalize() if key.startswith("UN") else "\\" + key.capitalize()
+                if (flag in message.flags) == key.startswith("UN"):
+                    return False
+            elif key == "NOT":
+                if self._matches([criteria.pop(0)], seq, message):
+                    return False
+            elif key == "UID":
+                if not any(lo <= message.uid <= hi for lo, hi in parse_set(str(criteria.pop(0)), self.mailbox.uidnext - 1)):
+                    return False
+            elif key in ("FROM", "TO", "CC", "SUBJECT"):
+                if str(criteria.pop(0)).lower() not in str(message.headers.get(key, "")).lower():
+                    return False
+            elif key == "HEADER":
+                name, value = str(criteria.pop(0)), str(criteria.pop(0))
+                if value.lower() not in str(message.headers.get(name, "")).lower():
+                    return False
+            elif key == "MODSEQ":
+                if message.modseq < int(criteria.pop(0)):
+                    return False
+            elif key[:1].isdigit() or key[:1] == "*":
+                if not any(lo <= seq <= hi for lo, hi in parse_set(key, len(self.mailbox.messages))):
+                    return False
+            else:
+                raise IMAPError("BAD", f"Unsupported search key {key}")
+        return True
+
+    async def cmd_SEARCH(self, args):
+        await self._search(args, uid=False)
+
+    async def cmd_UID_SEARCH(self, args):
+        await self._search(args, uid=True)
+
+    def _fetch_item(self, item, message):
+        """Render one FETCH data item; returns (bytes, marks_seen)"""
+        name = item.upper()
+        if name == "UID":
+            return f"UID {message.uid}".encode(), False
+        if name == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(message.flags))})".encode(), False
+        if name == "INTERNALDATE":
+            stamp = time.strftime("%d-%b-%Y %H:%M:%S +0000", time.gmtime(message.internaldate))
+            return f'INTERNALDATE "{stamp}"'.encode(), False
+        if name == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(message.data)}".encode(), False
+        if name == "MODSEQ":
+            return f"MODSEQ ({message.modseq})".encode(), False
+        if name == "ENVELOPE":
+            return f"ENVELOPE {envelope(message)}".encode(), False
+        if name in ("BODYSTRUCTURE", "BODY"):
+            return f"{name} {bodystructure(message.parsed)}".encode(), False
+        if name in ("RFC822", "RFC822.HEADER", "RFC822.TEXT"):
+            content = {"RFC822": message.data, "RFC822.HEADER": message.header_bytes,
+                       "RFC822.TEXT": message.text_bytes}[name]
+            return f"{name} {{{len(content)}}}\r\n".encode() + content, name != "RFC822.HEADER"
+
+        match = _BODY_SECTION.match(item)
+        if not match:
+            raise IMAPError("BAD", f"Unsupported FETCH item {item}")
+        peek, section, origin, length = match.groups()
+        upper = section.upper()
+        if not section:
+            content = message.data
+        elif upper == "HEADER":
+            content = message.header_bytes
+        elif upper == "TEXT":
+            content = message.text_bytes
+        elif upper.startswith("HEADER.FIELDS"):
+            fields = tokenize([section[section.index("("):]])[0]
+            content = _header_fields(message, fields, upper.startswith("HEADER.FIELDS.NOT"))
+        elif section.replace(".", "").isdigit():
+            part = message.parsed
+            for index in section.split("."):
+                part = part.get_payload(int(index) - 1) if part.is_multipart() else part
+            payload = part.get_payload()
+            content = payload.encode("utf-8", "replace") if isinstance(payload, str) else b""
+        else:
+            raise IMAPError("BAD", f"Unsupported section {section}")
+        label = f"BODY[{section}]"
+        if origin is not None:
+            start = int(origin)
+            content = content[start:start + int(length)] if length else content[start:]
+            label += f"<{start}>"
+        return f"{label} {{{len(content)}}}\r\n".encode() + content, not peek
+
+    async def _fetch(self, args, uid):
+        self._require_selected()
+        if len(args) < 2:
+            raise IMAPError("BAD", "FETCH expects a set and items")
+        items = args[1] if isinstance(args[1], list) else [args[1]]
+        items = [str(i) for i in items]
+        items = [expanded for i in items for expanded in _FETCH_MACROS.get(i.upper(), [i])]
+        changed_since = None
+        if len(args) > 2 and isinstance(args[2], list) and len(args[2]) == 2 and str(args[2][0]).upper() == "CHANGEDSINCE":
+            changed_since = int(args[2][1])
+            self.condstore = True
+        if uid and "UID" not in (i.upper() for i in items):
+            items.insert(0, "UID")
+        if self.condstore and "MODSEQ" not in (i.upper() for i in items):
+            items.append("MODSEQ")
+
+        for seq, message in self._select_messages(str(args[0]), uid):
+            if changed_since is not None and message.modseq <= changed_since:
+                continue
+            rendered, seen = [], False
+            for item in items:
+                data, marks_seen = self._fetch_item(item, message)
+                rendered.append(data)
+                seen = seen or marks_seen
+            if seen and not self.readonly and "\\Seen" not in message.flags:
+                message.flags.add("\\Seen")
+                self.mailbox.touch(message)
+                if "FLAGS" not in (i.upper() for i in items):
+                    rendered.append(self._fetch_item("FLAGS", message)[0])
+            self.send(f"* {seq} FETCH (".encode() + b" ".join(rendered) + b")\r\n")
+
+    async def cmd_FETCH(self, args):
+        await self._fetch(args, uid=False)
+
+    async def cmd_UID_FETCH(self, args):
+        await self._fetch(args, uid=True)
+
+    async def _store(self, args, uid):
+        self._require_selected()
+        if self.readonly:
+            raise IMAPError("NO", "Mailbox is read-only")
+        if len(args) < 3:
+            raise IMAPError("BAD", "STORE expects a set, an item and flags")
+        if isinstance(args[1], list):  # (UNCHANGEDSINCE n) is accepted and ignored
+            args = [args[0]] + args[2:]
+        operation = str(args[1]).upper()
+        flags = args[2] if isinstance(args[2], list) else args[2:]
+        flags = {str(flag) for flag in flags}
+        silent = operation.endswith(".SILENT")
+        operation = operation.replace(".SILENT", "")
+        if operation not in ("FLAGS", "+FLAGS", "-FLAGS"):
+            raise IMAPError("BAD", f"Unsupported STORE item {operation}")
+        for seq, message in self._select_messages(str(args[0]), uid):
+            if operation == "FLAGS":
+                message.flags = set(flags)
+            elif operation == "+FLAGS":
+                message.flags |= flags
+            else:
+                message.flags -= flags
+            self.mailbox.touch(message)
+            if not silent:
+                items = ["UID", "FLAGS"] if uid else ["FLAGS"]
+                if self.condstore:
+                    items.append("MODSEQ")
+                rendered = b" ".join(self._fetch_item(item, message)[0] for item in items)
+                self.send(f"* {seq} FETCH (".encode() + rendered + b")\r\n")
+
+    async def cmd_STORE(self, args):
+        await self._store(args, uid=False)
+
+    async def cmd_UID_STORE(self, args):
+        await self._store(args, uid=True)
+
+
+class IMAPServer:
+    """Accepts IMAP connections against a MailStore"""
+
+    def __init__(self, store, tls_context=None):
+        self.store = store
+        self.tls_context = tls_context
+
+    async def handle(self, reader, writer):
+        self.store.stats["imap_sessions"] += 1
+        connection = IMAPConnection(self, reader, writer)
+        try:
+            await connection.run()
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args, ready=None):
+    """Run the SMTP and IMAP listeners until cancelled"""
+    store = MailStore(max_messages=args.max_messages)
+    tls_context = None if args.no_tls else create_tls_context(args.cert_dir)
+    smtp = SMTPServer(store, tls_context, require_auth=not args.no_auth, size_limit=args.message_size_limit,
+                      connection_rate_limit=args.connection_rate_limit, message_rate_limit=args.message_rate_limit,
+                      reject_test_signatures=args.reject_test_signatures)
+    mx = SMTPServer(store, tls_context, require_auth=False, size_limit=args.message_size_limit,
+                    connection_rate_limit=args.connection_rate_limit, message_rate_limit=args.message_rate_limit,
+                    reject_test_signatures=args.reject_test_signatures, offer_auth=False, greylist=args.greylist)
+    imap = IMAPServer(store, tls_context)
+    options = {"limit": STREAM_LIMIT, "reuse_port": args.processes > 1, "backlog": 1024}
+
+    servers = [
+        await asyncio.start_server(smtp.handle, args.host, args.smtp_port, **options),
+        await asyncio.start_server(mx.handle, args.host, args.mx_port, **options),
+        await asyncio.start_server(imap.handle, args.host, args.imap_port, **options),
+    ]
+    if tls_context is not None:
+        servers.append(await asyncio.start_server(
+            imap.handle, args.host, args.imaps_port, ssl=tls_context, **options))
+    logger.info(
+        f"[{os.getpid()}] stand-in listening on {args.host}: SMTP {args.smtp_port}, MX {args.mx_port}, "
+        f"IMAP {args.imap_port}"
+        + (f", IMAPS {args.imaps_port}" if tls_context is not None else "")
+    )
+    if ready is not None:
+        ready()
+
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval or 3600)
+            if args.stats_interval:
+                logger.info(f"[{os.getpid()}] {store.stats}")
+    finally:
+        for server in servers:
+            server.close()
+        logger.info(f"[{os.getpid()}] final {store.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP/IMAP stand-in target for the load test harness")
+    parser.add_argument("--host", default=STANDIN_HOST)
+    parser.add_argument("--smtp-port", type=int, default=STANDIN_SMTP_PORT)
+    parser.add_argument("--mx-port", type=int, default=STANDIN_MX_PORT, help="unauthenticated SMTP, like port 25")
+    parser.add_argument("--imap-port", type=int, default=STANDIN_IMAP_PORT)
+    parser.add_argument("--imaps-port", type=int, default=STANDIN_IMAPS_PORT)
+    parser.add_argument("--cert-dir", default="test_data/standin")
+    parser.add_argument("--no-tls", action="store_true", help="do not offer STARTTLS or implicit TLS")
+    parser.add_argument("--no-auth", action="store_true", help="accept MAIL without AUTH")
+    parser.add_argument("--max-messages", type=int, default=1000, help="messages kept per mailbox")
+    parser.add_argument("--message-size-limit", type=int, default=MAX_MESSAGE_SIZE,
+                        help=f"bytes, like Postfix message_size_limit (at most {MAX_MESSAGE_SIZE})")
+    parser.add_argument("--connection-rate-limit", type=int, default=0,
+                        help="SMTP connections per client and minute before 421 (0: unlimited)")
+    parser.add_argument("--message-rate-limit", type=int, default=0,
+                        help="MAIL FROM per client and minute before 450 (0: unlimited)")
+    parser.add_argument("--reject-test-signatures", action="store_true",
+                        help="reject GTUBE and EICAR messages with 554, like rspamd/ClamAV")
+    parser.add_argument("--greylist", type=float, default=0,
+                        help="on the MX port, defer new client/sender/recipient triplets for N seconds")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="server processes sharing the ports (SO_REUSEPORT); each has its own store")
+    parser.add_argument("--stats-interval", type=float, default=0, help="log counters every N seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.processes > 1 and not args.no_tls:
+        create_tls_context(args.cert_dir)  # create the certificate once, before forking
+
+    children = []
+    for _ in range(args.processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = None
+            break
+        children.append(pid)
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        asyncio.run(serve(args))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in children or ():
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# throttle.py - Closed-loop adaptive throttling of SMTP connections and messages
+#
+# Postfix answers smtpd_client_connection_rate_limit with "421 4.7.0 Error: too many
+# connections" and smtpd_client_message_rate_limit with "450 4.7.1 Error: too much
+# mail", counted per client address over anvil_rate_time_unit. Without feedback the
+# suite keeps opening connections that are bound to be rejected, and the send rate
+# it reports says more about the retry storm than about the server.
+#
+# With THROTTLE_ENABLED each worker paces new SMTP connections and messages through
+# two token buckets. Their rates follow AIMD, as in TCP congestion control:
+#
+#   - the rate grows by THROTTLE_INCREASE times its starting rate per second, but
+#     only while the bucket is the bottleneck (some user had to wait, so an idle
+#     bucket does not grow unbounded) and once something was accepted since the
+#     last cut
+#   - a 421/450-style rate-limit reply or any other 4xx cuts the rate by
+#     THROTTLE_DECREASE, at most once per THROTTLE_DECREASE_INTERVAL. anvil counts
+#     attempts over a sliding anvil_rate_time_unit (60s in Silver), so rejections
+#     keep arriving for up to that long after the rate was cut; reacting to each
+#     of them would collapse the rate to THROTTLE_MIN_RATE
+#
+# so the offered load settles just under the server's limits and send_* counts
+# measure the accepted throughput under the production rate-limit configuration.
+# Starting rates are per second across all workers (split evenly, like the arrival
+# rates in arrival_scheduler.py); the Silver defaults of 10 connections and 100
+# messages per minute are 0.17/s and 1.67/s.
+#
+# Every token taken is reported as "THROTTLE smtp.connect" or "THROTTLE
+# smtp.message": the response time is how long the user waited for the token and
+# the response length is the currently allowed rate per minute, so Locust's
+# "Average size" column shows the mean allowed rate.
+#
+import time
+import smtplib
+import logging
+import threading
+
+import gevent
+from locust import events
+
+from config import EmailServerConfig
+from user_manager import worker_position
+
+logger = logging.getLogger(__name__)
+
+
+class AIMDBucket:
+    """Token bucket whose rate adapts additively up and multiplicatively down"""
+
+    def __init__(self, name, rate, min_rate, max_rate, increase, decrease, decrease_interval, burst_seconds=1.0):
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase * rate  # rate added per second while rate-bound
+        self.decrease = decrease
+        self.decrease_interval = decrease_interval
+        self.burst_seconds = burst_seconds
+        self.tokens = self.capacity
+        self.updated = self.last_increase = time.monotonic()
+        self.last_decrease = None
+        self.waited = False  # some caller had to wait since the last increase
+        self.accepted = True  # something got through since the last decrease
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return max(1.0, self.rate * self.burst_seconds)
+
+    def try_take(self, tokens=1, now=None):
+        """Take tokens if available; otherwise returns the seconds until they should be.
+
+        Waiters retry instead of reserving a future slot, so a rate cut also slows
+        down users that are already waiting. A request for more tokens than the
+        bucket holds (a bulk send) goes through once it is full and leaves a debt.
+        """
+        now = now or time.monotonic()
+        with self._lock:
+            self._grow(now)
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            needed = min(tokens, self.capacity)
+            if self.tokens >= needed:
+                self.tokens -= tokens
+                return 0.0
+            self.waited = True
+            return (needed - self.tokens) / self.rate
+
+    def _grow(self, now):
+        """Additive increase, at most once a second and only while rate-bound"""
+        elapsed = now - self.last_increase
+        if elapsed < 1.0:
+            return
+        if self.waited and self.accepted:
+            self.rate = min(self.max_rate, self.rate + self.increase * elapsed)
+        self.last_increase = now
+        self.waited = False
+
+    def on_success(self):
+        """Something got through; allow the rate to grow again"""
+        self.accepted = True
+
+    def on_limit(self, now=None):
+        """Multiplicative decrease; returns True if the rate was cut"""
+        now = now or time.monotonic()
+        with self._lock:
+            if self.last_decrease is not None and now - self.last_decrease < self.decrease_interval:
+                return False
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)  # no burst straight back into the limit
+            self.last_decrease = self.last_increase = now
+            self.waited = self.accepted = False
+        logger.info(f"Throttle: {self.name} rate limited, allowing {self.rate * 60:.1f}/min")
+        return True
+
+
+def smtp_codes(exception):
+    """SMTP reply codes carried by an smtplib exception"""
+    if isinstance(exception, smtplib.SMTPRecipientsRefused):
+        return [code for code, _ in exception.recipients.values()]
+    code = getattr(exception, "smtp_code", None)
+    if code is None and isinstance(exception, smtplib.SMTPConnectError) and exception.args:
+        code = exception.args[0]
+    return [code] if isinstance(code, int) else []
+
+
+def is_backoff_signal(exception):
+    """True for rate-limit replies and other temporary (4xx) failures"""
+    text = str(exception).lower()
+    if "421" in text or "too many" in text or "too much mail" in text:
+        return True
+    return any(400 <= code < 500 for code in smtp_codes(exception))
+
+
+class AdaptiveThrottle:
+    """Per-worker pacing of new SMTP connections and messages"""
+
+    def __init__(self, environment, connect_rate, message_rate, config=EmailServerConfig):
+        self.environment = environment
+        self.buckets = {
+            kind: AIMDBucket(
+                f"smtp.{kind}", rate, config.THROTTLE_MIN_RATE, config.THROTTLE_MAX_RATE,
+                config.THROTTLE_INCREASE, config.THROTTLE_DECREASE, config.THROTTLE_DECREASE_INTERVAL
+            )
+            for kind, rate in (("connect", connect_rate), ("message", message_rate))
+        }
+
+    def allowed_rate(self, kind):
+        """Currently allowed rate of kind per second"""
+        return self.buckets[kind].rate
+
+    def wait(self, kind, tokens=1):
+        """Block the calling user until tokens of kind may be used"""
+        bucket = self.buckets[kind]
+        start_time = time.monotonic()
+        delay = bucket.try_take(tokens)
+        while delay > 0:
+            gevent.sleep(delay)
+            delay = bucket.try_take(tokens)
+        self.environment.events.request.fire(
+            request_type="THROTTLE",
+            name=bucket.name,
+            response_time=(time.monotonic() - start_time) * 1000,
+            response_length=int(round(bucket.rate * 60)),
+            exception=None
+        )
+
+    def feedback(self, kind, exception=None):
+        """Adapt kind's rate to the outcome of one connection or send"""
+        if exception is None:
+            self.buckets[kind].on_success()
+        elif is_backoff_signal(exception):
+            self.buckets[kind].on_limit()
+
+
+_shared_throttle = None
+_shared_throttle_lock = threading.Lock()
+
+
+@events.test_start.add_listener
+def _reset_throttle(**kwargs):
+    """Start every run (including restarts from the web UI) from the configured rates"""
+    global _shared_throttle
+    with _shared_throttle_lock:
+        _shared_throttle = None
+
+
+def get_throttle(environment):
+    """Return the AdaptiveThrottle shared by all SMTP users in this worker"""
+    global _shared_throttle
+    with _shared_throttle_lock:
+        if _shared_throttle is None:
+            _, worker_count = worker_position(environment)
+            config = EmailServerConfig
+            _shared_throttle = AdaptiveThrottle(
+                environment,
+                config.THROTTLE_CONNECT_RATE / worker_count,
+                config.THROTTLE_MESSAGE_RATE / worker_count,
+            )
+            logger.info(
+                f"Throttle: starting at {config.THROTTLE_CONNECT_RATE / worker_count * 60:.1f} connections/min "
+                f"and {config.THROTTLE_MESSAGE_RATE / worker_count * 60:.1f} messages/min per worker"
+            )
+    return _shared_throttle
@@ -0,0 +1,82 @@
+# tls_context.py - Shared client TLS context and session resumption
+#
+# Building an SSLContext loads the default CA store, so doing it for every
+# connection costs client CPU for nothing. All users in a worker share one context.
+#
+# Real clients also resume TLS sessions (tickets or session IDs) when they
+# reconnect, which is far cheaper for the server than a full handshake. With
+# TLS_SESSION_RESUMPTION enabled each simulated user keeps the last session per
+# server endpoint in a TLSSessionCache and offers it on the next connection. The
+# handshake is reported as connect.tls_full or connect.tls_resumed, depending on
+# whether the server accepted the session, so Postfix and Raven TLS capacity can be
+# sized for both cases.
+#
+import ssl
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def create_client_context():
+    """Permissive client context: TLS 1.2+, self-signed test certificates accepted"""
+    context = ssl.create_default_context()
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+_shared_context = None
+_shared_context_lock = threading.Lock()
+
+
+def get_client_context():
+    """Return the client TLS context shared by all users in this process"""
+    global _shared_context
+    if _shared_context is None:
+        with _shared_context_lock:
+            if _shared_context is None:
+                _shared_context = create_client_context()
+    return _shared_context
+
+
+class _ResumingContext:
+    """Offers a saved session to wrap_socket(), the only method smtplib and imaplib call"""
+
+    def __init__(self, context, session):
+        self._context = context
+        self._session = session
+
+    def wrap_socket(self, sock, **kwargs):
+        return self._context.wrap_socket(sock, session=self._session, **kwargs)
+
+
+def with_session(context, session):
+    """Context whose handshakes try to resume session (context itself if session is None)"""
+    return _ResumingContext(context, session) if session is not None else context
+
+
+def handshake_phase(sock):
+    """Phase name for a completed handshake: connect.tls_full or connect.tls_resumed"""
+    return "connect.tls_resumed" if getattr(sock, "session_reused", False) else "connect.tls_full"
+
+
+class TLSSessionCache:
+    """TLS sessions of one simulated client, keyed by server endpoint"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._sessions = {}
+
+    def get(self, host, port):
+        """Session to offer when connecting to host:port, or None"""
+        if not self.enabled:
+            return None
+        return self._sessions.get((host, port))
+
+    def save(self, host, port, sock):
+        """Remember the session of an established TLS connection"""
+        session = getattr(sock, "session", None) if self.enabled else None
+        if session is not None:
+            self._sessions[(host, port)] = session
@@ -1,9 +1,20 @@
 # user_manager.py - Test user account management
 import os
 import csv
+import bisect
 import random
+import logging
+import itertools
+import threading
+from collections import namedtuple
 from faker import Faker
-from config import MAIL_DOMAIN
+from config import MAIL_DOMAIN, EmailServerConfig
+
+logger = logging.getLogger(__name__)
+
+
+# Immutable, compact user record (a tuple, not a dict per user)
+TestUser = namedtuple('TestUser', ['username', 'email', 'password', 'full_name'], defaults=('',))
 
 
 class TestUserManager:
@@ -15,29 +26,38 @@ class TestUserManager:
     
     def _load_users(self):
         """Load test users from CSV file"""
-        users = []
         if os.path.exists(self.users_file):
             with open(self.users_file, 'r') as f:
                 reader = csv.DictReader(f)
-                users = list(reader)
+                users = [self._to_user(row) for row in reader]
         else:
             # Create sample users if file doesn't exist
             users = self._create_sample_users()
             self._save_users(users)
         
-        return users
+        return tuple(users)
+    
+    @staticmethod
+    def _to_user(row):
+        """Convert a CSV row to a TestUser (extra columns are ignored)"""
+        return TestUser(
+            username=row['username'],
+            email=row['email'],
+            password=row['password'],
+            full_name=row.get('full_name') or ''
+        )
     
     def _create_sample_users(self):
         """Create sample test users"""
         fake = Faker()
         users = []
         for i in range(100):
-            users.append({
-                'username': f'testuser{i:03d}',
-                'email': f'testuser{i:03d}@{MAIL_DOMAIN}',
-                'password': 'TestPassword123!',
-                'full_name': fake.name()
-            })
+            users.append(TestUser(
+                username=f'testuser{i:03d}',
+                email=f'testuser{i:03d}@{MAIL_DOMAIN}',
+                password='TestPassword123!',
+                full_name=fake.name()
+            ))
         return users
     
     def _save_users(self, users):
@@ -45,10 +65,294 @@ class TestUserManager:
         os.makedirs(os.path.dirname(self.users_file), exist_ok=True)
         with open(self.users_file, 'w', newline='') as f:
             if users:
-                writer = csv.DictWriter(f, fieldnames=users[0].keys())
-                writer.writeheader()
+                writer = csv.writer(f)
+                writer.writerow(TestUser._fields)
                 writer.writerows(users)
     
     def get_random_user(self):
         """Get a random test user"""
         return random.choice(self.users)
+
+
+_shared_managers = {}
+_shared_managers_lock = threading.Lock()
+
+
+def get_user_manager(users_file="test_data/users.csv"):
+    """Return the TestUserManager shared by all users in this process"""
+    manager = _shared_managers.get(users_file)
+    if manager is None:
+        with _shared_managers_lock:
+            manager = _shared_managers.get(users_file)
+            if manager is None:
+                manager = TestUserManager(users_file)
+                _shared_managers[users_file] = manager
+    return manager
+
+
+class AccountPartition:
+    """Deterministic, disjoint slice of the test accounts for one worker process.
+    
+    Worker i of n gets every n-th account starting at i, and each user spawned in
+    the worker takes the next account of that slice, so no two simulated users log
+    in as the same account until a worker has more users than accounts.
+    """
+    
+    def __init__(self, users, worker_index=0, worker_count=1, seed=None):
+        self.worker_index = worker_index
+        self.worker_count = max(1, worker_count)
+        self.seed = seed
+        self.accounts = users[worker_index::self.worker_count] or users
+        self._slots = itertools.count()
+    
+    def next_slot(self):
+        """Index of the next user spawned in this worker"""
+        slot = next(self._slots)
+        if slot == len(self.accounts):
+            logger.warning(
+                f"Worker {self.worker_index} has more users than its {len(self.accounts)} accounts; "
+                f"accounts will be shared"
+            )
+        return slot
+    
+    def account_for(self, slot):
+        """Sender account for a user slot"""
+        return self.accounts[slot % len(self.accounts)]
+    
+    def rng_for(self, slot):
+        """Random generator for a user slot, reproducible when a seed is set"""
+        if self.seed is None:
+            return random.Random()
+        return random.Random(f"{self.seed}:{self.worker_index}:{slot}")
+
+
+def parse_fanout(spec, name="RECIPIENT_FANOUT"):
+    """Parse RECIPIENT_FANOUT (or another setting named name), e.g. "1:70,2-5:20,6-20:9,100-300:1".
+
+    Returns [(low, high, weight), ...]; a bare "n" or "n-m" has weight 1.
+    """
+    classes = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        counts, _, weight = item.partition(":")
+        low, _, high = counts.partition("-")
+        low, high = int(low), int(high or low)
+        if low < 1 or high < low:
+            raise ValueError(f"Invalid count range '{counts}' in {name}")
+        classes.append((low, high, float(weight or 1)))
+    if not classes:
+        raise ValueError(f"{name} is empty")
+    return classes
+
+
+def fanout_bucket(count, bounds):
+    """Stats label of a recipient count for upper bounds like (1, 2, 5, 20, 100)"""
+    low = 1
+    for bound in bounds:
+        if count <= bound:
+            return str(bound) if low == bound else f"{low}-{bound}"
+        low = bound + 1
+    return f"{low}+"
+
+
+class MessageRecipients(namedtuple('MessageRecipients', ['to', 'cc', 'bcc'])):
+    """Header and envelope recipients of one message (lists of addresses).
+
+    Bcc recipients are only in the envelope. A distribution-list send has every
+    recipient in bcc and the group "undisclosed-recipients:;" as its To header.
+    """
+    __slots__ = ()
+    
+    @property
+    def envelope(self):
+        """All RCPT TO addresses"""
+        return [address for address in itertools.chain(self.to, self.cc, self.bcc) if "@" in address]
+
+
+_zipf_weights = {}
+_zipf_weights_lock = threading.Lock()
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative Zipf weights of ranks 1..count, shared per worker"""
+    key = (count, exponent)
+    weights = _zipf_weights.get(key)
+    if weights is None:
+        with _zipf_weights_lock:
+            weights = _zipf_weights.get(key)
+            if weights is None:
+                weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+                _zipf_weights[key] = weights
+    return weights
+
+
+class RecipientPicker:
+    """Choose recipients from a configurable distribution.
+    
+    uniform    - any test account, uniformly at random (default)
+    partition  - accounts of this worker's partition only
+    sequential - round-robin over all accounts, starting at a per-user offset
+    zipf       - account k of users.csv with probability ~ 1/k^RECIPIENT_ZIPF_EXPONENT
+    hotspot    - RECIPIENT_HOTSPOT_SHARE of the mail to the first
+                 RECIPIENT_HOTSPOT_ACCOUNTS accounts, the rest uniformly
+    
+    pick_message() also draws the number of recipients from RECIPIENT_FANOUT and
+    splits them into To, Cc and Bcc.
+    """
+    
+    MODES = ("uniform", "partition", "sequential", "zipf", "hotspot")
+    
+    def __init__(self, users, partition_accounts, mode="uniform", rng=None, config=EmailServerConfig):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown recipient distribution '{mode}', expected one of {self.MODES}")
+        self.users = users
+        self.partition_accounts = partition_accounts
+        self.mode = mode
+        self.rng = rng or random.Random()
+        self._next = self.rng.randrange(len(users)) if users else 0
+        if mode == "zipf":
+            self._cum_weights = zipf_cum_weights(len(users), config.RECIPIENT_ZIPF_EXPONENT)
+        self.hot_accounts = max(1, min(config.RECIPIENT_HOTSPOT_ACCOUNTS, len(users)))
+        self.hot_share = config.RECIPIENT_HOTSPOT_SHARE
+        self.fanout = parse_fanout(config.RECIPIENT_FANOUT)
+        self._fanout_weights = list(itertools.accumulate(weight for _, _, weight in self.fanout))
+        self.max_fanout = max(high for _, high, _ in self.fanout)
+        self.cc_share = config.RECIPIENT_CC_SHARE
+        self.bcc_share = config.RECIPIENT_BCC_SHARE
+        self.list_threshold = config.RECIPIENT_LIST_THRESHOLD
+    
+    def pick(self):
+        """Return the next recipient"""
+        if self.mode == "partition":
+            return self.rng.choice(self.partition_accounts)
+        if self.mode == "sequential":
+            user = self.users[self._next % len(self.users)]
+            self._next += 1
+            return user
+        if self.mode == "zipf":
+            weights = self._cum_weights
+            return self.users[bisect.bisect(weights, self.rng.random() * weights[-1], 0, len(weights) - 1)]
+        if self.mode == "hotspot" and self.rng.random() < self.hot_share:
+            return self.users[self.rng.randrange(self.hot_accounts)]
+        return self.rng.choice(self.users)
+    
+    def pick_many(self, count):
+        """Return count distinct recipients (fewer only if there are fewer accounts)"""
+        pool = self.partition_accounts if self.mode == "partition" else self.users
+        count = min(count, len(pool))
+        chosen = {}
+        attempts = 0
+        while len(chosen) < count and attempts < count * 10:
+            user = self.pick()
+            chosen[user.email] = user
+            attempts += 1
+        if len(chosen) < count:
+            # Skewed distributions rarely reach the cold accounts; fill up uniformly
+            for user in self.rng.sample(pool, len(pool)):
+                chosen.setdefault(user.email, user)
+                if len(chosen) == count:
+                    break
+        return list(chosen.values())
+    
+    def recipient_count(self):
+        """Draw a number of recipients from RECIPIENT_FANOUT"""
+        if self.max_fanout == 1:
+            return 1
+        index = bisect.bisect(self._fanout_weights, self.rng.random() * self._fanout_weights[-1],
+                              0, len(self._fanout_weights) - 1)
+        low, high, _ = self.fanout[index]
+        return self.rng.randint(low, high)
+    
+    def pick_message(self):
+        """Recipients of the next message: the first in To, the rest in To, Cc or Bcc"""
+        count = self.recipient_count()
+        if count == 1:
+            return MessageRecipients([self.pick().email], [], [])
+        addresses = [user.email for user in self.pick_many(count)]
+        if len(addresses) >= self.list_threshold:
+            return MessageRecipients(["undisclosed-recipients:;"], [], addresses)
+        to, cc, bcc = [addresses[0]], [], []
+        for address in addresses[1:]:
+            draw = self.rng.random()
+            if draw < self.cc_share:
+                cc.append(address)
+            elif draw < self.cc_share + self.bcc_share:
+                bcc.append(address)
+            else:
+                to.append(address)
+        return MessageRecipients(to, cc, bcc)
+
+
+_partition = None
+_partition_lock = threading.Lock()
+# Worker count announced by the master at test start (see register_partitioning)
+_announced_worker_count = None
+
+
+def register_partitioning(environment):
+    """Let the master tell every worker how many workers share the accounts"""
+    from locust.runners import MasterRunner, WorkerRunner
+    runner = environment.runner
+    if isinstance(runner, MasterRunner):
+        @environment.events.test_start.add_listener
+        def announce_worker_count(environment, **kwargs):
+            environment.runner.send_message("loadtest_partition", {"worker_count": environment.runner.worker_count})
+    elif isinstance(runner, WorkerRunner):
+        def on_partition_message(environment, msg, **kwargs):
+            global _announced_worker_count, _partition
+            with _partition_lock:
+                _announced_worker_count = msg.data["worker_count"]
+                _partition = None  # the next user repartitions with the new count
+        runner.register_message("loadtest_partition", on_partition_message)
+
+
+def worker_position(environment):
+    """(worker_index, worker_count) of this process in a distributed run"""
+    runner = getattr(environment, "runner", None)
+    worker_index = getattr(runner, "worker_index", 0) or 0
+    worker_count = EmailServerConfig.LOADTEST_WORKER_COUNT or _announced_worker_count or 1
+    return worker_index, max(worker_count, worker_index + 1)
+
+
+def get_partition(environment):
+    """Return this worker's account partition, creating it on first use"""
+    global _partition
+    if _partition is None:
+        with _partition_lock:
+            if _partition is None:
+                worker_index, worker_count = worker_position(environment)
+                seed = EmailServerConfig.LOADTEST_SEED
+                if seed is not None:
+                    # Make content and task selection reproducible per worker too
+                    random.seed(f"{seed}:{worker_index}")
+                    Faker.seed(f"{seed}:{worker_index}")
+                users = get_user_manager().users
+                _partition = AccountPartition(users, worker_index, worker_count, seed)
+                logger.info(
+                    f"Worker {worker_index}/{worker_count}: {len(_partition.accounts)} accounts"
+                    f"{'' if seed is None else f', seed {seed}'}"
+                )
+    return _partition
+
+
+def assign_account(environment):
+    """Pick the account, random generator and recipient picker for a new Locust user"""
+    manager = get_user_manager()
+    config = EmailServerConfig
+    if config.USER_PARTITIONING or config.LOADTEST_SEED is not None:
+        partition = get_partition(environment)
+        slot = partition.next_slot()
+        rng = partition.rng_for(slot)
+        if config.USER_PARTITIONING:
+            account = partition.account_for(slot)
+        else:
+            account = rng.choice(manager.users)
+        accounts = partition.accounts
+    else:
+        rng = random.Random()
+        account = manager.get_random_user()
+        accounts = manager.users
+    recipients = RecipientPicker(manager.users, accounts, config.RECIPIENT_DISTRIBUTION, rng)
+    return account, rng, recipients